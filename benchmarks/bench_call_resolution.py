@@ -0,0 +1,123 @@
+"""
+Benchmarks call resolution (buildCallflowDB) as the number of entities grows.
+
+Builds a synthetic Entities/EntityCallNames database and times the indexed resolver.  The old
+list scan + per-name SELECT resolver is timed alongside it for the smaller sizes.
+
+    python benchmarks/bench_call_resolution.py --sizes 1000,10000,100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tabulate import tabulate
+
+from pycallflow.callFlowData import callFlowData
+from pycallflow.analyzeCallFlow import buildCallflowDB, entitylists, getEntityCallNames, clearCallsFrom, findAllEntityIDWithName, addCallDBEntry
+
+
+def buildSyntheticDB(num_entities, names_per_entity, collision_rate, entities_per_file, seed):
+    """
+    Returns an in memory connection holding num_entities functions spread over files.
+    collision_rate of the entities reuse an existing name (the ambiguous calls case).
+    """
+    rng = random.Random(seed)
+    db_conn = callFlowData().getSqliteConnection()
+    db_cursor = db_conn.cursor()
+    names = []
+    files = []
+    file_names = set()
+    for n in range(num_entities):
+        if n % entities_per_file == 0:
+            db_cursor.execute("INSERT INTO Files (file_full_path, package_path) VALUES (?, ?);",
+                              (f"pkg/mod{n}.py", f"pkg.mod{n}"))
+            files.append(db_cursor.lastrowid)
+            file_names = set()
+        name = None
+        if names and rng.random() < collision_rate:
+            name = rng.choice(names)
+        if name is None or name in file_names:
+            # (entity_name, import_path) is unique, so collisions come from other files
+            name = f"func_{n}"
+            names.append(name)
+        file_names.add(name)
+        db_cursor.execute("""
+            INSERT INTO Entities (fileID, entity_name, entity_type, import_path)
+            VALUES (?, ?, 'function', ?);
+        """, (files[-1], name, f"pkg.mod{files[-1]}"))
+    # Most names an entity loads are locals, builtins and attributes that never match an entity
+    noise = [f"local_{n}" for n in range(200)] + ["self", "len", "print", "append", "db_cursor"]
+    rows = []
+    for entityID in range(1, num_entities + 1):
+        call_names = [rng.choice(names) if rng.random() < 0.2 else rng.choice(noise) for _ in range(names_per_entity)]
+        rows.append((entityID, json.dumps(call_names)))
+    db_cursor.executemany("INSERT INTO EntityCallNames (entityID, call_names) VALUES (?, ?);", rows)
+    db_conn.commit()
+    return db_conn
+
+
+def legacyBuildCallflowDB(db_conn, suppress_calls_to_init, match_to_file):
+    # The resolver as it was: 'in' on a list of names and a SELECT per matched name
+    entity_names, entity_data = entitylists(db_conn.cursor())
+    clearCallsFrom(db_conn.cursor())
+    for entityID, fileID, call_names in getEntityCallNames(db_conn.cursor()):
+        call_num = 0
+        for name in call_names:
+            if name in entity_names:
+                for id in findAllEntityIDWithName(db_conn.cursor(), name, fileID, match_to_file):
+                    addCallDBEntry(db_conn.cursor(), entityID, id, f"{entityID}.{call_num}")
+                call_num += 1
+    db_conn.commit()
+
+
+def timeResolver(resolver, db_conn, match_to_file):
+    start = time.perf_counter()
+    resolver(db_conn, False, match_to_file)
+    elapsed = time.perf_counter() - start
+    calls = db_conn.execute("SELECT count(*) FROM Calls;").fetchone()[0]
+    return elapsed, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Call resolution scaling benchmark")
+    parser.add_argument("--sizes", type=str, default="1000,3000,10000,30000,100000", help="Comma separated entity counts")
+    parser.add_argument("--names_per_entity", type=int, default=60, help="Names each entity's bytecode loads")
+    parser.add_argument("--collision_rate", type=float, default=0.1, help="Fraction of entities that reuse a name")
+    parser.add_argument("--entities_per_file", type=int, default=25)
+    parser.add_argument("--legacy_max", type=int, default=10000, help="Largest size to also time the old resolver at")
+    parser.add_argument("--match_to_file", action="store_true")
+    parser.add_argument("--json", action="store_true", help="Emit JSON instead of a table")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        db_conn = buildSyntheticDB(size, args.names_per_entity, args.collision_rate, args.entities_per_file, args.seed)
+        indexed_s, calls = timeResolver(buildCallflowDB, db_conn, args.match_to_file)
+        legacy_s = None
+        if size <= args.legacy_max:
+            legacy_s, legacy_calls = timeResolver(legacyBuildCallflowDB, db_conn, args.match_to_file)
+            if legacy_calls != calls:
+                print(f"Resolvers disagree at {size} entities: {legacy_calls} vs {calls}", file=sys.stderr)
+        results.append({
+            "entities": size,
+            "names_scanned": size * args.names_per_entity,
+            "calls": calls,
+            "indexed_s": round(indexed_s, 4),
+            "legacy_s": None if legacy_s is None else round(legacy_s, 4),
+        })
+        db_conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(tabulate(results, headers="keys", tablefmt="github"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Benchmarks every phase of the pipeline against synthetic packages of growing size.
+
+Generates a package with the requested number of files, classes, methods and functions, where
+collision_rate of the names are shared between files (ambiguous calls) and each function or
+method references calls_per_function other entities.  Each phase is timed separately and the
+results are written as JSON, so two runs can be compared to catch scaling regressions.
+peak_rss_mb is the process high water mark once the phase is done; --trace_memory adds the peak
+of each phase on its own.
+
+    python benchmarks/bench_pipeline.py --files 10,100,1000 --output results.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pycallflow.__about__ import __version__
+from pycallflow.callFlowData import callFlowData
+from pycallflow.buildFileDB import buildFileDB
+from pycallflow.buildDeclaredEntitiesDB import findDeclaredEntities_inlineSave
+from pycallflow.staticAnalysis import findDeclaredEntities_static
+from pycallflow.analyzeCallFlow import buildCallflowDB
+from pycallflow.finalResults import generateEntityResults_selectID_object
+from pycallflow.output import pydot_output
+
+DOT_OPTIONS = {
+    "rankdir": "LR",
+    "edge_color": "rotate",
+    "suppress_recursive_calls": False,
+    "combine_calls": False,
+    "suppress_class_references": False,
+    "suppress_calls_to_init": False,
+}
+
+
+def generatePackage(root, package_name, num_files, classes_per_file, methods_per_class, functions_per_file,
+                    collision_rate, calls_per_function, rng):
+    """
+    Writes a synthetic package under root.  Nothing in it is ever called, so the bodies only
+    need to reference names, not work.
+    """
+    shared_names = [f"shared_{n}" for n in range(max(1, int(1 / max(collision_rate, 0.001))))]
+    unique = iter(range(sys.maxsize))
+
+    def pickName(used):
+        if rng.random() < collision_rate:
+            name = rng.choice(shared_names)
+            if name not in used:
+                used.add(name)
+                return name
+        name = f"entity_{next(unique)}"
+        used.add(name)
+        return name
+
+    # First pass names everything, so bodies can reference entities in any file
+    layout = []
+    function_names = []
+    method_names = []
+    for f in range(num_files):
+        used = set()
+        functions = [pickName(used) for _ in range(functions_per_file)]
+        classes = []
+        for c in range(classes_per_file):
+            methods = [pickName(set()) for _ in range(methods_per_class)]
+            classes.append((f"Class_{f}_{c}", methods))
+            method_names += methods
+        function_names += functions
+        layout.append((f"module_{f}", functions, classes))
+
+    def body(indent):
+        lines = []
+        for _ in range(calls_per_function):
+            if method_names and rng.random() < 0.5:
+                lines.append(f"{indent}obj.{rng.choice(method_names)}()")
+            elif function_names:
+                lines.append(f"{indent}{rng.choice(function_names)}()")
+        return "\n".join(lines or [f"{indent}pass"])
+
+    package_dir = os.path.join(root, package_name)
+    os.makedirs(package_dir)
+    open(os.path.join(package_dir, "__init__.py"), "w").close()
+    for module_name, functions, classes in layout:
+        source = []
+        for name in functions:
+            source.append(f"def {name}(obj):\n{body('    ')}\n")
+        for class_name, methods in classes:
+            source.append(f"class {class_name}:")
+            for name in methods:
+                source.append(f"    def {name}(self, obj):\n{body('        ')}\n")
+        with open(os.path.join(package_dir, f"{module_name}.py"), "w") as module_f:
+            module_f.write("\n".join(source))
+    return package_dir
+
+
+def timePhase(name, phases, trace_memory, func, *args, **kwargs):
+    if trace_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = func(*args, **kwargs)
+    phases[name] = {
+        "wall_s": round(time.perf_counter() - wall_start, 4),
+        "cpu_s": round(time.process_time() - cpu_start, 4),
+        # ru_maxrss is KB on Linux, bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+    if trace_memory:
+        phases[name]["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+    return result
+
+
+def runPipeline(root, num_files, args, rng):
+    package_name = f"synth_{num_files}_{args.seed}"
+    generatePackage(root, package_name, num_files, args.classes_per_file, args.methods_per_class,
+                    args.functions_per_file, args.collision_rate, args.calls_per_function, rng)
+    target_object = importlib.import_module(package_name)
+    cf_data = callFlowData()
+    db_conn = cf_data.getSqliteConnection()
+    findDeclaredEntities = findDeclaredEntities_static if args.static else findDeclaredEntities_inlineSave
+
+    phases = {}
+    timePhase("buildFileDB", phases, args.trace_memory, buildFileDB, target_object, db_conn)
+    timePhase(findDeclaredEntities.__name__, phases, args.trace_memory, findDeclaredEntities, db_conn)
+    timePhase("buildCallflowDB", phases, args.trace_memory, buildCallflowDB, db_conn, False, False)
+    results = timePhase("generateEntityResults_selectID_object", phases, args.trace_memory,
+                        generateEntityResults_selectID_object, db_conn, None)
+    # A single entity trace from the middle of the package
+    select_id = str(list(results.keys())[len(results) // 2])
+    timePhase("generateEntityResults_selectID_object[select]", phases, args.trace_memory,
+              generateEntityResults_selectID_object, db_conn, select_id)
+    timePhase("pydot_output.output", phases, args.trace_memory,
+              pydot_output().output, results, output_to_stdout=False, **DOT_OPTIONS)
+
+    counts = {
+        "files": db_conn.execute("SELECT count(*) FROM Files;").fetchone()[0],
+        "entities": db_conn.execute("SELECT count(*) FROM Entities;").fetchone()[0],
+        "calls": db_conn.execute("SELECT count(*) FROM Calls;").fetchone()[0],
+    }
+    db_conn.close()
+    # The next size starts from nothing
+    for module_name in [m for m in sys.modules if m == package_name or m.startswith(f"{package_name}.")]:
+        del sys.modules[module_name]
+    return {"num_files": num_files, "counts": counts, "phases": phases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic package benchmark of every pycallflow phase")
+    parser.add_argument("--files", type=str, default="10,100,500", help="Comma separated package sizes, in files")
+    parser.add_argument("--classes_per_file", type=int, default=2)
+    parser.add_argument("--methods_per_class", type=int, default=5)
+    parser.add_argument("--functions_per_file", type=int, default=5)
+    parser.add_argument("--collision_rate", type=float, default=0.1, help="Fraction of entity names shared between files")
+    parser.add_argument("--calls_per_function", type=int, default=5, help="Entities referenced by each function or method body")
+    parser.add_argument("--static", action="store_true", help="Time findDeclaredEntities_static instead of the import engine")
+    parser.add_argument("--trace_memory", action="store_true", help="Also record each phase's peak traced (tracemalloc) memory.  Slows every phase down.")
+    parser.add_argument("--keep", type=str, default=None, help="Generate the packages in this directory and leave them there")
+    parser.add_argument("--output", type=str, default=None, help="Write the JSON here instead of stdout")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    root = args.keep if args.keep is not None else tempfile.mkdtemp(prefix="pycallflow_bench_")
+    sys.path.insert(0, root)
+    report = {
+        "pycallflow": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ["keep", "output"]},
+        "runs": [],
+    }
+    rng = random.Random(args.seed)
+    try:
+        for num_files in [int(n) for n in args.files.split(",")]:
+            report["runs"].append(runPipeline(root, num_files, args, rng))
+            print(f"[-] {num_files} files done", file=sys.stderr)
+    finally:
+        if args.keep is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, "w") as output_f:
+            json.dump(report, output_f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,12 @@
 # SPDX-FileCopyrightText: 2023-present Michael Rich <richmr2174@gmail.com>
 #
 # SPDX-License-Identifier: MIT
+
+
+def __getattr__(name):
+    # Imported on first use, so "import pycallflow" (and every --jobs worker) doesn't pay for the
+    # CLI, the query server and http.server
+    if name == "CallFlowSession":
+        from .callFlowSession import CallFlowSession
+        return CallFlowSession
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
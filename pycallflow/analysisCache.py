@@ -0,0 +1,170 @@
+"""
+Content addressed cache of per-file analysis results.
+
+Entries are keyed by the SHA256 of the source file along with its package path, the engine used,
+the version of the call name format, and the pycallflow and Python versions.  Each entry holds the entities discovered in that file
+and the raw names each one references, so a cache hit needs neither an import nor disassembly.
+Because nothing depends on modification times, the cache can be shared between fresh checkouts.
+"""
+import hashlib
+import json
+import os
+import sys
+
+from .__about__ import __version__
+from .buildDeclaredEntitiesDB import addEntityToDB
+from .analyzeCallFlow import saveCallNames, CALL_NAMES_VERSION
+from .staticAnalysis import staticEntity
+
+ENTRY_KEYS = {"entity_name", "entity_type", "import_path", "member_of_class", "call_names"}
+
+
+class analysisCache:
+
+    def __init__(self, cache_dir, static=False) -> None:
+        if not os.path.isdir(cache_dir):
+            raise NotADirectoryError(cache_dir)
+        self.cache_dir = cache_dir
+        self.engine = "static" if static else "import"
+        self.hits = 0
+        self.misses = 0
+
+    def cacheKey(self, file_full_path, package_path):
+        hasher = hashlib.sha256()
+        with open(file_full_path, "rb") as source:
+            hasher.update(source.read())
+        hasher.update(f"\0{package_path}\0{self.engine}\0{CALL_NAMES_VERSION}\0{__version__}\0{sys.version}".encode())
+        return hasher.hexdigest()
+
+    def entryPath(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def loadEntry(self, file_row):
+        """
+        Returns the cache entry for this Files row, or None if the file needs to be analyzed
+        """
+        try:
+            file_row["cache_key"] = self.cacheKey(file_row["file_full_path"], file_row["package_path"])
+            with open(self.entryPath(file_row["cache_key"]), "r") as entry_f:
+                entry = json.load(entry_f)
+        except (OSError, ValueError):
+            entry = None
+        if not isValidEntry(entry):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def restoreFile(self, db_cursor, file_row):
+        """
+        Saves the cached entities for this Files row to the db.
+        Returns True if there was a cache entry, False if the file needs to be analyzed
+        """
+        entry = self.loadEntry(file_row)
+        if entry is None:
+            return False
+        saveEntryToDB(db_cursor, file_row["fileID"], entry)
+        return True
+
+    def storeFiles(self, db_cursor, file_rows):
+        for file_row in file_rows:
+            self.storeFile(db_cursor, file_row)
+
+    def storeFile(self, db_cursor, file_row):
+        """
+        Caches what the analysis of this Files row saved to the db
+        """
+        if "cache_key" not in file_row:
+            return
+        entry = entryFromDB(db_cursor, file_row["fileID"])
+        entry_path = self.entryPath(file_row["cache_key"])
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # Write then rename so concurrent builds never see a partial entry
+            tmp_path = f"{entry_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as entry_f:
+                json.dump(entry, entry_f)
+            os.replace(tmp_path, entry_path)
+        except OSError as badnews:
+            print(f"Unable to cache {file_row['file_full_path']} because {badnews}", file=sys.stderr)
+
+
+def entryFromDB(db_cursor, fileID):
+    """
+    Returns a cache entry like:
+    {
+        entities: [
+            {
+                entity_name:...,
+                entity_type:...,
+                import_path:...,
+                member_of_class: index into entities or None,
+                call_names: [...] or None
+            }, ...
+        ]
+    }
+    """
+    stmt = """
+        SELECT
+            Entities.entityID,
+            entity_name,
+            entity_type,
+            import_path,
+            member_of_class,
+            call_names
+        FROM
+            Entities
+        LEFT JOIN
+            EntityCallNames on Entities.entityID=EntityCallNames.entityID
+        WHERE
+            fileID = ?
+        ORDER BY
+            Entities.entityID;
+    """
+    rows = db_cursor.execute(stmt, (fileID, )).fetchall()
+    index_of = {row["entityID"]: n for n, row in enumerate(rows)}
+    entities = []
+    for row in rows:
+        entities.append({
+            "entity_name": row["entity_name"],
+            "entity_type": row["entity_type"],
+            "import_path": row["import_path"],
+            "member_of_class": index_of.get(row["member_of_class"]),
+            "call_names": None if row["call_names"] is None else json.loads(row["call_names"]),
+        })
+    return {"entities": entities}
+
+
+def isValidEntry(entry):
+    """
+    Checks the entry is shaped like the ones entryFromDB makes, so a damaged one is a miss
+    instead of failing the run halfway through saving it
+    """
+    if not isinstance(entry, dict) or not isinstance(entry.get("entities"), list):
+        return False
+    for n, cached in enumerate(entry["entities"]):
+        if not isinstance(cached, dict) or set(cached) != ENTRY_KEYS:
+            return False
+        if not all(isinstance(cached[key], str) for key in ("entity_name", "entity_type", "import_path")):
+            return False
+        # A member always comes after its class
+        member_of_class = cached["member_of_class"]
+        if member_of_class is not None and not (type(member_of_class) is int and 0 <= member_of_class < n):
+            return False
+        call_names = cached["call_names"]
+        if call_names is not None and not (isinstance(call_names, list) and all(isinstance(name, str) for name in call_names)):
+            return False
+    return True
+
+
+def saveEntryToDB(db_cursor, fileID, entry):
+    py_objs = []
+    for cached in entry["entities"]:
+        member_of_class = None
+        if cached["member_of_class"] is not None:
+            member_of_class = getattr(py_objs[cached["member_of_class"]], "callflow_entity_id", None)
+        py_obj = staticEntity(cached["entity_name"], cached["call_names"])
+        addEntityToDB(db_cursor, fileID, cached["entity_name"], cached["entity_type"],
+                      cached["import_path"], py_obj, member_of_class)
+        py_objs.append(py_obj)
+    saveCallNames(db_cursor, [py_obj for py_obj in py_objs if hasattr(py_obj, "callflow_call_names")])
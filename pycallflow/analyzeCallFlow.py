@@ -1,82 +1,161 @@
-import dis
+import json
 
-from .callFlowData import callFlowData
+from .callFlowData import bulkWriter, dropIndexes, createIndexes
+from .bytecodeScanner import bytecodeScanner
+from .profiling import countEvent
 
-def buildCallflowDB(db_conn, suppress_calls_to_init, match_to_file):
-    foundCalls = []
-    objs_to_analyze = callFlowData().getDiscoveredObjects()
-    entity_names, entity_data = entitylists(db_conn.cursor())
-    for obj in objs_to_analyze:
-        call_num = 0
+# Bump whenever the names recorded for an entity change, so saved and cached ones are redone
+CALL_NAMES_VERSION = 2
+
+def buildCallflowDB(db_conn, suppress_calls_to_init, match_to_file, entityIDs=None):
+    """
+    Resolves the saved call names into Calls rows.
+    entityIDs - only (re)build the calls made by these entities [all entities]
+    """
+    resolver = entityNameIndex(entityData(db_conn.cursor()), match_to_file)
+    clearCallsFrom(db_conn.cursor(), entityIDs)
+    if entityIDs is None:
+        # Building the Calls indexes once at the end beats keeping them up to date row by row
+        dropIndexes(db_conn.cursor(), "Calls")
+    try:
+        with bulkWriter(db_conn) as writer:
+            for entityID, fileID, call_names in getEntityCallNames(db_conn.cursor(), entityIDs):
+                call_num = 0
+                for name in call_names:
+                    if name in resolver.index:
+                        if suppress_calls_to_init:
+                            if name == "__init__":
+                                # We don't add it to the database.
+                                continue
+                        # Get all IDs with this name
+                        for id in resolver.findAllEntityIDWithName(name, fileID):
+                            this_call = {
+                                "fileID": fileID,
+                                "entityID": entityID, 
+                                "called_entity_ID":id,
+                                "collision_num": f"{entityID}.{call_num}"
+                            }
+                            addCallDBEntry(writer, **this_call)
+                        call_num += 1
+    finally:
+        if entityIDs is None:
+            # Even when the build fails, so later runs don't go without them
+            createIndexes(db_conn.cursor())
+            db_conn.commit()
+
+class entityNameIndex:
+    """
+    Finds the entities a call name could be.  Built once from entityData() so each name lookup
+    during call resolution is a dict lookup rather than a SELECT.
+    """
+
+    def __init__(self, entity_data, match_to_file=False) -> None:
+        self.match_to_file = match_to_file
+        # {entity_name: [(entityID, fileID), ...]} in entityID order, same as the SELECT returned
+        self.index = {}
+        for entity in entity_data:
+            self.index.setdefault(entity["entity_name"], []).append((entity["entityID"], entity["fileID"]))
+        # match_to_file answers depend on the calling file, so they are worked out once per (name, file)
+        self.resolved = {}
+
+    def findAllEntityIDWithName(self, entity_name, fileID):
+        key = (entity_name, fileID if self.match_to_file else None)
+        if key not in self.resolved:
+            possibles = self.index.get(entity_name, [])
+            toreturn = []
+            if self.match_to_file:
+                toreturn = [entityID for entityID, entity_fileID in possibles if entity_fileID == fileID]
+            # if there is nothing in toreturn, we use all the possibles
+            if len(toreturn) == 0:
+                toreturn = [entityID for entityID, entity_fileID in possibles]
+            self.resolved[key] = toreturn
+        return self.resolved[key]
+
+def saveCallNames(db_cursor, objs):
+    """
+    Records the names each discovered object references against its entity so calls can be
+    resolved (and re-resolved later) without the live object
+    """
+    stmt = """
+        INSERT OR REPLACE INTO EntityCallNames (entityID, call_names)
+        VALUES (?, ?);
+    """
+    seen = set()
+    scanner = bytecodeScanner()
+    for obj in objs:
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
         try:
-            for t in dis.get_instructions(obj):
-                if t.argval in entity_names:
-                    if suppress_calls_to_init:
-                        if t.argval == "__init__":
-                            # We don't add it to the database.
-                            continue
-                    # Get all IDs with this name
-                    for id in findAllEntityIDWithName(db_conn.cursor(), t.argval, obj.callflow_file_id, match_to_file):
-                        this_call = {
-                            "fileID": obj.callflow_file_id,
-                            "entityID": obj.callflow_entity_id, 
-                            "called_entity_ID":id,
-                            "collision_num": f"{obj.callflow_entity_id}.{call_num}"
-                        }
-                        foundCalls.append(this_call)
-                        addCallDBEntry(db_conn.cursor(), **this_call)
-                    call_num += 1
-                elif t.opname == "LOAD_GLOBAL":
-                    pass
+            call_names = [name for name in getCallNames(obj, scanner) if isinstance(name, str)]
+            if isinstance(db_cursor, bulkWriter):
+                db_cursor.addCallNames(obj.callflow_entity_id, json.dumps(call_names))
+            else:
+                db_cursor.execute(stmt, (obj.callflow_entity_id, json.dumps(call_names), ))
         except Exception as badnews:
+            # Classes and anything that never got an entity ID have nothing to record
             pass
-    db_conn.commit()
 
-def entitylists(db_cursor):
+def getEntityCallNames(db_cursor, entityIDs=None):
     """
-    returns names, data
-    names = [ename1, ename2, ...]
-        For fast lookup during disassembly
-    data = [{info from the db}, {}]  These are in the same order as the object list due to algorithm
+    returns list of (entityID, fileID, [call names])
     """
     stmt = """
         SELECT
-            *
+            EntityCallNames.entityID,
+            fileID,
+            call_names
         FROM
-            Entities;
+            EntityCallNames
+        JOIN
+            Entities on EntityCallNames.entityID=Entities.entityID;
     """
-    data = []
-    names = []
+    toreturn = []
     for row in db_cursor.execute(stmt):
-        names.append(row["entity_name"])
-        data.append(dict(zip(row.keys(), row)))
-    return names, data
+        if entityIDs is not None and row["entityID"] not in entityIDs:
+            continue
+        toreturn.append((row["entityID"], row["fileID"], json.loads(row["call_names"])))
+    return toreturn
 
-def findAllEntityIDWithName(db_cursor, entity_name, fileID, match_to_file=False):
+def clearCallsFrom(db_cursor, entityIDs=None):
+    if entityIDs is None:
+        db_cursor.execute("DELETE FROM Calls;")
+        return
+    db_cursor.executemany("DELETE FROM Calls WHERE entityID = ?;", [(id, ) for id in entityIDs])
+
+def getCallNames(obj, scanner=None):
+    """
+    Returns the names obj references, in order, including those in functions, lambdas and
+    comprehensions nested inside it.  Entities from the static engine already carry these,
+    everything else is scanned.
+    scanner - bytecodeScanner to reuse, so code shared between objects is only scanned once [new one]
+    """
+    if hasattr(obj, "callflow_call_names"):
+        return obj.callflow_call_names
+    if scanner is None:
+        scanner = bytecodeScanner()
+    return scanner.callNames(obj)
+
+def entityData(db_cursor):
+    """
+    returns [{info from the db}, {}] for every entity, in entityID order
+    """
     stmt = """
         SELECT
-            entityID,
-            fileID
+            *
         FROM
             Entities
-        WHERE
-            entity_name = ?;
+        ORDER BY
+            entityID;
     """
-    toreturn = []
-    possibles = []
-    for row in db_cursor.execute(stmt, (entity_name, )):
-        possibles.append(row["entityID"])
-        if match_to_file and (row["fileID"] == fileID):
-            toreturn.append(row["entityID"])
-
-    # if there is nothing in toreturn, we set toreturn = possibles
-    if len(toreturn) == 0:
-        toreturn = possibles
-
-    return toreturn
+    return [dict(zip(row.keys(), row)) for row in db_cursor.execute(stmt)]
 
 
 def addCallDBEntry(db_cursor, entityID, called_entity_ID, collision_num, **kwargs):
+    countEvent("calls_inserted")
+    if isinstance(db_cursor, bulkWriter):
+        db_cursor.addCall(entityID, called_entity_ID, collision_num)
+        return
     insert = """
         INSERT INTO Calls (entityID, called_entity_ID, collision_num)
         VALUES (?, ?, ?);
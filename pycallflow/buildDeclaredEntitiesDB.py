@@ -1,10 +1,13 @@
+import gc
 import inspect
 import sys
 from importlib import import_module
 
-from .buildFileDB import getFileList
+from .buildFileDB import getFileList, streamFileRows
 #from .cflow_importlib import import_module
-from .callFlowData import callFlowData
+from .callFlowData import callFlowData, bulkWriter, BACKGROUND_BATCH_SIZE
+from .analyzeCallFlow import saveCallNames
+from .profiling import profileTimer
 
 def buildDeclaredEntitiesDB(db_conn):
     entities = findDeclaredEntities(db_conn)
@@ -14,6 +17,17 @@ def buildDeclaredEntitiesDB(db_conn):
     db_conn.commit()
 
 def addEntityToDB(db_cursor, fileID, entity_name, entity_type, import_path, py_obj, member_of_class = None):
+    """
+    db_cursor may be a bulkWriter, in which case the row is buffered
+    Returns the new EntityID, or None if the entity was already there
+    """
+    if isinstance(db_cursor, bulkWriter):
+        EntityID = db_cursor.addEntity(fileID, entity_name, entity_type, import_path, member_of_class)
+        if EntityID is not None:
+            setattr(py_obj, "callflow_entity_id", EntityID)
+            setattr(py_obj, "callflow_file_id", fileID)
+        return EntityID
+
     entity_search_stmt = """
         SELECT
             entityID
@@ -135,23 +149,72 @@ def inspectEntity(entity, import_path="", member_of_class=None):
     
     return toreturn
 
-def findDeclaredEntities_inlineSave(db_conn):
+def findDeclaredEntities_inlineSave(db_conn, fileIDs=None, cache=None, release_modules=False, target_files=None):
     """
-    Iterates files and finds entities, saving them inline
+    Iterates files and finds entities, saving them inline.  The rows are written to the db by a
+    background thread while the next files are imported.
+    fileIDs - only process these files [all files]
+    cache - analysisCache to reuse results from [None]
+    release_modules - Set True to drop each module once its entities are saved [False]
+    target_files - walkTargetFiles generator to add the files from, each one analyzed as soon as
+                   the walk finds it, instead of the files already in the db [None]
     """
     file_list = getFileList(db_conn)
-    cursor = db_conn.cursor()
-    for f in file_list:
-        try:
-            entity = import_module(f["package_path"])
-            fileID = f["fileID"]
-            inspectAndSaveEntities(cursor, fileID, entity, f["package_path"])
-        except Exception as badnews:
-            print(
-                f"Unable to process file {f['file_full_path']} because {badnews}", file=sys.stderr)
-    db_conn.commit()
+    to_cache = []
+    analyzed = set()
+    with bulkWriter(db_conn, BACKGROUND_BATCH_SIZE, background=True) as writer:
+        if target_files is not None:
+            file_list = streamFileRows(writer, target_files)
+        for f in file_list:
+            if fileIDs is not None and f["fileID"] not in fileIDs:
+                continue
+            if cache is not None and cache.restoreFile(writer, f):
+                continue
+            loaded_before = set(sys.modules) if release_modules else None
+            try:
+                saveFileEntities(writer, f)
+                to_cache.append(f)
+            except Exception as badnews:
+                print(
+                    f"Unable to process file {f['file_full_path']} because {badnews}", file=sys.stderr)
+            if release_modules:
+                releaseAnalyzedModules(loaded_before, f["package_path"], analyzed)
+    if cache is not None:
+        cache.storeFiles(db_conn.cursor(), to_cache)
     return 
 
+def releaseAnalyzedModules(loaded_before, package_path, analyzed):
+    """
+    Drops package_path's module, along with any already analyzed module that importing it loaded
+    again, from sys.modules (and from its parent package) so they can be freed.  Modules that
+    haven't had their turn yet are kept, so they are only imported once more for it.
+    analyzed - package paths of the files analyzed so far, package_path is added to it
+    """
+    analyzed.add(package_path)
+    to_release = (set(sys.modules) - loaded_before) | {package_path}
+    for name in to_release & analyzed:
+        module = sys.modules.pop(name, None)
+        parent_name, _, child_name = name.rpartition(".")
+        parent = sys.modules.get(parent_name)
+        if module is not None and parent is not None and getattr(parent, child_name, None) is module:
+            delattr(parent, child_name)
+    # Functions and classes sit in reference cycles with their module's globals
+    gc.collect()
+
+def saveFileEntities(db_cursor, file_row):
+    """
+    Imports the file in this Files row and saves its entities and their call names
+    """
+    cf_data = callFlowData()
+    try:
+        with profileTimer("import"):
+            entity = import_module(file_row["package_path"])
+            inspectAndSaveEntities(db_cursor, file_row["fileID"], entity, file_row["package_path"])
+    finally:
+        # Entities saved before the inspection failed part way through still need their call names
+        with profileTimer("disassembly"):
+            saveCallNames(db_cursor, cf_data.releaseDiscoveredObjects())
+
 
 def inspectAndSaveEntities(db_cursor, fileID, entity, import_path="", member_of_class=None):
     """
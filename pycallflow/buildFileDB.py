@@ -1,19 +1,60 @@
 import os
 import pathlib
 
-def buildFileDB(target_object, db_conn, targetIsDirectory = False):
+from .callFlowData import bulkWriter
+from .pathFilter import pathFilter
+
+def buildFileDB(target_object, db_conn, targetIsDirectory = False, path_filter = None):
     # Get the file list
-    db_cursor = db_conn.cursor()
+    addTargetFiles(db_conn, walkTargetFiles(target_object, targetIsDirectory, path_filter))
+    return
+
+def addTargetFiles(db_conn, target_files):
+    """
+    Adds the files from walkTargetFiles to the Files table
+    """
+    with bulkWriter(db_conn) as writer:
+        for file_row in streamFileRows(writer, target_files):
+            pass
+
+def streamFileRows(writer, target_files):
+    """
+    Adds the files from walkTargetFiles to the bulkWriter as the walk finds them, yielding the
+    Files row (as getFileList has it) of each one that wasn't there already
+    """
+    for file_full_path, package_path, file_mod_time, file_size in target_files:
+        fileID = addFileToDB(writer, file_full_path, package_path, file_mod_time, file_size)
+        if fileID is None:
+            continue
+        yield {
+            "fileID": fileID,
+            "file_full_path": file_full_path,
+            "package_path": package_path,
+            "file_mod_time": file_mod_time,
+            "file_size": file_size,
+        }
+
+def walkTargetFiles(target_object, targetIsDirectory = False, path_filter = None):
+    """
+    Yields (file_full_path, package_path, file_mod_time, file_size) for every python file in the target
+    path_filter - pathFilter of the files and directories to leave out [only the default excludes]
+    """
+    if path_filter is None:
+        path_filter = pathFilter()
     search_paths = [target_object]
     if not targetIsDirectory:
         search_paths = target_object.__path__
     for search_path in search_paths:
         for root, dirs, files in os.walk(search_path, topdown=True):
+            # os.walk won't go into the directories taken out here
+            path_filter.keepDirs(search_path, root, dirs)
             for name in files:
                 if name.endswith(".py"):
                     if name == "setup.py":
                         # These files seem to cause problems with this technique
                         continue
+                    if not path_filter.keepFile(search_path, os.path.join(root, name)):
+                        continue
                     file_full_path = os.path.join(root, name)
                     file_full_path = os.path.normpath(file_full_path)
                     # Build package path
@@ -26,7 +67,6 @@ def buildFileDB(target_object, db_conn, targetIsDirectory = False):
                     else:
                         package_path = target_object.__name__
                     rel_path = root[len(search_path):]
-                    print(rel_path)
                     if "\\" in rel_path:
                         # Fix Windows paths
                         rel_path = rel_path.replace("\\",".")
@@ -39,12 +79,16 @@ def buildFileDB(target_object, db_conn, targetIsDirectory = False):
                     if targetIsDirectory and package_path.startswith("."):
                         # Have to watch out for 'relative' package loads not in a package when scanning directories
                         package_path = package_path[1:]
-                    file_mod_time = int(pathlib.Path(os.path.join(root, name)).stat().st_mtime)
-                    addFileToDB(db_cursor, file_full_path, package_path, file_mod_time)
-    db_conn.commit()
-    return
+                    file_stat = pathlib.Path(os.path.join(root, name)).stat()
+                    yield file_full_path, package_path, int(file_stat.st_mtime), file_stat.st_size
 
-def addFileToDB(db_cursor, file_full_path, package_path, file_mod_time):
+def addFileToDB(db_cursor, file_full_path, package_path, file_mod_time, file_size=None):
+    """
+    db_cursor may be a bulkWriter, in which case the row is buffered
+    Returns the new fileID, or None if the package path was already there
+    """
+    if isinstance(db_cursor, bulkWriter):
+        return db_cursor.addFile(file_full_path, package_path, file_mod_time, file_size)
     file_search = """
         SELECT
             fileID
@@ -53,8 +97,8 @@ def addFileToDB(db_cursor, file_full_path, package_path, file_mod_time):
         WHERE package_path = ?
     """
     file_insert = """
-        INSERT INTO Files (file_full_path, package_path, file_mod_time)
-        VALUES (?, ?, ?)
+        INSERT INTO Files (file_full_path, package_path, file_mod_time, file_size)
+        VALUES (?, ?, ?, ?)
     """
     # Does this package path already exist
     rows = db_cursor.execute(file_search, (package_path,)).fetchall()
@@ -62,8 +106,8 @@ def addFileToDB(db_cursor, file_full_path, package_path, file_mod_time):
         return
     
     # No, so add it
-    db_cursor.execute(file_insert, (file_full_path, package_path, file_mod_time,))
-    return
+    db_cursor.execute(file_insert, (file_full_path, package_path, file_mod_time, file_size,))
+    return db_cursor.lastrowid
 
 def getFileList(db_conn):
     """
@@ -72,7 +116,8 @@ def getFileList(db_conn):
         fileID:..,
         file_full_path:..,
         package_path:...,
-        file_mod_time:...
+        file_mod_time:...,
+        file_size:...
     }
     """
     toreturn = []
@@ -0,0 +1,162 @@
+"""
+Reads the names a function references straight out of its bytecode.
+
+This gives the same names, in the same order, as taking the string argvals of
+dis.get_instructions(), without building an Instruction (and its argrepr) for every opcode.
+Code objects found in co_consts (nested functions, lambdas, classes, and comprehensions before
+3.12) are scanned too, and their names are counted as the enclosing function's, at the point the
+code object is loaded.  Each code object is only scanned once per scanner, so shared and
+decorated functions cost nothing the second time.
+
+The opcode layout is worked out for the CPython versions below.  Anything else falls back to dis.
+"""
+import dis
+import platform
+import sys
+import types
+
+from .profiling import countEvent
+
+# What the argument of an opcode refers to
+ARG_NONE, ARG_NAME, ARG_CONST, ARG_LOCAL, ARG_CELL, ARG_COMPARE, ARG_EXTENDED = range(7)
+
+
+def opcodeTables():
+    """
+    Returns (arg_kinds, name_shifts, compare_shift), the first two indexed by opcode, or None if
+    this interpreter's bytecode isn't understood
+    """
+    if platform.python_implementation() != "CPython" or not (3, 7) <= sys.version_info[:2] <= (3, 13):
+        return None
+    kinds = [
+        (dis.hasname, ARG_NAME),
+        (dis.hasconst, ARG_CONST),
+        (dis.haslocal, ARG_LOCAL),
+        # From 3.11 cells and frees are numbered along with the locals
+        (dis.hasfree, ARG_LOCAL if sys.version_info >= (3, 11) else ARG_CELL),
+        (dis.hascompare, ARG_COMPARE),
+    ]
+    arg_kinds = [ARG_NONE] * 256
+    for ops, kind in kinds:
+        for op in ops:
+            # Pseudo instructions (256 and up) never appear in co_code
+            if op < 256 and hasArg(op):
+                arg_kinds[op] = kind
+    for name in ("LOAD_FAST_LOAD_FAST", "STORE_FAST_LOAD_FAST", "STORE_FAST_STORE_FAST"):
+        # Two locals packed in one argument, dis gives a tuple for these
+        if name in dis.opmap:
+            arg_kinds[dis.opmap[name]] = ARG_NONE
+    arg_kinds[dis.EXTENDED_ARG] = ARG_EXTENDED
+
+    # Low bits of these arguments are flags rather than part of the name index
+    name_shifts = [0] * 256
+    if sys.version_info >= (3, 11):
+        name_shifts[dis.opmap["LOAD_GLOBAL"]] = 1
+    if sys.version_info >= (3, 12):
+        name_shifts[dis.opmap["LOAD_ATTR"]] = 1
+        name_shifts[dis.opmap["LOAD_SUPER_ATTR"]] = 2
+    compare_shift = {(3, 12): 4, (3, 13): 5}.get(sys.version_info[:2], 0)
+    return arg_kinds, name_shifts, compare_shift
+
+
+def hasArg(op):
+    if sys.version_info >= (3, 12):
+        return op in dis.hasarg
+    return op >= dis.HAVE_ARGUMENT
+
+
+OPCODE_TABLES = opcodeTables()
+
+
+class bytecodeScanner:
+    """
+    Scans code objects for the names they reference, remembering what it has already scanned
+    """
+
+    def __init__(self) -> None:
+        # {id(code): (code, names)}, the code is kept so its id can't be reused
+        self.scanned = {}
+
+    def callNames(self, obj):
+        """
+        Returns the names obj references, including those in any code nested inside it
+        """
+        return list(self.codeNames(codeObject(obj)))
+
+    def codeNames(self, code):
+        if id(code) not in self.scanned:
+            if OPCODE_TABLES is None:
+                names = self.scanWithDis(code)
+            else:
+                names = self.scanCode(code)
+            self.scanned[id(code)] = (code, tuple(names))
+        return self.scanned[id(code)][1]
+
+    def scanCode(self, code):
+        """
+        One pass over co_code.  Inline cache entries (3.11 and up) read back from co_code as
+        CACHE instructions with no argument, so they fall through like any other
+        """
+        arg_kinds, name_shifts, compare_shift = OPCODE_TABLES
+        co_code = code.co_code
+        co_names = code.co_names
+        co_consts = code.co_consts
+        if sys.version_info >= (3, 11):
+            varname = code._varname_from_oparg
+        else:
+            varname = code.co_varnames.__getitem__
+        cell_names = code.co_cellvars + code.co_freevars
+        names = []
+        extended_arg = 0
+        for op, arg in zip(co_code[::2], co_code[1::2]):
+            kind = arg_kinds[op]
+            if kind == ARG_NONE:
+                extended_arg = 0
+                continue
+            arg |= extended_arg
+            if kind == ARG_EXTENDED:
+                extended_arg = arg << 8
+                continue
+            extended_arg = 0
+            if kind == ARG_NAME:
+                names.append(co_names[arg >> name_shifts[op]])
+            elif kind == ARG_CONST:
+                const = co_consts[arg]
+                if isinstance(const, str):
+                    names.append(const)
+                elif isinstance(const, types.CodeType):
+                    names.extend(self.codeNames(const))
+            elif kind == ARG_LOCAL:
+                names.append(varname(arg))
+            elif kind == ARG_CELL:
+                names.append(cell_names[arg])
+            else:
+                names.append(dis.cmp_op[arg >> compare_shift])
+        countEvent("instructions_scanned", len(co_code) // 2)
+        return names
+
+    def scanWithDis(self, code):
+        names = []
+        instructions = 0
+        for instruction in dis.get_instructions(code):
+            instructions += 1
+            if isinstance(instruction.argval, str):
+                names.append(instruction.argval)
+            elif isinstance(instruction.argval, types.CodeType):
+                names.extend(self.codeNames(instruction.argval))
+        countEvent("instructions_scanned", instructions)
+        return names
+
+
+def codeObject(obj):
+    """
+    Finds the code object of a function, method, generator or coroutine the way dis does.
+    Raises TypeError for anything else (classes included).
+    """
+    obj = getattr(obj, "__func__", obj)
+    for attr in ("__code__", "gi_code", "ag_code", "cr_code"):
+        if hasattr(obj, attr):
+            return getattr(obj, attr)
+    if isinstance(obj, types.CodeType):
+        return obj
+    raise TypeError(f"don't know how to scan {type(obj).__name__} objects")
@@ -1,5 +1,10 @@
+from contextlib import contextmanager
+import queue
 import sqlite3
 import sys
+import threading
+
+from .profiling import profileTimer
 
 CALLFLOW_TABLES = {
     "Files": """
@@ -7,7 +12,8 @@ CALLFLOW_TABLES = {
             fileID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
             file_full_path TEXT,
             package_path TEXT,
-            file_mod_time INTEGER
+            file_mod_time INTEGER,
+            file_size INTEGER
         ) 
     """,
     "Entities":"""
@@ -27,23 +33,102 @@ CALLFLOW_TABLES = {
             called_entity_ID INTEGER,
             collision_num TEXT
         )
+    """,
+    "EntityCallNames":"""
+        CREATE TABLE EntityCallNames (
+            entityID INTEGER PRIMARY KEY NOT NULL,
+            call_names TEXT
+        )
+    """,
+    "RunSettings":"""
+        CREATE TABLE RunSettings (
+            setting_name TEXT PRIMARY KEY NOT NULL,
+            setting_value TEXT
+        )
+    """,
+    "EntityComponents":"""
+        CREATE TABLE EntityComponents (
+            entityID INTEGER PRIMARY KEY NOT NULL,
+            componentID INTEGER
+        )
+    """,
+    "ComponentCalls":"""
+        CREATE TABLE ComponentCalls (
+            componentID INTEGER,
+            called_componentID INTEGER
+        )
     """
 }
 
+# Version of the schema above plus the indexes below, kept in PRAGMA user_version.
+# Databases from before versioning read as 0 and are migrated in place when opened.
+CALLFLOW_SCHEMA_VERSION = 4
+
+# Columns added after a table was first released
+CALLFLOW_ADDED_COLUMNS = {
+    "Files": {
+        "file_size": "INTEGER"
+    }
+}
+
+# Tables that are no longer used, dropped along with their data
+CALLFLOW_DROPPED_TABLES = ["ComponentReach"]
+
+# The unique index on Entities(entity_name, import_path) also serves lookups by entity_name alone
+CALLFLOW_INDEXES = {
+    "Files_package_path": "CREATE UNIQUE INDEX IF NOT EXISTS Files_package_path ON Files (package_path)",
+    "Entities_name_import_path": "CREATE UNIQUE INDEX IF NOT EXISTS Entities_name_import_path ON Entities (entity_name, import_path)",
+    "Entities_fileID": "CREATE INDEX IF NOT EXISTS Entities_fileID ON Entities (fileID)",
+    "Calls_entityID": "CREATE INDEX IF NOT EXISTS Calls_entityID ON Calls (entityID)",
+    "Calls_called_entity_ID": "CREATE INDEX IF NOT EXISTS Calls_called_entity_ID ON Calls (called_entity_ID)",
+    "Calls_collision_num": "CREATE INDEX IF NOT EXISTS Calls_collision_num ON Calls (collision_num)",
+    "EntityComponents_componentID": "CREATE INDEX IF NOT EXISTS EntityComponents_componentID ON EntityComponents (componentID)",
+    "ComponentCalls_componentID": "CREATE INDEX IF NOT EXISTS ComponentCalls_componentID ON ComponentCalls (componentID)",
+    "ComponentCalls_called_componentID": "CREATE INDEX IF NOT EXISTS ComponentCalls_called_componentID ON ComponentCalls (called_componentID)",
+}
+
+def dropIndexes(db_cursor, table):
+    """
+    Drops the indexes on table ahead of a bulk load, createIndexes puts them back
+    """
+    for name in CALLFLOW_INDEXES:
+        if name.startswith(f"{table}_"):
+            db_cursor.execute(f"DROP INDEX IF EXISTS {name};")
+
+
+def createIndexes(db_cursor):
+    for stmt in CALLFLOW_INDEXES.values():
+        db_cursor.execute(stmt)
+
+
+class objectRegistry:
+    """
+    The objects discovered by one analysis.  Only the objects of the file being analyzed are
+    held, so they can be freed with their module.
+    """
+
+    def __init__(self) -> None:
+        self.objects = []
+        self.count = 0
+
+
 class callFlowData:
     """
     Holds the discovered objects and sqlite3 connection for resuse across call flow activities    
+    Discovered objects go to the active registry, see useRegistry()
     """
     sqlite_connection = None
-    discoveredObjects = []
+    registry = objectRegistry()
 
     def __init__(self, sqlite3_filename=":memory:") -> None:
         self.sqlite3_filename = sqlite3_filename
-        pass
+        # Set by collectData when it updated the analysis already in the db instead of redoing it
+        self.reused_analysis = False
 
     def getSqliteConnection(self, checkTablesExist=True):
         if self.sqlite_connection is None:
-            cnxn = sqlite3.connect(self.sqlite3_filename)
+            # A background bulkWriter writes from its own thread, one thread at a time
+            cnxn = sqlite3.connect(self.sqlite3_filename, check_same_thread=False)
             cnxn.row_factory = sqlite3.Row
             if checkTablesExist:
                 self.checkDBHasRequiredTables(cnxn)
@@ -52,6 +137,10 @@ class callFlowData:
 
     def checkDBHasRequiredTables(self, db_conn, createIfMissing=True):
         db_cursor = db_conn.cursor()
+        schema_version = db_cursor.execute("PRAGMA user_version;").fetchone()[0]
+        if schema_version > CALLFLOW_SCHEMA_VERSION:
+            raise Exception(f"callflow.sqlsetup.checkDBHasRequiredTables: {self.sqlite3_filename} has schema version {schema_version}, this version of pycallflow only understands up to {CALLFLOW_SCHEMA_VERSION}.")
+
         tablesNeeded = list(CALLFLOW_TABLES.keys())
         listOfTables = db_cursor.execute(
             "SELECT name FROM sqlite_master WHERE type='table'").fetchall()
@@ -64,22 +153,289 @@ class callFlowData:
 
         if not createIfMissing:
             if len(tablesNeeded) > 0:
-                raise Exception(f"callflow.sqlsetup.checkDBHasRequiredTables: Missing {','.join(tablesNeeded)}.  Set createIfMissing=True to build them.", file=sys.stderr)
+                raise Exception(f"callflow.sqlsetup.checkDBHasRequiredTables: Missing {','.join(tablesNeeded)}.  Set createIfMissing=True to build them.")
 
         # Build the remaining
         for table in tablesNeeded:
             stmt = CALLFLOW_TABLES[table]
             db_cursor.execute(stmt)
+
+        if schema_version < CALLFLOW_SCHEMA_VERSION:
+            self.migrateSchema(db_conn)
         return
 
+    def migrateSchema(self, db_conn):
+        """
+        Brings the tables of a new or older database up to CALLFLOW_SCHEMA_VERSION
+        """
+        db_cursor = db_conn.cursor()
+        for table, columns in CALLFLOW_ADDED_COLUMNS.items():
+            existing = [row[1] for row in db_cursor.execute(f"PRAGMA table_info({table});")]
+            for column, column_type in columns.items():
+                if column not in existing:
+                    db_cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type};")
+
+        # The unique indexes can't be built over duplicates, keep the first of each
+        db_cursor.execute("""
+            DELETE FROM Files WHERE fileID NOT IN (
+                SELECT min(fileID) FROM Files GROUP BY package_path
+            );
+        """)
+        db_cursor.execute("""
+            DELETE FROM Entities WHERE entityID NOT IN (
+                SELECT min(entityID) FROM Entities GROUP BY entity_name, import_path
+            );
+        """)
+        # Along with anything that still points at the rows just deleted
+        db_cursor.execute("DELETE FROM Entities WHERE fileID NOT IN (SELECT fileID FROM Files);")
+        db_cursor.execute("""
+            DELETE FROM Calls WHERE
+                entityID NOT IN (SELECT entityID FROM Entities) OR
+                called_entity_ID NOT IN (SELECT entityID FROM Entities);
+        """)
+        db_cursor.execute("DELETE FROM EntityCallNames WHERE entityID NOT IN (SELECT entityID FROM Entities);")
+        for table in CALLFLOW_DROPPED_TABLES:
+            db_cursor.execute(f"DROP TABLE IF EXISTS {table};")
+        # The reachability index was kept in ComponentReach, so it has to be built again
+        db_cursor.execute("DELETE FROM RunSettings WHERE setting_name = 'reach_index_fingerprint';")
+        createIndexes(db_cursor)
+        db_cursor.execute(f"PRAGMA user_version = {CALLFLOW_SCHEMA_VERSION};")
+        db_conn.commit()
+
     def clearTables(self, db_conn):
         db_cursor = db_conn.cursor()
         for table in CALLFLOW_TABLES:
             stmt = f"DELETE FROM {table};"
             db_cursor.execute(stmt)
 
+    def getRunSettings(self, db_conn):
+        """
+        Returns the settings the data in the db was built with as {setting_name: setting_value}
+        """
+        stmt = "SELECT setting_name, setting_value FROM RunSettings;"
+        return {row["setting_name"]: row["setting_value"] for row in db_conn.cursor().execute(stmt)}
+
+    def saveRunSettings(self, db_conn, settings):
+        stmt = "INSERT OR REPLACE INTO RunSettings (setting_name, setting_value) VALUES (?, ?);"
+        db_conn.cursor().executemany(stmt, [(k, str(v)) for k, v in settings.items()])
+        db_conn.commit()
+
     def addDiscoveredObject(self, obj):
-        self.discoveredObjects.append(obj)
+        callFlowData.registry.objects.append(obj)
+        callFlowData.registry.count += 1
 
     def getDiscoveredObjects(self):
-        return self.discoveredObjects
+        return callFlowData.registry.objects
+
+    def releaseDiscoveredObjects(self):
+        """
+        Returns the objects discovered since the last release and lets go of them
+        """
+        released = callFlowData.registry.objects
+        callFlowData.registry.objects = []
+        return released
+
+    def getDiscoveredCount(self):
+        return callFlowData.registry.count
+
+    @staticmethod
+    @contextmanager
+    def useRegistry(registry):
+        """
+        Sends the objects discovered in the with block to registry, so separate analyses in one
+        process don't see each other's objects or counts
+        """
+        previous = callFlowData.registry
+        callFlowData.registry = registry
+        try:
+            yield registry
+        finally:
+            callFlowData.registry = previous
+
+
+# Batch size for a background bulkWriter, small enough that the writes start while the analysis
+# is still going on
+BACKGROUND_BATCH_SIZE = 10000
+
+
+def emptyBuffers():
+    return {
+        "Files": [],
+        "Entities": [],
+        "EntityCallNames": [],
+        "Calls": [],
+    }
+
+
+class bulkWriter:
+    """
+    Buffers rows for the Files, Entities, EntityCallNames, and Calls tables and writes them with
+    executemany in large transactions.
+
+    Files and Entities IDs are handed out here rather than by sqlite, so callers get them straight
+    away, and duplicates are caught against in-memory sets instead of a SELECT per row.  While
+    loading, the connection runs with synchronous=OFF and an in-memory journal; the previous
+    settings are put back on exit.  Use as a context manager:
+
+        with bulkWriter(db_conn) as writer:
+            addEntityToDB(writer, ...)
+
+    With background=True the batches are written by a thread of its own, fed through a queue a
+    couple of batches deep.  sqlite lets go of the GIL while it works, so the analysis goes on
+    while earlier batches are written, and the analysis is held up rather than memory growing
+    if the writes fall behind.  Nothing else may use db_conn until the writer exits.
+    """
+
+    def __init__(self, db_conn, batch_size=100000, background=False) -> None:
+        self.db_conn = db_conn
+        self.batch_size = batch_size
+        self.background = background
+        self.batches = None
+        self.writer_thread = None
+        self.write_error = None
+        db_cursor = db_conn.cursor()
+        self.file_ids = {row[0]: row[1] for row in db_cursor.execute("SELECT package_path, fileID FROM Files;")}
+        self.entity_keys = {(row[0], row[1]) for row in db_cursor.execute("SELECT entity_name, import_path FROM Entities;")}
+        self.next_fileID = self.nextID(db_cursor, "Files", "fileID")
+        self.next_entityID = self.nextID(db_cursor, "Entities", "entityID")
+        self.buffers = emptyBuffers()
+        self.buffered = 0
+        self.saved_pragmas = None
+
+    def nextID(self, db_cursor, table, id_column):
+        # AUTOINCREMENT never reuses an ID, even after the rows are deleted, so neither do we
+        last_id = db_cursor.execute(f"SELECT max({id_column}) FROM {table};").fetchone()[0] or 0
+        try:
+            row = db_cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;", (table, )).fetchone()
+            if row is not None:
+                last_id = max(last_id, row[0])
+        except sqlite3.OperationalError:
+            # No sqlite_sequence until something has been inserted
+            pass
+        return last_id + 1
+
+    def __enter__(self):
+        self.db_conn.commit()
+        db_cursor = self.db_conn.cursor()
+        self.saved_pragmas = {
+            "synchronous": db_cursor.execute("PRAGMA synchronous;").fetchone()[0],
+            "journal_mode": db_cursor.execute("PRAGMA journal_mode;").fetchone()[0],
+        }
+        db_cursor.execute("PRAGMA synchronous = OFF;")
+        db_cursor.execute("PRAGMA journal_mode = MEMORY;")
+        if self.background:
+            self.batches = queue.Queue(maxsize=2)
+            self.writer_thread = threading.Thread(target=self.writeBatches, name="pycallflow db writer", daemon=True)
+            self.writer_thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            self.flush()
+        finally:
+            # Even after a failed write, the connection is handed back the way it came
+            try:
+                self.stopWriter()
+            finally:
+                self.restorePragmas()
+        if self.write_error is not None and exc_type is None:
+            raise self.write_error
+        return False
+
+    def stopWriter(self):
+        if self.writer_thread is not None:
+            self.batches.put(None)
+            self.writer_thread.join()
+            self.writer_thread = None
+
+    def restorePragmas(self):
+        if self.db_conn.in_transaction:
+            # Left open by the write that failed, and the pragmas can't change inside it
+            self.db_conn.rollback()
+        db_cursor = self.db_conn.cursor()
+        db_cursor.execute(f"PRAGMA journal_mode = {self.saved_pragmas['journal_mode']};")
+        db_cursor.execute(f"PRAGMA synchronous = {self.saved_pragmas['synchronous']};")
+
+    def addFile(self, file_full_path, package_path, file_mod_time, file_size=None):
+        """
+        Returns the new fileID, or None if this package path is already in the db
+        """
+        if package_path in self.file_ids:
+            return None
+        fileID = self.next_fileID
+        self.next_fileID += 1
+        self.file_ids[package_path] = fileID
+        self.buffer("Files", (fileID, file_full_path, package_path, file_mod_time, file_size))
+        return fileID
+
+    def addEntity(self, fileID, entity_name, entity_type, import_path, member_of_class=None):
+        """
+        Returns the new entityID, or None if this entity is already in the db
+        """
+        if (entity_name, import_path) in self.entity_keys:
+            return None
+        entityID = self.next_entityID
+        self.next_entityID += 1
+        self.entity_keys.add((entity_name, import_path))
+        self.buffer("Entities", (entityID, fileID, entity_name, entity_type, import_path, member_of_class))
+        return entityID
+
+    def addCallNames(self, entityID, call_names):
+        self.buffer("EntityCallNames", (entityID, call_names))
+
+    def addCall(self, entityID, called_entity_ID, collision_num):
+        self.buffer("Calls", (entityID, called_entity_ID, collision_num))
+
+    def buffer(self, table, row):
+        self.buffers[table].append(row)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        # A batch that fails isn't tried again
+        buffers = self.buffers
+        self.buffers = emptyBuffers()
+        self.buffered = 0
+        with profileTimer("sql_flush"):
+            if self.writer_thread is None:
+                self.writeBuffers(buffers)
+            elif self.write_error is None:
+                # Waits here while the writer is a full queue behind
+                self.batches.put(buffers)
+
+    def writeBatches(self):
+        # The writer thread
+        while True:
+            buffers = self.batches.get()
+            if buffers is None:
+                return
+            if self.write_error is not None:
+                # Left for __exit__ to raise, the rest are dropped
+                continue
+            try:
+                with profileTimer("sql_write"):
+                    self.writeBuffers(buffers)
+            except Exception as badnews:
+                self.db_conn.rollback()
+                self.write_error = badnews
+
+    def writeBuffers(self, buffers):
+        db_cursor = self.db_conn.cursor()
+        db_cursor.executemany("""
+            INSERT INTO Files (fileID, file_full_path, package_path, file_mod_time, file_size)
+            VALUES (?, ?, ?, ?, ?);
+        """, buffers["Files"])
+        db_cursor.executemany("""
+            INSERT INTO Entities (entityID, fileID, entity_name, entity_type, import_path, member_of_class)
+            VALUES (?, ?, ?, ?, ?, ?);
+        """, buffers["Entities"])
+        db_cursor.executemany("""
+            INSERT OR REPLACE INTO EntityCallNames (entityID, call_names)
+            VALUES (?, ?);
+        """, buffers["EntityCallNames"])
+        db_cursor.executemany("""
+            INSERT INTO Calls (entityID, called_entity_ID, collision_num)
+            VALUES (?, ?, ?);
+        """, buffers["Calls"])
+        self.db_conn.commit()
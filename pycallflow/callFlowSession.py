@@ -0,0 +1,205 @@
+"""
+A reusable analysis, for tools that want to keep one around rather than paying for a new
+collectData run (which always starts from empty tables) for every question.
+
+    from pycallflow import CallFlowSession
+
+    with CallFlowSession(db_file="myproject.db") as session:
+        session.add_target("mypackage")
+        session.add_target("scripts", directory=True)
+        flows = session.entity_results("5,11")
+        ...
+        session.refresh()   # after files have changed
+
+Each session has its own db connection and discovered object registry, so several sessions in
+one process don't see each other's data.  The targets of a session share one analysis, so calls
+are resolved across all of them.  A db_file built before with the same engine settings is kept,
+and only the files that changed since are analyzed again.
+"""
+from contextlib import contextmanager, redirect_stdout
+import importlib
+import itertools
+import os
+import sys
+
+from .callFlowData import callFlowData, objectRegistry
+from .buildFileDB import walkTargetFiles, getFileList
+from .pathFilter import pathFilter
+from .analyzeCallFlow import buildCallflowDB, CALL_NAMES_VERSION
+from .analysisCache import analysisCache
+from .incrementalUpdate import canUpdateIncrementally, resolutionChanged, refreshFiles, findAffectedEntities
+from .finalResults import generateFinalResults_object, generateEntityResults_object, generateEntityResults_selectID_object, getEntityList, callGraph, traceLimits
+from .rollupResults import generateRollupResults_selectID_object
+from .output import DOT_WRITERS, DOT_OPTIONS
+from .callflow import importTarget, entityFinder
+
+
+class CallFlowSession:
+    """
+    The analysis of one or more targets, kept up to date with refresh()
+    """
+
+    def __init__(self,  # See collectData for the settings
+        db_file = ":memory:",
+        static = False,
+        suppress_calls_to_init = False,
+        match_to_file = False,
+        cache_dir = None,
+        jobs = 1,
+        release_modules = False,
+        sandbox = False,
+        import_timeout = 60,
+        import_memory_limit = None,
+        stdout_capture_file = os.devnull,
+        exclude = None,
+        include = None,
+        gitignore = False,
+    ) -> None:
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            raise NotADirectoryError(cache_dir)
+        self.cf_data = callFlowData(sqlite3_filename=db_file)
+        self.db_conn = self.cf_data.getSqliteConnection()
+        self.registry = objectRegistry()
+        self.static = static
+        self.sandbox = sandbox
+        self.suppress_calls_to_init = suppress_calls_to_init
+        self.match_to_file = match_to_file
+        self.stdout_capture_file = stdout_capture_file
+        self.findDeclaredEntities = entityFinder(static, jobs, release_modules, sandbox, import_timeout, import_memory_limit,
+                                                 stdout_capture_file)
+        self.path_filter = pathFilter(exclude, include, gitignore)
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = analysisCache(cache_dir, static)
+        # [(target, directory, target_obj), ...]
+        self.targets = []
+        # callGraph of the whole analysis, made when first needed
+        self.call_graph = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.db_conn.close()
+
+    def add_target(self, target, directory=False):
+        """
+        Adds a package, module, or (with directory=True) directory to the analysis and analyzes
+        whatever is new.  Returns the number of files analyzed.
+        """
+        if (target, directory) not in [(t, d) for t, d, _ in self.targets]:
+            with self.analyzedCodeOutput():
+                target_obj = importTarget(target, directory, self.static, self.sandbox)
+            self.targets.append((target, directory, target_obj))
+        return self.refresh()
+
+    def refresh(self):
+        """
+        Analyzes the files of every target that were added, changed, or deleted since they were
+        last analyzed, and the calls that could have changed with them.  Returns the number of
+        files analyzed.
+        """
+        run_settings = self.runSettings()
+        previous_settings = self.cf_data.getRunSettings(self.db_conn)
+        with self.analyzedCodeOutput(), callFlowData.useRegistry(self.registry):
+            if not canUpdateIncrementally(previous_settings, run_settings, any_targets=True):
+                # Made with another engine, nothing in it can be kept
+                self.cf_data.clearTables(self.db_conn)
+                previous_settings = {}
+            target_files = itertools.chain.from_iterable(
+                walkTargetFiles(target_obj, directory, self.path_filter) for _, directory, target_obj in self.targets)
+            fileIDs, removed_names = refreshFiles(self.db_conn, target_files)
+            # Otherwise every call is resolved again
+            calls_kept = len(previous_settings) > 0 and not resolutionChanged(previous_settings, run_settings)
+            if not calls_kept or len(fileIDs) > 0 or len(removed_names) > 0:
+                forgetModules(self.db_conn, fileIDs)
+                self.findDeclaredEntities(self.db_conn, fileIDs=fileIDs, cache=self.cache)
+                entityIDs = None
+                if calls_kept:
+                    entityIDs = findAffectedEntities(self.db_conn, fileIDs, removed_names)
+                buildCallflowDB(self.db_conn, self.suppress_calls_to_init, self.match_to_file, entityIDs)
+                self.call_graph = None
+            self.cf_data.saveRunSettings(self.db_conn, run_settings)
+        return len(fileIDs)
+
+    def runSettings(self):
+        # The same as collectData's when there is one target, so the CLI can pick up the db too
+        return {
+            "target": ",".join(target for target, _, _ in self.targets),
+            "directory": ",".join(str(directory) for _, directory, _ in self.targets),
+            "static": self.static,
+            "suppress_calls_to_init": self.suppress_calls_to_init,
+            "match_to_file": self.match_to_file,
+            "call_names_version": CALL_NAMES_VERSION,
+        }
+
+    @contextmanager
+    def analyzedCodeOutput(self):
+        # Code run while importing the targets writes here instead of stdout
+        with open(self.stdout_capture_file, "a") as stdout_cap, redirect_stdout(stdout_cap):
+            yield
+
+    def entity_list(self):
+        """
+        The entities found, as -o entity_list lists them
+        """
+        return getEntityList(self.db_conn)
+
+    def entity_results(self, select_entity_id=None, max_depth_up=None, max_depth_down=None, max_fan_out=None):
+        """
+        The generateEntityResults_object results for the entities that call, or are called from,
+        the selected ones.  Every entity if select_entity_id is None.
+        select_entity_id - "5,11" or [5, 11]
+        max_depth_up, max_depth_down, max_fan_out - limits for the trace [no limit]
+        """
+        if self.call_graph is None:
+            self.call_graph = callGraph(generateEntityResults_object(self.db_conn))
+        if select_entity_id is None:
+            return self.call_graph.allResults()
+        return generateEntityResults_selectID_object(self.db_conn, selectString(select_entity_id), call_graph=self.call_graph,
+                                                     max_depth_up=max_depth_up, max_depth_down=max_depth_down,
+                                                     max_fan_out=max_fan_out)
+
+    def final_results(self):
+        """
+        Entities and their calls by file, as -o simple shows them
+        """
+        return generateFinalResults_object(self.db_conn)
+
+    def dot(self, select_entity_id=None, dot_writer="stream", granularity="entity", **kwargs):
+        """
+        Returns the DOT text -o dot would print
+        granularity - "entity", or "file", "package" or "class" for a rolled up graph
+        kwargs - the dot output options (see DOT_OPTIONS) for any that aren't the defaults, and
+                 max_depth_up, max_depth_down or max_fan_out to limit the trace
+        """
+        if select_entity_id is not None:
+            select_entity_id = selectString(select_entity_id)
+        options = dict(DOT_OPTIONS, **kwargs)
+        if granularity != "entity":
+            results = generateRollupResults_selectID_object(self.db_conn, granularity, select_entity_id,
+                                                            suppress_class_references=options["suppress_class_references"],
+                                                            **traceLimits(options))
+            return DOT_WRITERS[dot_writer]().rollup_output(results, output_to_stdout=False, **options)
+        return DOT_WRITERS[dot_writer]().output(self.entity_results(select_entity_id, **traceLimits(options)),
+                                                output_to_stdout=False, select_entity_id=select_entity_id, **options)
+
+
+def selectString(select_entity_id):
+    if isinstance(select_entity_id, str):
+        return select_entity_id
+    return ",".join(str(id) for id in select_entity_id)
+
+
+def forgetModules(db_conn, fileIDs):
+    """
+    Drops the modules of these files from sys.modules, so importing them again runs the files
+    as they are now rather than handing back what was imported before they changed
+    """
+    for f in getFileList(db_conn):
+        if f["fileID"] in fileIDs:
+            sys.modules.pop(f["package_path"], None)
+    importlib.invalidate_caches()
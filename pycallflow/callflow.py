@@ -1,20 +1,35 @@
-from contextlib import closing, redirect_stdout
+from contextlib import closing, redirect_stdout, nullcontext
 import argparse
+import functools
 import importlib
 from pprint import pprint
 import sys
 import os
 import traceback
 
-from .callFlowData import callFlowData
-from .buildFileDB import buildFileDB
+from .callFlowData import callFlowData, objectRegistry
+from .buildFileDB import walkTargetFiles
+from .pathFilter import pathFilter
 from .buildDeclaredEntitiesDB import findDeclaredEntities_inlineSave
-from .analyzeCallFlow import buildCallflowDB
-from .finalResults import generateFinalResults_object, generateEntityResults_selectID_object, getEntityList
-from .output import simpleTextOutput, pydot_output, entity_list_output, all_entity_flow
+from .analyzeCallFlow import buildCallflowDB, CALL_NAMES_VERSION
+from .staticAnalysis import findDeclaredEntities_static, findStaticTarget
+from .analysisCache import analysisCache
+from .parallelAnalysis import findDeclaredEntities_parallel
+from .sandboxAnalysis import findDeclaredEntities_sandboxed
+from .incrementalUpdate import canUpdateIncrementally, resolutionChanged, refreshFileDB, findAffectedEntities
+from .finalResults import generateFinalResults_object, generateEntityResults_selectID_object, getEntityList, traceLimits
+from .reachabilityIndex import generateEntityResults_indexed
+from .rollupResults import generateRollupResults_selectID_object, GRANULARITIES
+from .queryServer import serve_run
+from .profiling import runProfile, profilePhase
+from .output import simpleTextOutput, pydot_output, entity_list_output, all_entity_flow, DOT_WRITERS
 
     
 def cli_run():
+    if sys.argv[1:2] == ["serve"]:
+        # pycallflow serve has options of its own
+        serve_run(sys.argv[2:])
+        return
     version = "0.1.0"
     #  Arguments
     description = f"pycallflow v{version}: "
@@ -31,6 +46,8 @@ def cli_run():
                         "TB", "BT", "RL", "LR"], default="LR", help="See Graphviz documentation")
     parser.add_argument("--edge_color", type=str, default="rotate",
                         help="Use an X11 color scheme name or 'rotate' to rotate through X11 colors")
+    parser.add_argument("--dot_writer", type=str, choices=["pydot", "stream"], default="pydot", help="How 'dot' and 'entity_flow_graphs' output is made.  'stream' writes the same DOT text without building a pydot graph first, which is much faster and uses far less memory on large graphs.")
+    parser.add_argument("--granularity", type=str, choices=GRANULARITIES, default="entity", help="What each node of 'dot' output stands for.  'file', 'package' and 'class' collapse the entities of each file, package, or class (methods into their class) into one node, with one edge per pair of nodes labeled with the number of calls it stands for.  These render in seconds on code bases whose entity graph Graphviz can't lay out, and --select_entity_id still narrows them down.")
     parser.add_argument("--suppress_recursive_calls", action="store_true", help="Hides edges for entities that call themselves")
     parser.add_argument("--combine_calls", action="store_true", help="Will only show one directed edge between two entities, regardless of actual number of calls")
     parser.add_argument("--suppress_class_references", action="store_true", help="Will suppress explicit edges representing references to a class (method calls will remain)")
@@ -39,9 +56,27 @@ def cli_run():
     parser.add_argument("--stdout_capture_file", type=str, default=os.devnull, help="Since the examined code is actually imported any code not protected with a __main__ clause will run. Stdout is normally redirected to os.devnull to prevent output corruption.  Specify another filename if you would like to capture the output from the analyzed code.")
     parser.add_argument("--select_entity_id", type=str, default=None,
                         help="Comma separated list of specific entity ID numbers to trace.  Use -oentity_list to get the entity ID.  The entity ID will remain constant if there are no changes to the files or added files.")
+    parser.add_argument("--max_depth_up", type=nonNegativeInt, default=None, help="With --select_entity_id, only follow this many calls back from the selected entities (their callers, their callers' callers, ...).  Callers left out are shown as a '+N more' node.")
+    parser.add_argument("--max_depth_down", type=nonNegativeInt, default=None, help="With --select_entity_id, only follow this many calls on from the selected entities.  Calls left out are shown as a '+N more' node.")
+    parser.add_argument("--max_fan_out", type=nonNegativeInt, default=None, help="With --select_entity_id, only follow the first this many calls from (or to) each entity on the way, with the rest shown as a '+N more' node")
     parser.add_argument("--suppress_calls_to_init", action="store_true", help="Will not show calls going to __init__ functions.  These can be very noisy if a superclass has many subclasses.")
     parser.add_argument("--clean", action="store_true", help="Will set all graph simplification options to true")
     parser.add_argument("--match_to_file", action="store_true", help="Ambiguous calls happen if there are multiple entities with the same name in seprate files.  Setting this flag will make pycallflow choose calls from the same file, if they exist")
+    parser.add_argument("--static", action="store_true", help="Parse the target files with ast instead of importing them.  Nothing in the target is executed, which is much faster on large code bases and safe to run in CI.  Calls are found from the source text rather than the bytecode.")
+    parser.add_argument("--exclude", type=str, action="append", default=None, help="Skip the files and directories matching this .gitignore style pattern, e.g. 'tests', 'build/' or 'vendor/**/*.py'.  Patterns without a / match names at any depth, ones with a / match paths from the target.  Excluded directories are never walked into.  Can be given more than once.  Hidden directories (.venv, .tox, .git, ...) and __pycache__ are always skipped.")
+    parser.add_argument("--include", type=str, action="append", default=None, help="Only analyze the files matching this pattern (same form as --exclude), or in a directory that does.  Can be given more than once.")
+    parser.add_argument("--gitignore", action="store_true", help="Also skip whatever the .gitignore files in the target, and above it up to the top of its git work tree, ignore")
+    parser.add_argument("--incremental", action="store_true", help="Reuse the analysis saved in --db_file.  Only files that were added, deleted, or changed (modification time or size) since the last run are re-imported, and only the calls that could have changed are rebuilt.  Falls back to a full analysis if the db is empty or was built from a different target.")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Directory to keep a cache of per-file analysis results in.  Entries are keyed by the contents of each file (and the pycallflow and Python versions), so unchanged files are not imported again even from a fresh checkout.  The directory must exist.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes used to import and disassemble files.  Use 0 for one per CPU.  Results are identical to a single process run.")
+    parser.add_argument("--release_modules", action="store_true", help="Drop each imported module once its entities and call names are saved, so memory use grows with the largest module rather than the whole target.  Any of the target's modules imported again by a later file are run again.  Ignored with --static and --sandbox.")
+    parser.add_argument("--sandbox", action="store_true", help="Import every file in its own short lived process.  A file that hangs or runs out of memory on import is skipped (and reported) instead of stalling or crashing the analysis, and nothing the analyzed code does at import time leaks into pycallflow.  Use --jobs to import several files at once.  Ignored with --static.")
+    parser.add_argument("--import_timeout", type=float, default=60, help="With --sandbox, seconds each file gets to import before it is skipped")
+    parser.add_argument("--import_memory_limit", type=int, default=None, help="With --sandbox, MB of memory each file's import process may allocate before it is stopped and the file skipped")
+    parser.add_argument("--render_jobs", type=int, default=1, help="Number of dot processes -o entity_flow_graphs runs at once.  Use 0 for one per CPU.")
+    parser.add_argument("--render_timeout", type=float, default=300, help="Seconds -o entity_flow_graphs gives dot to render each image before counting it as failed")
+    parser.add_argument("--profile", type=str, default=None, help="Write a JSON report of the wall time, CPU time and peak memory of each phase, along with counts of files, entities, instructions scanned, calls, SQL statements and ambiguous edges, to this file")
+    parser.add_argument("--profile_dir", type=str, default=None, help="With --profile, also dump a cProfile .prof file for each phase into this directory")
     parser.add_argument("--save_images_to", type=str, default="images", help="Set this to the directory you want -o entity_flow_graphs to save the images")
     ### Not implemented
     # parser.add_argument("--highlight_orphans", action="store_true", help="Will highlight entities that are never called (possible dead code).  Only does anything in with 'dot' output")
@@ -59,18 +94,54 @@ def cli_run():
         args_cp["suppress_calls_to_init"] = True
         args_cp["match_to_file"] = True
     
+    if args.cache_dir is not None and not os.path.isdir(args.cache_dir):
+        print(f"The {args.cache_dir} directory does not exist, please create it and try again")
+        return
+
+    profile = nullcontext()
+    if args.profile is not None:
+        try:
+            profile = runProfile(args.profile, args.profile_dir)
+        except NotADirectoryError:
+            print(f"The {args.profile_dir} directory does not exist, please create it and try again")
+            return
+
+    with profile:
+        cliOutput(args, args_cp)
+
+def cliOutput(args, args_cp):
     cf_data = collectData(**args_cp)
     with cf_data.getSqliteConnection() as conn:
         if args.output == "entity_list":
-            results = getEntityList(conn)
-            entity_list_output(results)
+            with profilePhase("results"):
+                results = getEntityList(conn)
+            with profilePhase("output"):
+                entity_list_output(results)
+        elif args.output == "dot" and args.granularity != "entity":
+            with profilePhase("results"):
+                results = generateRollupResults_selectID_object(conn, args.granularity, args.select_entity_id,
+                                                                indexed=cf_data.reused_analysis,
+                                                                suppress_class_references=args_cp["suppress_class_references"],
+                                                                **traceLimits(args_cp))
+            with profilePhase("output"):
+                DOT_WRITERS[args.dot_writer]().rollup_output(results, **args_cp)
         elif args.output == "dot":
-            results = generateEntityResults_selectID_object(conn, select_entity_id=args.select_entity_id)
-            pydot_output().output(results, **args_cp)
+            with profilePhase("results"):
+                if cf_data.reused_analysis and all(limit is None for limit in traceLimits(args_cp).values()):
+                    # Later selects against the same analysis reuse the index this saves.  A fresh
+                    # analysis would have to build it first, which costs more than one trace.
+                    # It only knows about whole closures, so limited traces walk the graph.
+                    results = generateEntityResults_indexed(conn, args.select_entity_id)
+                else:
+                    results = generateEntityResults_selectID_object(conn, select_entity_id=args.select_entity_id,
+                                                                    **traceLimits(args_cp))
+            with profilePhase("output"):
+                DOT_WRITERS[args.dot_writer]().output(results, **args_cp)
         elif args.output == "entity_flow_graphs":
             try:
-                aef = all_entity_flow(args.save_images_to)
-                aef.generate_all_entity_flows(conn, **args_cp)
+                aef = all_entity_flow(args.save_images_to, args.render_jobs, args.render_timeout)
+                with profilePhase("entity_flow_graphs"):
+                    aef.generate_all_entity_flows(conn, **args_cp)
             except FileNotFoundError:
                 
                 print("'entity_flow_graphs' mode requires Graphviz and dot to be installed and on the system path")
@@ -83,8 +154,19 @@ def cli_run():
                 print(f"Unable to complete processing because {badnews}")
                 return
         else:
-            results = generateFinalResults_object(conn)
-            simpleTextOutput(results)
+            with profilePhase("results"):
+                results = generateFinalResults_object(conn)
+            with profilePhase("output"):
+                simpleTextOutput(results)
+
+def nonNegativeInt(value):
+    """
+    argparse type for the trace limits
+    """
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, not {value}")
+    return number
 
 def collectData( # See argparse list in cli_run()
     target,
@@ -94,6 +176,17 @@ def collectData( # See argparse list in cli_run()
     stdout_capture_file = os.devnull,
     suppress_calls_to_init = False,
     match_to_file = False,
+    static = False,
+    incremental = False,
+    cache_dir = None,
+    jobs = 1,
+    release_modules = False,
+    sandbox = False,
+    import_timeout = 60,
+    import_memory_limit = None,
+    exclude = None,
+    include = None,
+    gitignore = False,
     **kwargs        # Catch all     
 ):
     """
@@ -102,6 +195,17 @@ def collectData( # See argparse list in cli_run()
     db_file - Name of sqlite3 db file to generate [:memory:]
     verbose - Set True for status updates [False]
     stdout_capture_file  - filename to capture any output from the analyzed code [os.devnull]
+    static - Set True to parse the files with ast instead of importing them [False]
+    incremental - Set True to only re-analyze files that changed since the data in db_file was built [False]
+    cache_dir - directory to cache per-file analysis results in [None]
+    jobs - number of worker processes to discover entities with, 0 for one per CPU [1]
+    release_modules - Set True to drop each imported module once its entities are saved [False]
+    sandbox - Set True to import each file in its own process [False]
+    import_timeout - with sandbox, seconds a file gets to import before it is skipped [60]
+    import_memory_limit - with sandbox, MB each file's import process may allocate [None]
+    exclude - list of patterns of files and directories to skip [None]
+    include - list of patterns, only files matching one are analyzed [None]
+    gitignore - Set True to also skip what the target's .gitignore files ignore [False]
     """
     verbose_out_f = None
     cf_data = None
@@ -113,28 +217,99 @@ def collectData( # See argparse list in cli_run()
     with open(stdout_capture_file, "w") as stdout_cap:
         with redirect_stdout(stdout_cap):
             # import the target
-            target_obj = ""
-            if directory:
-                target_obj = target
-            else:
-                target_obj = importlib.import_module(target)
+            with profilePhase("import_target"):
+                target_obj = importTarget(target, directory, static, sandbox)
 
             cf_data = callFlowData(sqlite3_filename=db_file)
-            with cf_data.getSqliteConnection() as conn:
+            run_settings = {
+                "target": target,
+                "directory": directory,
+                "static": static,
+                "suppress_calls_to_init": suppress_calls_to_init,
+                "match_to_file": match_to_file,
+                "call_names_version": CALL_NAMES_VERSION,
+            }
+            findDeclaredEntities = entityFinder(static, jobs, release_modules, sandbox, import_timeout, import_memory_limit,
+                                                stdout_capture_file)
+            cache = None
+            if cache_dir is not None:
+                cache = analysisCache(cache_dir, static)
+            path_filter = pathFilter(exclude, include, gitignore)
+            with cf_data.getSqliteConnection() as conn, callFlowData.useRegistry(objectRegistry()):
+                profile = runProfile.active
+                if profile is not None:
+                    profile.settings = dict(run_settings, incremental=incremental, jobs=jobs, cache_dir=cache_dir, sandbox=sandbox,
+                                            release_modules=release_modules)
+                    profile.countSQL(conn)
                 db_cursor = conn.cursor()
-                print("[-] Clearing old data", file=verbose_out_f)
-                cf_data.clearTables(conn)
-                print("[-] Building file list", file=verbose_out_f)
-                buildFileDB(target_obj, conn, directory)
-                print("[-] Building declared entity DB", file=verbose_out_f)
-                findDeclaredEntities_inlineSave(conn)
-                print(
-                    f"[-] Found {len(cf_data.getDiscoveredObjects())} objects", file=verbose_out_f)
-                buildCallflowDB(conn, suppress_calls_to_init, match_to_file)
+                previous_settings = cf_data.getRunSettings(conn)
+                if incremental and canUpdateIncrementally(previous_settings, run_settings):
+                    cf_data.reused_analysis = True
+                    print("[-] Updating file list", file=verbose_out_f)
+                    with profilePhase("refresh_files"):
+                        fileIDs, removed_names = refreshFileDB(target_obj, conn, directory, path_filter)
+                    print(f"[-] Updating declared entity DB for {len(fileIDs)} changed files", file=verbose_out_f)
+                    with profilePhase("find_entities"):
+                        findDeclaredEntities(conn, fileIDs=fileIDs, cache=cache)
+                    with profilePhase("build_calls"):
+                        entityIDs = None
+                        if not resolutionChanged(previous_settings, run_settings):
+                            entityIDs = findAffectedEntities(conn, fileIDs, removed_names)
+                        buildCallflowDB(conn, suppress_calls_to_init, match_to_file, entityIDs)
+                else:
+                    print("[-] Clearing old data", file=verbose_out_f)
+                    with profilePhase("clear_tables"):
+                        cf_data.clearTables(conn)
+                    print("[-] Building file list and declared entity DB", file=verbose_out_f)
+                    with profilePhase("find_entities"):
+                        # Each file is analyzed as soon as the walk finds it
+                        findDeclaredEntities(conn, cache=cache,
+                                             target_files=walkTargetFiles(target_obj, directory, path_filter))
+                    print(
+                        f"[-] Found {cf_data.getDiscoveredCount()} objects", file=verbose_out_f)
+                    with profilePhase("build_calls"):
+                        buildCallflowDB(conn, suppress_calls_to_init, match_to_file)
+                if cache is not None:
+                    print(f"[-] Analysis cache: {cache.hits} hits, {cache.misses} misses", file=verbose_out_f)
+                cf_data.saveRunSettings(conn, run_settings)
+                if profile is not None:
+                    profile.countResults(conn)
+                    if cache is not None:
+                        profile.counters["cache_hits"] = cache.hits
+                        profile.counters["cache_misses"] = cache.misses
     
     if not verbose:
         # Make sure to clean up the os.devnull file
         verbose_out_f.close()
 
     return cf_data        
-    
+
+def importTarget(target, directory=False, static=False, sandbox=False):
+    """
+    Returns what walkTargetFiles needs for the target: the directory name, or its package
+    """
+    if directory:
+        return target
+    if static or sandbox:
+        # Found without importing it, so the target's own code only runs in a sandbox
+        return findStaticTarget(target)
+    return importlib.import_module(target)
+
+def entityFinder(static=False, jobs=1, release_modules=False, sandbox=False, import_timeout=60, import_memory_limit=None,
+                 stdout_capture_file=os.devnull):
+    """
+    Returns the findDeclaredEntities function for these settings (see collectData), called as
+    findDeclaredEntities(db_conn, fileIDs=None, cache=None, target_files=None)
+    """
+    findDeclaredEntities = functools.partial(findDeclaredEntities_inlineSave, release_modules=release_modules)
+    if static:
+        findDeclaredEntities = findDeclaredEntities_static
+    if jobs != 1:
+        findDeclaredEntities = functools.partial(findDeclaredEntities_parallel, jobs=jobs, static=static,
+                                                 stdout_capture_file=stdout_capture_file,
+                                                 release_modules=release_modules)
+    if sandbox and not static:
+        findDeclaredEntities = functools.partial(findDeclaredEntities_sandboxed, jobs=jobs, timeout=import_timeout,
+                                                 memory_limit=import_memory_limit,
+                                                 stdout_capture_file=stdout_capture_file)
+    return findDeclaredEntities
@@ -0,0 +1,236 @@
+"""
+Compact call graph for tracing.
+
+Entities are numbered 0..n-1 and the calls between them are kept in compressed sparse row form:
+for each direction one offsets array and one flat array of targets, so the neighbours of node n
+are targets[offsets[n]:offsets[n + 1]].  These are array module arrays, a few bytes per edge
+instead of the dict and set entries of an adjacency dict, and they are built straight from the
+Calls table without making a results object first.
+
+Self calls and repeated calls between the same two entities are dropped, tracing doesn't need
+them.
+"""
+from array import array
+from itertools import compress
+import sys
+
+
+class compactGraph:
+    """
+    Forward (caller to called) and reverse adjacency of the call graph
+    """
+
+    def __init__(self, entityIDs, called) -> None:
+        """
+        entityIDs - every entity, in the order they are numbered
+        called - {entityID: the entityIDs it calls}, calls to unknown entities are skipped
+        """
+        self.entityIDs = array("q", entityIDs)
+        self.num_nodes = len(self.entityIDs)
+        self.index_of = dict(zip(self.entityIDs, range(self.num_nodes)))
+        offsets = array("q", [0])
+        targets = array("q")
+        for n, entityID in enumerate(self.entityIDs):
+            called_n = set(map(self.index_of.get, called.get(entityID, ())))
+            called_n.discard(None)
+            called_n.discard(n)
+            targets.extend(sorted(called_n))
+            offsets.append(len(targets))
+        self.forward = csrAdjacency(offsets, targets)
+        self.reverse = self.forward.reversed()
+
+    def reach(self, seeds, adjacency, max_depth=None, max_fan_out=None):
+        """
+        Marks the nodes reachable along adjacency from any of seeds (node numbers), seeds
+        included.  Each round expands the whole frontier, so any number of seeds costs one
+        traversal.  Returns a bytearray with a 1 for every node reached.
+        max_depth - stop after this many rounds [no limit]
+        max_fan_out - only follow the first this many neighbours of each node [no limit]
+        """
+        offsets = adjacency.offsets
+        targets = adjacency.targets
+        fan_out = self.num_nodes if max_fan_out is None else max_fan_out
+        reached = bytearray(self.num_nodes)
+        frontier = []
+        for n in seeds:
+            if not reached[n]:
+                reached[n] = 1
+                frontier.append(n)
+        depth = 0
+        while frontier and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_frontier = []
+            for n in frontier:
+                for to_n in targets[offsets[n]:min(offsets[n + 1], offsets[n] + fan_out)]:
+                    if not reached[to_n]:
+                        reached[to_n] = 1
+                        next_frontier.append(to_n)
+            frontier = next_frontier
+        return reached
+
+    def traceIDs(self, select_entity_id_list):
+        """
+        Returns the set of entities that call, or are called from, the selected entities
+        (directly or not), the selected ones included
+        """
+        seeds = self.seedNodes(select_entity_id_list)
+        downstream = self.reach(seeds, self.forward)
+        upstream = self.reach(seeds, self.reverse)
+        return set(compress(self.entityIDs, map(max, downstream, upstream)))
+
+    def boundedTraceIDs(self, select_entity_id_list, max_depth_up=None, max_depth_down=None, max_fan_out=None):
+        """
+        traceIDs, but only following max_depth_down calls on from the selected entities and
+        max_depth_up calls back into them, and at most max_fan_out calls from (or to) each
+        entity on the way.  The traversal stops there, the rest of the closure is never visited.
+        returns keep, hidden_calls, hidden_callers
+            keep - set of entityIDs
+            hidden_calls - {entityID: number of entities it calls that were left out}
+            hidden_callers - {entityID: number of entities calling it that were left out}
+        """
+        for name, limit in [("max_depth_up", max_depth_up), ("max_depth_down", max_depth_down), ("max_fan_out", max_fan_out)]:
+            if limit is not None and limit < 0:
+                raise ValueError(f"{name} must be 0 or more, not {limit}")
+        seeds = self.seedNodes(select_entity_id_list)
+        downstream = self.reach(seeds, self.forward, max_depth_down, max_fan_out)
+        upstream = self.reach(seeds, self.reverse, max_depth_up, max_fan_out)
+        kept = bytes(map(max, downstream, upstream))
+        return (set(compress(self.entityIDs, kept)), self.leftOut(downstream, kept, self.forward),
+                self.leftOut(upstream, kept, self.reverse))
+
+    def leftOut(self, reached, kept, adjacency):
+        """
+        {entityID: number of neighbours not kept} for the reached nodes that have any
+        """
+        left_out = {}
+        for n in compress(range(self.num_nodes), reached):
+            count = sum(not kept[to_n] for to_n in adjacency.neighbors(n))
+            if count > 0:
+                left_out[self.entityIDs[n]] = count
+        return left_out
+
+    def seedNodes(self, select_entity_id_list):
+        seeds = []
+        for entityID in select_entity_id_list:
+            if entityID not in self.index_of:
+                print(f"compactGraph.traceIDs: No entity with ID {entityID}", file=sys.stderr)
+                continue
+            seeds.append(self.index_of[entityID])
+        return seeds
+
+
+def compactGraphFromDB(db_conn):
+    """
+    The compactGraph of the whole db, straight from the Calls table
+    """
+    db_cursor = db_conn.cursor()
+    # Plain tuples, sqlite3.Row costs more than the rest of the build
+    db_cursor.row_factory = None
+    entityIDs = [row[0] for row in db_cursor.execute("SELECT entityID FROM Entities ORDER BY entityID;")]
+    stmt = """
+        SELECT
+            entityID,
+            group_concat(DISTINCT called_entity_ID)
+        FROM
+            Calls
+        GROUP BY
+            entityID;
+    """
+    called = {row[0]: map(int, row[1].split(",")) for row in db_cursor.execute(stmt)}
+    return compactGraph(entityIDs, called)
+
+
+def compactGraphFromResults(results_object):
+    """
+    The compactGraph of a generateEntityResults_object result, numbered in its order
+    """
+    called = {k: (to_id for call in v["calls"] for to_id in call) for k, v in results_object.items()}
+    return compactGraph(results_object.keys(), called)
+
+
+class csrAdjacency:
+    """
+    One direction of a compactGraph
+    """
+
+    def __init__(self, offsets, targets) -> None:
+        self.offsets = offsets
+        self.targets = targets
+
+    def neighbors(self, n):
+        return self.targets[self.offsets[n]:self.offsets[n + 1]]
+
+    def reversed(self):
+        """
+        The same edges the other way round.  A counting sort, so each node's neighbours stay
+        in order.
+        """
+        # Worked out in lists, which index faster than arrays
+        num_nodes = len(self.offsets) - 1
+        offsets = [0] * (num_nodes + 1)
+        for to_n in self.targets:
+            offsets[to_n + 1] += 1
+        for n in range(num_nodes):
+            offsets[n + 1] += offsets[n]
+        targets = [0] * len(self.targets)
+        next_slot = offsets[:-1]
+        for n in range(num_nodes):
+            for to_n in self.targets[self.offsets[n]:self.offsets[n + 1]]:
+                targets[next_slot[to_n]] = n
+                next_slot[to_n] += 1
+        return csrAdjacency(array("q", offsets), array("q", targets))
+
+
+def stronglyConnectedComponents(graph):
+    """
+    Iterative Tarjan's algorithm over a compactGraph.  Components come out in reverse
+    topological order: every component another one can reach comes before it.
+    returns components, component_of
+        components - list of lists of node numbers
+        component_of - list of the component of each node
+    """
+    offsets = graph.forward.offsets
+    targets = graph.forward.targets
+    index_of = [-1] * graph.num_nodes
+    lowlink = [0] * graph.num_nodes
+    on_stack = bytearray(graph.num_nodes)
+    component_of = [-1] * graph.num_nodes
+    stack = []
+    components = []
+    next_index = 0
+    for root in range(graph.num_nodes):
+        if index_of[root] != -1:
+            continue
+        index_of[root] = lowlink[root] = next_index
+        next_index += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, iter(targets[offsets[root]:offsets[root + 1]]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if index_of[child] == -1:
+                    index_of[child] = lowlink[child] = next_index
+                    next_index += 1
+                    stack.append(child)
+                    on_stack[child] = 1
+                    work.append((child, iter(targets[offsets[child]:offsets[child + 1]])))
+                    break
+                if on_stack[child]:
+                    lowlink[node] = min(lowlink[node], index_of[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index_of[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component_of[member] = len(components)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components, component_of
@@ -1,8 +1,11 @@
-import networkx as nx
 import sys
 
+from .compactGraph import compactGraphFromDB, compactGraphFromResults, stronglyConnectedComponents
+
 def generateFinalResults_object(db_conn):
     toreturn = {}
+    calls_by_entity = getCallsByEntity(db_conn.cursor())
+    call_entries = getCallEntries(db_conn.cursor())
     for row in getFileEntityJoin(db_conn.cursor()):
         entity_name = row["entity_name"]
         if row["entity_type"] == "class":
@@ -19,12 +22,9 @@ def generateFinalResults_object(db_conn):
             "entity_name":entity_name,
             "calls":[]
         }
-        for row in getCallForEntity(db_conn.cursor(), row["entityID"]):
-            these_calls = []
-            called_entity_IDs = row["found_calls"].split(",")
-            for id in called_entity_IDs:
-                thiscall = getCallEntryForEntityID(db_conn.cursor(), int(id))
-                these_calls.append(thiscall)
+        for called_entity_IDs in calls_by_entity.get(row["entityID"], []):
+            # Every call gets its own copy, same as getCallEntryForEntityID gave
+            these_calls = [dict(call_entries[id]) for id in called_entity_IDs]
             entity_to_add["calls"].append(these_calls)
             
         toreturn[package_path]["entities"].append(entity_to_add)
@@ -33,7 +33,7 @@ def generateFinalResults_object(db_conn):
 
 
 def getFileEntityJoin(db_cursor):
-    # Returns list from SQL query
+    # Returns the rows from SQL query as they are read
     stmt = """
         select
             Files.fileID,
@@ -48,7 +48,7 @@ def getFileEntityJoin(db_cursor):
         JOIN
             Files on Entities.fileID=Files.fileID;
     """
-    return db_cursor.execute(stmt).fetchall()
+    return db_cursor.execute(stmt)
 
 def getCallForEntity(db_cursor, entityID):
     # returns list from SQL query
@@ -84,6 +84,65 @@ def getInfoForEntity(db_cursor, entityID):
         break
     return toreturn
 
+def getCallsByEntity(db_cursor, entityIDs=None):
+    """
+    All of the calls in one pass, as {entityID: [[called_entity_ID, ...], ...]}
+    Same lists, in the same order, as running getCallForEntity for each entity
+    entityIDs - only the calls made by these entities [all entities]
+    """
+    if entityIDs is not None:
+        return getCallsBySelectedEntity(db_cursor, entityIDs)
+    stmt = """
+        select
+            entityID,
+            GROUP_CONCAT(called_entity_ID) as found_calls
+        from
+            Calls
+        group by
+            collision_num;
+    """
+    toreturn = {}
+    for row in db_cursor.execute(stmt):
+        these_calls = [int(called_id) for called_id in row["found_calls"].split(",")]
+        toreturn.setdefault(row["entityID"], []).append(these_calls)
+    return toreturn
+
+def getCallsBySelectedEntity(db_cursor, entityIDs):
+    """
+    getCallsByEntity for a set of entities.  Rows come back in the same (collision_num, callID)
+    order the GROUP BY above reads them through the Calls_collision_num index, and are grouped here
+    """
+    selectEntities(db_cursor, entityIDs)
+    stmt = """
+        select
+            entityID,
+            called_entity_ID,
+            collision_num
+        from
+            Calls
+        where
+            entityID in (select entityID from temp.SelectedEntities)
+        order by
+            collision_num, callID;
+    """
+    toreturn = {}
+    last_collision_num = None
+    for row in db_cursor.execute(stmt):
+        if row["collision_num"] != last_collision_num:
+            these_calls = []
+            toreturn.setdefault(row["entityID"], []).append(these_calls)
+            last_collision_num = row["collision_num"]
+        these_calls.append(row["called_entity_ID"])
+    return toreturn
+
+def selectEntities(db_cursor, entityIDs):
+    """
+    Puts entityIDs in the temp.SelectedEntities table, for queries to join against
+    """
+    db_cursor.execute("CREATE TEMP TABLE IF NOT EXISTS SelectedEntities (entityID INTEGER PRIMARY KEY);")
+    db_cursor.execute("DELETE FROM temp.SelectedEntities;")
+    db_cursor.executemany("INSERT INTO temp.SelectedEntities (entityID) VALUES (?);", [(id, ) for id in entityIDs])
+
 def getCallEntryForEntityID(db_cursor, entityID):
     """
     Produces a:
@@ -94,11 +153,38 @@ def getCallEntryForEntityID(db_cursor, entityID):
     For adding to final results
     """
     toreturn = getInfoForEntity(db_cursor, entityID)
+    decorateCallEntry(toreturn)
+    return toreturn
+
+def decorateCallEntry(call_entry):
     # Adding some decorators to allow easy ID in final report
-    if toreturn["entity_type"] == "class":
-        toreturn["entity_name"] += ":"
-    elif toreturn["entity_type"] == "function":
-        toreturn["entity_name"] += "()"
+    if call_entry["entity_type"] == "class":
+        call_entry["entity_name"] += ":"
+    elif call_entry["entity_type"] == "function":
+        call_entry["entity_name"] += "()"
+
+def getCallEntries(db_cursor):
+    """
+    getCallEntryForEntityID for every entity at once, as {entityID: call entry}
+    """
+    stmt = """
+        SELECT
+            entityID,
+            entity_name,
+            entity_type,
+            import_path
+        FROM
+            Entities;
+    """
+    toreturn = {}
+    for row in db_cursor.execute(stmt):
+        call_entry = {
+            "entity_name": row["entity_name"],
+            "entity_type": row["entity_type"],
+            "import_path": row["import_path"],
+        }
+        decorateCallEntry(call_entry)
+        toreturn[row["entityID"]] = call_entry
     return toreturn
 
 """
@@ -118,7 +204,10 @@ Might need:
                         entity_id, entity_id2
                     ]
                 ]
-
+        # Only from a trace bounded by max_depth_up, max_depth_down or max_fan_out, and only when
+        # some were left out
+        "hidden_calls": number of entities it calls that were left out
+        "hidden_callers": number of entities calling it that were left out
     }
 }
 """
@@ -127,73 +216,193 @@ Might need:
 def generateEntityResults_selectID_object(
         db_conn,
         select_entity_id,
+        call_graph = None,
+        max_depth_up = None,
+        max_depth_down = None,
+        max_fan_out = None,
 ):
-    results_object = generateEntityResults_object(db_conn)
-    # return results_object
-
+    """
+    call_graph - callGraph to trace with, so tracing many entities only reads the db once [None]
+    max_depth_up - only follow this many calls back from the selected entities [no limit]
+    max_depth_down - only follow this many calls on from the selected entities [no limit]
+    max_fan_out - only follow this many calls from (or to) each entity [no limit]
+    """
     if select_entity_id is None:
-        return results_object
-
-    # if there are select_entity_id, we make a quick networkx graph and use it to trace the call flows
-    nx_g = nx.DiGraph()
-    
-    for n, (k, v) in enumerate(results_object.items()):
-        for call in v["calls"]:
-            for to_id in call:
-                if k == to_id:
-                    continue
-                nx_g.add_edge(k, to_id)
+        if call_graph is None:
+            return generateEntityResults_object(db_conn)
+        return call_graph.results_object
 
     try:
         select_entity_id_list = [int(i) for i in select_entity_id.split(",")]
     except Exception as badnews:
         print(
-            f"generateFinalResults_selectID_object: Unable to parse select_entity_id: {select_entity_id}", sys.stderr)
-        return results_object
-
-    # now trace the results
-    # only do this once
-    nx_g_reverse = nx_g.reverse()
-    list_of_nodes_to_keep = select_entity_id_list.copy()
-    for node_id in select_entity_id_list:
-        # Forward first
-        successor_nodes_dict = nx.dfs_successors(nx_g, source=node_id)
-        for n, (n_id, called_nodes_list) in enumerate(successor_nodes_dict.items()):
-            list_of_nodes_to_keep += called_nodes_list
-
-        predecessor_nodes_dict = nx.dfs_successors(nx_g_reverse, source=node_id)
-        for n, (n_id, called_nodes_list) in enumerate(predecessor_nodes_dict.items()):
-            list_of_nodes_to_keep += called_nodes_list
-
-    # remove duplicates
-    list_of_nodes_to_keep = list(set(list_of_nodes_to_keep))
-
-    # We need to add in the classes for these entities
-    for entityID in list_of_nodes_to_keep:
-        if results_object[entityID]["member_of_class"] is not None:
-            list_of_nodes_to_keep.append(results_object[entityID]["member_of_class"])
-
-    # create new "final results" for just these entities
-    pruned_results_obj = {id: results_object[id] for id in list_of_nodes_to_keep}
-    return pruned_results_obj
-
-def generateEntityResults_object(db_conn):
+            f"generateFinalResults_selectID_object: Unable to parse select_entity_id: {select_entity_id}", file=sys.stderr)
+        if call_graph is None:
+            return generateEntityResults_object(db_conn)
+        return call_graph.results_object
+
+    bounded = max_depth_up is not None or max_depth_down is not None or max_fan_out is not None
+    if call_graph is not None:
+        if bounded:
+            return call_graph.boundedTrace(select_entity_id_list, max_depth_up, max_depth_down, max_fan_out)
+        return call_graph.trace(select_entity_id_list)
+
+    # A single trace only needs the graph, and then just the entities it keeps
+    graph = compactGraphFromDB(db_conn)
+    if not bounded:
+        keep = addClasses(db_conn.cursor(), graph.traceIDs(select_entity_id_list))
+        return generateEntityResults_object(db_conn, entityIDs=keep)
+    keep, hidden_calls, hidden_callers = graph.boundedTraceIDs(select_entity_id_list, max_depth_up, max_depth_down, max_fan_out)
+    results = generateEntityResults_object(db_conn, entityIDs=addClasses(db_conn.cursor(), keep))
+    return markHidden(results, hidden_calls, hidden_callers)
+
+def traceLimits(settings):
+    """
+    The max_depth_up, max_depth_down and max_fan_out of settings (CLI options, say), for
+    generateEntityResults_selectID_object
+    """
+    return {limit: settings.get(limit) for limit in ["max_depth_up", "max_depth_down", "max_fan_out"]}
+
+def markHidden(results_object, hidden_calls, hidden_callers):
+    """
+    Notes on each entity how many of its calls and callers a bounded trace left out
+    """
+    for entityID, count in hidden_calls.items():
+        results_object[entityID]["hidden_calls"] = count
+    for entityID, count in hidden_callers.items():
+        results_object[entityID]["hidden_callers"] = count
+    return results_object
+
+class callGraph:
+    """
+    The call graph of a generateEntityResults_object result, built once so any number of entities
+    can be traced from it.  Tracing works on the strongly connected components of the graph
+    (groups of entities that can all reach each other), and what each component reaches is
+    memoized, so traces that run into the same part of the graph share the work.
+    """
+
+    def __init__(self, results_object) -> None:
+        self.results_object = results_object
+        self.graph = compactGraphFromResults(results_object)
+        self.successors = self.graph.forward
+        self.predecessors = self.graph.reverse
+        # By node number
+        self.node_components, self.node_component_of = stronglyConnectedComponents(self.graph)
+        # By entityID
+        self.components = [[self.graph.entityIDs[n] for n in component] for component in self.node_components]
+        self.component_of = {id: self.node_component_of[n] for n, id in enumerate(self.graph.entityIDs)}
+        # Reachable components of each component, as bitsets of component numbers
+        self.downstream_cache = {}
+        self.upstream_cache = {}
+
+    def trace(self, select_entity_id_list):
+        """
+        Returns the part of results_object that calls, or is called from, the selected entities.
+        Entries are copies, so the caller can add to them without touching the shared results.
+        """
+        reach = 0
+        for entityID in select_entity_id_list:
+            if entityID not in self.results_object:
+                print(f"callGraph.trace: No entity with ID {entityID}", file=sys.stderr)
+                continue
+            component = self.component_of[entityID]
+            reach |= self.reachable(component, self.successors, self.downstream_cache)
+            reach |= self.reachable(component, self.predecessors, self.upstream_cache)
+
+        keep = set()
+        for component in setBits(reach):
+            keep.update(self.components[component])
+        return self.keptResults(keep)
+
+    def boundedTrace(self, select_entity_id_list, max_depth_up=None, max_depth_down=None, max_fan_out=None):
+        """
+        trace, stopping at the limits compactGraph.boundedTraceIDs takes.  These walk the graph
+        rather than using the memoized components, which only know about whole closures.
+        """
+        keep, hidden_calls, hidden_callers = self.graph.boundedTraceIDs(select_entity_id_list, max_depth_up,
+                                                                        max_depth_down, max_fan_out)
+        return markHidden(self.keptResults(keep), hidden_calls, hidden_callers)
+
+    def allResults(self):
+        """
+        Copies of every results_object entry, as trace gives them
+        """
+        return {id: dict(v) for id, v in self.results_object.items()}
+
+    def keptResults(self, keep):
+        """
+        Copies of the results_object entries of keep, and of the classes they are in
+        """
+        # We need to add in the classes for these entities
+        for entityID in list(keep):
+            while entityID is not None:
+                keep.add(entityID)
+                entityID = self.results_object[entityID]["member_of_class"]
+
+        return {id: dict(v) for id, v in self.results_object.items() if id in keep}
+
+    def reachable(self, component, edges, cache):
+        """
+        Bitset of the components reachable from component along edges, itself included
+        """
+        stack = [component]
+        while stack:
+            current = stack[-1]
+            if current in cache:
+                stack.pop()
+                continue
+            next_components = self.nextComponents(current, edges)
+            pending = [c for c in next_components if c not in cache]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            reach = 1 << current
+            for c in next_components:
+                reach |= cache[c]
+            cache[current] = reach
+        return cache[component]
+
+    def nextComponents(self, component, edges):
+        """
+        edges - successors or predecessors
+        """
+        component_of = self.node_component_of
+        return {component_of[to_n] for n in self.node_components[component] for to_n in edges.neighbors(n)} - {component}
+
+def setBits(bitset):
+    # Positions of the 1 bits, without testing every bit from Python
+    bits = bin(bitset)[:1:-1]
+    position = bits.find("1")
+    while position != -1:
+        yield position
+        position = bits.find("1", position + 1)
+
+def generateEntityResults_object(db_conn, entityIDs=None):
+    """
+    entityIDs - only include these entities [all entities]
+    """
     toreturn = {}
-    for row in getEntityJoin(db_conn.cursor()):
+    calls_by_entity = getCallsByEntity(db_conn.cursor(), entityIDs)
+    for row in getEntityJoin(db_conn.cursor(), entityIDs):
         this_entity_data = dict(zip(row.keys(), row))
         if this_entity_data["entity_type"] == "class":
             this_entity_data["name"] += ":"
         elif this_entity_data["entity_type"] == "function":
             this_entity_data["name"] += "()"
-        this_entity_data["calls"] = []
-        for call_row in getCallForEntity(db_conn.cursor(), row["entityID"]):
-            these_calls = [int(called_id) for called_id in call_row["found_calls"].split(",")]
-            this_entity_data["calls"].append(these_calls)
+        this_entity_data["calls"] = calls_by_entity.get(row["entityID"], [])
         toreturn[this_entity_data["entityID"]] = this_entity_data
     return toreturn
 
-def getEntityJoin(db_cur):
-    stmt = """
+def getEntityJoin(db_cur, entityIDs=None):
+    """
+    entityIDs - only these entities, in the entityID order the full scan reads them in [all entities]
+    """
+    where = ""
+    if entityIDs is not None:
+        selectEntities(db_cur, entityIDs)
+        where = "where entityID in (select entityID from temp.SelectedEntities) order by entityID"
+    stmt = f"""
         select
             entityID,
             entity_name as name,
@@ -203,9 +412,36 @@ def getEntityJoin(db_cur):
         from
             Entities
         JOIN
-            Files on Entities.fileID=Files.fileID;
+            Files on Entities.fileID=Files.fileID
+        {where};
+    """
+    return db_cur.execute(stmt)
+
+def addClasses(db_cursor, entityIDs):
+    """
+    Adds the classes the entities are members of (and theirs, and so on) to the set entityIDs
+    """
+    classes = getClasses(db_cursor, entityIDs)
+    while not classes <= entityIDs:
+        entityIDs |= classes
+        classes = getClasses(db_cursor, classes)
+    return entityIDs
+
+def getClasses(db_cursor, entityIDs):
+    """
+    The set of classes these entities are members of
+    """
+    selectEntities(db_cursor, entityIDs)
+    stmt = """
+        SELECT
+            member_of_class
+        FROM
+            Entities
+        WHERE
+            entityID IN (SELECT entityID FROM temp.SelectedEntities) AND
+            member_of_class IS NOT NULL;
     """
-    return db_cur.execute(stmt).fetchall() 
+    return {row[0] for row in db_cursor.execute(stmt)}
 
 def getEntityList(db_conn):
     toreturn = [dict(zip(row.keys(), row)) for row in getEntityJoin(db_conn.cursor())]
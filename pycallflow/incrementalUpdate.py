@@ -0,0 +1,126 @@
+"""
+Incremental re-analysis of a saved --db_file.  Only files whose modification time or size changed
+(plus new and deleted files) are re-imported, and only the calls that could have changed are rebuilt.
+"""
+import json
+
+from .buildFileDB import walkTargetFiles, addFileToDB, getFileList
+
+# Changing any of these means the saved entities can't be reused
+ANALYSIS_SETTINGS = ["target", "directory", "static", "call_names_version"]
+# The ANALYSIS_SETTINGS that say which files are analyzed, rather than how
+TARGET_SETTINGS = ["target", "directory"]
+# Changing any of these only means every call has to be resolved again
+RESOLUTION_SETTINGS = ["suppress_calls_to_init", "match_to_file"]
+
+
+def canUpdateIncrementally(previous_settings, run_settings, any_targets=False):
+    """
+    any_targets - Set True if the files of other targets can be reconciled with refreshFiles,
+                  so only how the files were analyzed has to match [False]
+    """
+    if len(previous_settings) == 0:
+        # Nothing saved yet
+        return False
+    for setting in ANALYSIS_SETTINGS:
+        if any_targets and setting in TARGET_SETTINGS:
+            continue
+        if previous_settings.get(setting) != str(run_settings[setting]):
+            return False
+    return True
+
+
+def resolutionChanged(previous_settings, run_settings):
+    for setting in RESOLUTION_SETTINGS:
+        if previous_settings.get(setting) != str(run_settings[setting]):
+            return True
+    return False
+
+
+def refreshFileDB(target_object, db_conn, targetIsDirectory=False, path_filter=None):
+    """
+    Brings the Files table in line with what is on disk.  The entities of files that changed
+    or disappeared are removed, along with their saved call names and any calls to or from them.
+
+    returns fileIDs, removed_names
+        fileIDs - set of files that need their entities discovered again
+        removed_names - set of names of the removed entities
+    """
+    return refreshFiles(db_conn, walkTargetFiles(target_object, targetIsDirectory, path_filter))
+
+
+def refreshFiles(db_conn, target_files):
+    """
+    refreshFileDB for files walked from any number of targets
+    target_files - (file_full_path, package_path, file_mod_time, file_size) of every file that
+                   should be in Files, as walkTargetFiles yields them
+    """
+    db_cursor = db_conn.cursor()
+    saved_files = {f["package_path"]: f for f in getFileList(db_conn)}
+    fileIDs = set()
+    stale_fileIDs = set()
+    for file_full_path, package_path, file_mod_time, file_size in target_files:
+        saved = saved_files.pop(package_path, None)
+        if saved is None:
+            fileIDs.add(addFileToDB(db_cursor, file_full_path, package_path, file_mod_time, file_size))
+            continue
+        if (saved["file_mod_time"], saved["file_size"], saved["file_full_path"]) == (file_mod_time, file_size, file_full_path):
+            continue
+        stale_fileIDs.add(saved["fileID"])
+        fileIDs.add(saved["fileID"])
+        db_cursor.execute("""
+            UPDATE Files
+            SET file_full_path = ?, file_mod_time = ?, file_size = ?
+            WHERE fileID = ?;
+        """, (file_full_path, file_mod_time, file_size, saved["fileID"], ))
+
+    # Anything left was deleted
+    deleted_fileIDs = {f["fileID"] for f in saved_files.values()}
+    stale_fileIDs |= deleted_fileIDs
+    removed_names = removeEntitiesForFiles(db_cursor, stale_fileIDs)
+    db_cursor.executemany("DELETE FROM Files WHERE fileID = ?;", [(id, ) for id in deleted_fileIDs])
+    db_conn.commit()
+    fileIDs.discard(None)
+    return fileIDs, removed_names
+
+
+def removeEntitiesForFiles(db_cursor, fileIDs):
+    """
+    Deletes the Entities of these files and everything that refers to them.
+    returns set of the removed entity names
+    """
+    removed_names = set()
+    removed_entityIDs = []
+    stmt = "SELECT entityID, entity_name FROM Entities WHERE fileID = ?;"
+    for fileID in fileIDs:
+        for row in db_cursor.execute(stmt, (fileID, )).fetchall():
+            removed_entityIDs.append((row["entityID"], ))
+            removed_names.add(row["entity_name"])
+    db_cursor.executemany("DELETE FROM Calls WHERE entityID = ? OR called_entity_ID = ?;",
+                          [(id, id) for (id, ) in removed_entityIDs])
+    db_cursor.executemany("DELETE FROM EntityCallNames WHERE entityID = ?;", removed_entityIDs)
+    db_cursor.executemany("DELETE FROM Entities WHERE entityID = ?;", removed_entityIDs)
+    return removed_names
+
+
+def findAffectedEntities(db_conn, fileIDs, removed_names):
+    """
+    Returns the set of entityIDs whose calls need to be resolved again after fileIDs were
+    re-discovered: everything in those files, plus any entity referencing a name that was
+    removed or (re)added, since what that name resolves to may have changed.
+    """
+    db_cursor = db_conn.cursor()
+    affected = set()
+    changed_names = set(removed_names)
+    stmt = "SELECT entityID, entity_name FROM Entities WHERE fileID = ?;"
+    for fileID in fileIDs:
+        for row in db_cursor.execute(stmt, (fileID, )).fetchall():
+            affected.add(row["entityID"])
+            changed_names.add(row["entity_name"])
+
+    for row in db_cursor.execute("SELECT entityID, call_names FROM EntityCallNames;"):
+        if row["entityID"] in affected:
+            continue
+        if not changed_names.isdisjoint(json.loads(row["call_names"])):
+            affected.add(row["entityID"])
+    return affected
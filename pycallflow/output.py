@@ -1,5 +1,9 @@
 
-import networkx as nx
+import hashlib
+import io
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
 import pydot
 from collections import deque
 from tabulate import tabulate
@@ -9,7 +13,7 @@ import os.path
 import os
 import traceback
 
-from .finalResults import generateEntityResults_selectID_object, getEntityList
+from .finalResults import generateEntityResults_selectID_object, generateEntityResults_object, getEntityList, callGraph, traceLimits
 
 from pprint import pprint
 
@@ -35,7 +39,9 @@ def simpleTextOutput(finalOutputDataObject):
 def networkx_dot_output(finalOutputDataObject):
     """
     Generates and emits DOT compatible graph output
+    Needs networkx, which nothing else does (pip install pycallflow[networkx])
     """
+    import networkx as nx
     call_pairs = []
     for n, (k, v) in enumerate(finalOutputDataObject.items()):
         module_path = k
@@ -131,7 +137,7 @@ class pydot_output:
             v["node"] = this_node
 
         # Now make the edges
-        edge_list = []
+        edge_list = set()
         for n, (k, v) in enumerate(finalOutputDataObject.items()):
             if "node" not in v.keys():
                 # Then this is probably a skipped class reference and there should be no calls
@@ -162,7 +168,47 @@ class pydot_output:
                             continue
                     to_node = finalOutputDataObject[to_id]["node"]
                     graph.add_edge(pydot.Edge(from_node, to_node, style=style, color=color))
-                    edge_list.append(edge_id)
+                    edge_list.add(edge_id)
+            for name, label, from_name, to_name in moreNodes(k, v):
+                graph.add_node(pydot.Node(name=name, label=label, style="dashed", color="gray", shape="box"))
+                graph.add_edge(pydot.Edge(from_name, to_name, style="dashed", color="gray"))
+
+        if output_to_stdout:
+            print(graph.to_string())
+        else:
+            return graph.to_string()
+
+    def rollup_output(self, rollupDataObject, /,
+        rankdir,
+        edge_color,
+        suppress_recursive_calls,
+        graph_name = "Callflow Analysis",
+        output_to_stdout = True,
+        **kwargs
+    ):
+        """
+        DOT for a generateRollupResults_object result.  One edge per pair of groups, labeled with
+        its weight and drawn wider the more calls it stands for.
+        """
+        graph = pydot.Graph(graph_name, compound=True, rankdir=rankdir)
+        file_clusters = {}
+        for k, v in rollupDataObject.items():
+            parent = graph
+            if v["file_import_path"] is not None:
+                if v["file_import_path"] not in file_clusters:
+                    file_clusters[v["file_import_path"]] = pydot.Cluster(v["file_import_path"], label=v["file_import_path"])
+                    graph.add_subgraph(file_clusters[v["file_import_path"]])
+                parent = file_clusters[v["file_import_path"]]
+            parent.add_node(pydot.Node(name=str(k), **rollupNodeAttributes(v)))
+
+        for k, v in rollupDataObject.items():
+            for to_id, weight in v["calls"].items():
+                if suppress_recursive_calls and k == to_id:
+                    continue
+                color = edge_color
+                if edge_color == "rotate":
+                    color = self.next_X11_color()
+                graph.add_edge(pydot.Edge(str(k), str(to_id), label=str(weight), penwidth=rollupPenwidth(weight), color=color))
 
         if output_to_stdout:
             print(graph.to_string())
@@ -208,9 +254,270 @@ class pydot_output:
         self.x11_colors_d.rotate(1)
         return color
 
+class stream_dot_output(pydot_output):
+    """
+    Writes the same DOT text as pydot_output, but straight to a file as it goes instead of
+    building a pydot object tree first.  Only the cluster membership of each node is held in
+    memory, and edges are written out as they are found.
+    """
+
+    def output(self, finalOutputDataObject, /,
+        rankdir,
+        edge_color,
+        suppress_recursive_calls,
+        combine_calls,
+        suppress_class_references,
+        suppress_calls_to_init,
+        select_entity_id = None,
+        graph_name = "Callflow Analysis",
+        output_to_stdout = True,
+        out = None,
+        **kwargs
+    ):
+        """
+        out - file to write to when output_to_stdout is set [sys.stdout]
+        """
+        if not output_to_stdout:
+            out = io.StringIO()
+        elif out is None:
+            out = sys.stdout
+        select_entity_id_list = []
+        if select_entity_id is not None:
+            select_entity_id_list = [int(id) for id in select_entity_id.split(",")]
+
+        # Clusters are {"name":..., "label":..., "children": [cluster or node line, ...]}
+        # the same nesting pydot_output builds
+        file_clusters = {}
+        class_clusters = {}
+        has_node = set()
+        for k, v in finalOutputDataObject.items():
+            if v["file_import_path"] not in file_clusters:
+                file_clusters[v["file_import_path"]] = dotCluster(v["file_import_path"], v["file_import_path"])
+            fc = file_clusters[v["file_import_path"]]
+            cc = None
+            if v["member_of_class"] is not None:
+                if v["member_of_class"] not in class_clusters:
+                    class_name = finalOutputDataObject[v["member_of_class"]]["name"]
+                    class_clusters[v["member_of_class"]] = dotCluster(class_name, class_name)
+                    fc["children"].append(class_clusters[v["member_of_class"]])
+                cc = class_clusters[v["member_of_class"]]
+
+            style = "solid"
+            color = "black"
+            shape = "oval"
+            # Check if I should highlight this one.
+            if k in select_entity_id_list:
+                style = "bold"
+                color = "blue"
+                shape = "doubleoctagon"
+            label = v["name"]
+            if v["entity_type"] == "class":
+                if k not in class_clusters:
+                    class_clusters[k] = dotCluster(str(k), v["name"])
+                    fc["children"].append(class_clusters[k])
+                if suppress_class_references:
+                    continue
+                label = v["name"] + " (ref)"
+                cc = class_clusters[k]
+
+            node_line = f"{dotID(str(k))} [label={dotAttr(label)}, style={dotAttr(style)}, color={dotAttr(color)}, shape={dotAttr(shape)}];\n"
+            if cc is not None:
+                cc["children"].append(node_line)
+            else:
+                fc["children"].append(node_line)
+            has_node.add(k)
+
+        out.write(f"digraph {dotID(graph_name)} {{\n")
+        out.write("compound=true;\n")
+        out.write(f"rankdir={dotAttr(rankdir)};\n")
+        for fc in file_clusters.values():
+            writeDotCluster(out, fc)
+
+        edges_done = set()
+        for k, v in finalOutputDataObject.items():
+            if k not in has_node:
+                # Then this is probably a skipped class reference and there should be no calls
+                continue
+            for call in v["calls"]:
+                style = "solid"
+                color = edge_color
+                if edge_color == "rotate":
+                    color = self.next_X11_color()
+                if len(call) > 1:
+                    style = "dashed"    # Represents an ambiguous call to entities of same name
+                for to_id in call:
+                    if to_id not in finalOutputDataObject:
+                        # Then it was pruned.
+                        continue
+                    if suppress_recursive_calls:
+                        if k == to_id:
+                            continue
+                    if combine_calls:
+                        if (k, to_id) in edges_done:
+                            # Already have this one
+                            continue
+                    if suppress_class_references:
+                        if finalOutputDataObject[to_id]["entity_type"] == "class":
+                            # don't draw it
+                            continue
+                    out.write(f"{dotID(str(k))} -> {dotID(str(to_id))} [style={dotAttr(style)}, color={dotAttr(color)}];\n")
+                    edges_done.add((k, to_id))
+            for name, label, from_name, to_name in moreNodes(k, v):
+                out.write(f"{dotID(name)} [label={dotAttr(label)}, style=dashed, color=gray, shape=box];\n")
+                out.write(f"{dotID(from_name)} -> {dotID(to_name)} [style=dashed, color=gray];\n")
+        out.write("}\n")
+
+        if output_to_stdout:
+            # pydot_output's print() ends with an extra newline
+            out.write("\n")
+        else:
+            return out.getvalue()
+
+    def rollup_output(self, rollupDataObject, /,
+        rankdir,
+        edge_color,
+        suppress_recursive_calls,
+        graph_name = "Callflow Analysis",
+        output_to_stdout = True,
+        out = None,
+        **kwargs
+    ):
+        """
+        Same text as pydot_output.rollup_output
+        out - file to write to when output_to_stdout is set [sys.stdout]
+        """
+        if not output_to_stdout:
+            out = io.StringIO()
+        elif out is None:
+            out = sys.stdout
+        file_clusters = {}
+        top_nodes = []
+        for k, v in rollupDataObject.items():
+            attributes = ", ".join(f"{name}={dotAttr(value)}" for name, value in rollupNodeAttributes(v).items())
+            node_line = f"{dotID(str(k))} [{attributes}];\n"
+            if v["file_import_path"] is None:
+                top_nodes.append(node_line)
+                continue
+            if v["file_import_path"] not in file_clusters:
+                file_clusters[v["file_import_path"]] = dotCluster(v["file_import_path"], v["file_import_path"])
+            file_clusters[v["file_import_path"]]["children"].append(node_line)
+
+        out.write(f"digraph {dotID(graph_name)} {{\n")
+        out.write("compound=true;\n")
+        out.write(f"rankdir={dotAttr(rankdir)};\n")
+        for fc in file_clusters.values():
+            writeDotCluster(out, fc)
+        out.writelines(top_nodes)
+        for k, v in rollupDataObject.items():
+            for to_id, weight in v["calls"].items():
+                if suppress_recursive_calls and k == to_id:
+                    continue
+                color = edge_color
+                if edge_color == "rotate":
+                    color = self.next_X11_color()
+                out.write(f"{dotID(str(k))} -> {dotID(str(to_id))} [label={dotAttr(str(weight))}, "
+                          f"penwidth={dotAttr(rollupPenwidth(weight))}, color={dotAttr(color)}];\n")
+        out.write("}\n")
+
+        if output_to_stdout:
+            # pydot_output's print() ends with an extra newline
+            out.write("\n")
+        else:
+            return out.getvalue()
+
+def moreNodes(k, v):
+    """
+    "+N more" placeholders for the calls and callers of entity k that a bounded trace left out
+    returns [(node name, label, edge from, edge to), ...]
+    """
+    more = []
+    if v.get("hidden_calls"):
+        more.append((f"{k}_more_calls", f"+{v['hidden_calls']} more", str(k), f"{k}_more_calls"))
+    if v.get("hidden_callers"):
+        more.append((f"{k}_more_callers", f"+{v['hidden_callers']} more", f"{k}_more_callers", str(k)))
+    return more
+
+def rollupNodeAttributes(group):
+    style = "solid"
+    color = "black"
+    shape = "box"
+    if group["selected"]:
+        style = "bold"
+        color = "blue"
+        shape = "doubleoctagon"
+    return {"label": f"{group['name']} ({group['entities']})", "style": style, "color": color, "shape": shape}
+
+def rollupPenwidth(weight):
+    # Grows with the number of digits, so a few heavy edges don't swamp the rest
+    return str(min(1 + len(str(weight)), 6))
+
+def dotCluster(name, label):
+    return {"name": f"cluster_{name}", "label": label, "children": []}
+
+def writeDotCluster(out, cluster):
+    out.write(f"subgraph {dotID(cluster['name'])} {{\n")
+    out.write(f"label={dotAttr(cluster['label'])};\n")
+    for child in cluster["children"]:
+        if isinstance(child, dict):
+            writeDotCluster(out, child)
+        else:
+            out.write(child)
+    out.write("}\n")
+
+# Quoting follows the same rules pydot uses, so both writers produce the same text
+DOT_KEYWORDS = ["graph", "subgraph", "digraph", "node", "edge", "strict"]
+DOT_NUMERAL = re.compile(r"^([0-9]+\.?[0-9]*|[0-9]*\.[0-9]+)$")
+DOT_PLAIN_ID = re.compile(r"^[_a-zA-Z][a-zA-Z0-9_]*$")
+DOT_QUOTED = re.compile(r'^".*"$', re.S)
+DOT_HTML = re.compile(r"^<.*>$", re.S)
+
+def dotQuote(s):
+    return '"' + s.replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r") + '"'
+
+def dotAttr(s):
+    if s.lower() in DOT_KEYWORDS:
+        return dotQuote(s)
+    if s.isdigit() or (s.isalnum() and not s[0].isdigit()):
+        return s
+    if DOT_NUMERAL.match(s) or DOT_QUOTED.match(s) or DOT_HTML.match(s):
+        return s
+    return dotQuote(s)
+
+def dotID(s):
+    if s.lower() in DOT_KEYWORDS:
+        return dotQuote(s)
+    if s.isdigit() or DOT_PLAIN_ID.match(s) or DOT_NUMERAL.match(s) or DOT_QUOTED.match(s) or DOT_HTML.match(s):
+        return s
+    if s.isalnum() and not s[0].isdigit():
+        return s
+    return dotQuote(s)
+
+DOT_WRITERS = {
+    "pydot": pydot_output,
+    "stream": stream_dot_output,
+}
+
+# Options of the dot writers' output(), with the defaults the CLI gives them
+DOT_OPTIONS = {
+    "rankdir": "LR",
+    "edge_color": "rotate",
+    "suppress_recursive_calls": False,
+    "combine_calls": False,
+    "suppress_class_references": False,
+    "suppress_calls_to_init": False,
+}
+
+RENDER_FORMAT = "png"
+# Kept in --save_images_to, records what each image was rendered from
+MANIFEST_NAME = ".pycallflow_manifest.json"
+
 class all_entity_flow:
 
-    def __init__(self, save_images_to) -> None:
+    def __init__(self, save_images_to, render_jobs=1, render_timeout=None) -> None:
+        """
+        render_jobs - number of dot processes to run at once, 0 for one per CPU [1]
+        render_timeout - seconds to give each dot process before giving up on it [None]
+        """
         # Need to test for DOT working
         try:
             sp_run_result = subprocess.run(["dot", "--version"], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -222,38 +529,168 @@ class all_entity_flow:
             raise NotADirectoryError()
         else:
             self.save_images_to = save_images_to
+        if render_jobs < 1:
+            render_jobs = os.cpu_count() or 1
+        self.render_jobs = render_jobs
+        self.render_timeout = render_timeout
 
 
     def generate_all_entity_flows(self, db_conn, 
                                   **kwargs):
         # Iterate over the entities and create single entity call flows
-        entity_list = getEntityList(db_conn)
-        for entity in entity_list:
-            try:
-                if entity["name"] in ["__init__", "__del__"]:
+        entity_images = {}
+        for entity in getEntityList(db_conn):
+            if entity["name"] in ["__init__", "__del__"]:
+                continue
+            if entity["entity_type"] in ["class"]:
+                continue
+            import_path = entity["file_import_path"].replace(".","_")
+            # Entities with the same name and import path share an image, the last one drawn wins
+            entity_images[f"{import_path}_{entity['name']}.{RENDER_FORMAT}"] = entity
+        entity_list = list(entity_images.values())
+        dot_writer = DOT_WRITERS[kwargs.get("dot_writer", "pydot")]
+        # Every entity is traced from the same graph
+        call_graph = callGraph(generateEntityResults_object(db_conn))
+        progress_f = sys.stderr if kwargs.get("verbose") else open(os.devnull, "w")
+        # Images whose dot text hasn't changed since they were made are left alone
+        old_manifest = self.load_manifest()
+        new_manifest = {}
+        failures = []
+        rendered = 0
+        unchanged = 0
+        # dot does the rendering in its own processes, so threads are enough to keep every core busy
+        with ThreadPoolExecutor(max_workers=self.render_jobs) as executor:
+            pending = {}
+            for image_name, entity in entity_images.items():
+                filename = f"{self.save_images_to}/{image_name}"
+                try:
+                    # Generate the dot data
+                    this_entity_object = generateEntityResults_selectID_object(
+                        db_conn, select_entity_id=str(entity["entityID"]), call_graph=call_graph, **traceLimits(kwargs))
+                    this_entity_object, local_id = self.renumber_entities(this_entity_object, entity["entityID"])
+                    # Convert entityID to string because the next call will attempt to split(",") on it
+                    kwargs["select_entity_id"] = str(local_id)
+                    dot_data = dot_writer().output(this_entity_object, output_to_stdout=False,  **kwargs)
+                except Exception as badnews:
+                    failures.append((entity["name"], badnews))
                     continue
-                if entity["entity_type"] in ["class"]:
+                fingerprint = self.fingerprint(dot_data)
+                if old_manifest.get(image_name) == fingerprint and os.path.isfile(filename):
+                    new_manifest[image_name] = fingerprint
+                    rendered += 1
+                    unchanged += 1
                     continue
-                import_path = entity["file_import_path"].replace(".","_")
-                filename = f"{self.save_images_to}/{import_path}_{entity['name']}.png"
-                # Generate the dot data
-                # Convert entityID to string because the next call will attempt to split(",") on it
-                kwargs["select_entity_id"] = str(entity["entityID"])
-                this_entity_object = generateEntityResults_selectID_object(db_conn, select_entity_id=kwargs["select_entity_id"])
-                dot_data = pydot_output().output(this_entity_object, output_to_stdout=False,  **kwargs)
-                args = [
-                    "dot",
-                    "-Tpng",
-                    f"-o{filename}"
-                ]
-                p = subprocess.run(args=args, input=dot_data, text=True, capture_output=True)
+                pending[executor.submit(self.render_image, filename, dot_data)] = (entity, image_name, fingerprint)
+                # Only keep a few dot strings waiting on the workers
+                while len(pending) >= self.render_jobs * 2:
+                    rendered += self.collect_renders(pending, failures, new_manifest, FIRST_COMPLETED)
+                    print(f"\r[-] Rendered {rendered}/{len(entity_list)} flow graphs ({unchanged} unchanged)", end="", file=progress_f)
+            rendered += self.collect_renders(pending, failures, new_manifest, ALL_COMPLETED)
+            print(f"\r[-] Rendered {rendered}/{len(entity_list)} flow graphs ({unchanged} unchanged)", file=progress_f)
+        if progress_f is not sys.stderr:
+            progress_f.close()
+
+        # Remove the images we made for entities that are gone
+        for image_name in old_manifest.keys() - entity_images.keys():
+            image_path = self.manifest_image_path(image_name)
+            if image_path is None:
+                print(f"Unable to remove {image_name!r} because it is not an image in {self.save_images_to}")
+                continue
+            try:
+                os.remove(image_path)
+            except FileNotFoundError:
+                pass
+            except OSError as badnews:
+                print(f"Unable to remove {image_name} because {badnews}")
+        self.save_manifest(new_manifest)
+
+        if len(failures) > 0:
+            print(f"{len(failures)} of {len(entity_list)} flow graphs failed:")
+            for name, badnews in failures:
+                print(f"Unable to make flow graph for {name} because {badnews}")
+
+    def collect_renders(self, pending, failures, manifest, return_when):
+        """
+        Waits for renders in pending to finish, recording failures and adding the successes to
+        manifest.  Returns how many finished.
+        """
+        done, not_done = wait(pending.keys(), return_when=return_when)
+        for future in done:
+            entity, image_name, fingerprint = pending.pop(future)
+            try:
+                future.result()
             except Exception as badnews:
-                print(f"Unable to make flow graph for {entity['name']} because {badnews}")
+                failures.append((entity["name"], badnews))
+            else:
+                manifest[image_name] = fingerprint
+        return len(done)
 
+    def renumber_entities(self, entity_object, entityID):
+        """
+        Entity IDs are only node names in the dot text, but they shift whenever entities are
+        added or removed.  Numbering the nodes of each graph from 1 keeps the dot text (and so
+        its fingerprint) the same as long as the picture is.
+        Returns the renumbered object and the new ID of entityID
+        """
+        local_ids = {id: n for n, id in enumerate(entity_object.keys(), start=1)}
+        renumbered = {}
+        for id, v in entity_object.items():
+            v = dict(v)
+            v["entityID"] = local_ids[id]
+            v["member_of_class"] = local_ids.get(v["member_of_class"])
+            # Calls to pruned entities become None, which output skips like any other pruned call
+            v["calls"] = [[local_ids.get(to_id) for to_id in call] for call in v["calls"]]
+            renumbered[local_ids[id]] = v
+        return renumbered, local_ids[entityID]
 
-        
+    def fingerprint(self, dot_data):
+        return hashlib.sha256(f"{RENDER_FORMAT}\0{dot_data}".encode()).hexdigest()
 
+    def manifest_path(self):
+        return os.path.join(self.save_images_to, MANIFEST_NAME)
 
+    def load_manifest(self):
+        """
+        Returns {image file name: fingerprint of the dot text it was rendered from}
+        """
+        try:
+            with open(self.manifest_path(), "r") as manifest_f:
+                manifest = json.load(manifest_f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
 
+    def manifest_image_path(self, image_name):
+        """
+        Returns the path of an image listed in the manifest, or None if the name would reach
+        outside save_images_to.  Anyone can edit the manifest, so its names aren't trusted.
+        """
+        if os.path.isabs(image_name) or ".." in image_name:
+            return None
+        image_path = os.path.join(self.save_images_to, image_name)
+        images_dir = os.path.realpath(self.save_images_to)
+        if os.path.dirname(os.path.realpath(image_path)) != images_dir:
+            return None
+        return image_path
 
+    def save_manifest(self, manifest):
+        tmp_path = f"{self.manifest_path()}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as manifest_f:
+                json.dump(manifest, manifest_f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.manifest_path())
+        except OSError as badnews:
+            print(f"Unable to save {self.manifest_path()} because {badnews}")
 
+    def render_image(self, filename, dot_data):
+        args = [
+            "dot",
+            f"-T{RENDER_FORMAT}",
+            f"-o{filename}"
+        ]
+        try:
+            p = subprocess.run(args=args, input=dot_data, text=True, capture_output=True, timeout=self.render_timeout)
+        except subprocess.TimeoutExpired:
+            raise Exception(f"dot took longer than {self.render_timeout} seconds")
+        if p.returncode != 0:
+            raise Exception(f"dot failed: {p.stderr.strip()}")
@@ -0,0 +1,138 @@
+"""
+Spreads entity discovery across a pool of worker processes.
+
+Each worker imports (or parses) one file into its own in-memory database using the same code as
+a serial run, and sends back the rows it found in the analysisCache entry format.  The parent is
+the only writer: it saves the entries in Files order, so entity IDs come out exactly as they
+would from a serial run.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import os
+import sys
+
+from .buildFileDB import getFileList, addFileToDB, addTargetFiles
+from .buildDeclaredEntitiesDB import saveFileEntities, releaseAnalyzedModules
+from .staticAnalysis import saveStaticFileEntities
+from .analysisCache import entryFromDB, saveEntryToDB
+from .callFlowData import callFlowData, bulkWriter
+
+
+def findDeclaredEntities_parallel(db_conn, jobs, static=False, fileIDs=None, cache=None, stdout_capture_file=os.devnull,
+                                  release_modules=False, target_files=None):
+    """
+    Parallel version of findDeclaredEntities_inlineSave/findDeclaredEntities_static
+    jobs - number of worker processes, 0 for one per CPU
+    static - Set True to parse the files with ast instead of importing them [False]
+    fileIDs - only process these files [all files]
+    cache - analysisCache to reuse results from [None]
+    stdout_capture_file - where the workers send output from the analyzed code [os.devnull]
+    release_modules - Set True to have the workers drop each module once its entities are found [False]
+    target_files - walkTargetFiles generator to add the files from first [None]
+    """
+    if target_files is not None:
+        addTargetFiles(db_conn, target_files)
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    file_list = [f for f in getFileList(db_conn) if fileIDs is None or f["fileID"] in fileIDs]
+
+    cached_entries = {}
+    to_analyze = []
+    for f in file_list:
+        entry = None
+        if cache is not None:
+            entry = cache.loadEntry(f)
+        if entry is None:
+            to_analyze.append(f)
+        else:
+            cached_entries[f["fileID"]] = entry
+
+    # Same chunking multiprocessing.Pool.map uses, to keep the round trips down on big trees
+    chunksize, extra = divmod(len(to_analyze), jobs * 4)
+    if extra:
+        chunksize += 1
+    to_cache = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initWorker, initargs=(stdout_capture_file, )) as executor, \
+            bulkWriter(db_conn) as writer:
+        results = executor.map(analyzeFileWorker, to_analyze, [static] * len(to_analyze),
+                               [release_modules] * len(to_analyze), chunksize=max(chunksize, 1))
+        # Results come back in submission order, which is also Files order
+        analyzed = 0
+        for f in file_list:
+            if f["fileID"] in cached_entries:
+                saveEntryToDB(writer, f["fileID"], cached_entries[f["fileID"]])
+                continue
+            try:
+                entry, error = next(results)
+            except BrokenProcessPool:
+                # A worker died outright (a crash in a C extension, os._exit() in module level code)
+                # and took the pool with it.  The files not back yet get a process each instead,
+                # so only the one that does it is lost.
+                results = analyzeIsolated(to_analyze[analyzed:], jobs, static, stdout_capture_file)
+                entry, error = next(results)
+            analyzed += 1
+            if entry is not None:
+                saveEntryToDB(writer, f["fileID"], entry)
+            if error is not None:
+                print(
+                    f"Unable to process file {f['file_full_path']} because {error}", file=sys.stderr)
+            else:
+                to_cache.append(f)
+    if cache is not None:
+        cache.storeFiles(db_conn.cursor(), to_cache)
+    return
+
+
+def analyzeIsolated(file_list, jobs, static, stdout_capture_file):
+    """
+    Generates (entry, error) for each file in file_list, in order, each one analyzed in a
+    process of its own, jobs at a time.  entry is None if its process died.
+    """
+    # sandboxAnalysis imports this module
+    from .sandboxAnalysis import runSandboxes
+    results = {}
+    for f, entry, error in runSandboxes(file_list, jobs, None, None, stdout_capture_file, static):
+        results[f["fileID"]] = (entry, error)
+    for f in file_list:
+        yield results[f["fileID"]]
+
+
+# Package paths this worker process has analyzed, for release_modules
+worker_analyzed = set()
+
+
+def initWorker(stdout_capture_file):
+    # Code run during imports writes where the parent's would
+    sys.stdout = open(stdout_capture_file, "a")
+
+
+def analyzeFileWorker(file_row, static, release_modules=False):
+    """
+    Runs in a worker process.  Returns (entry, error) where error is None if the file was
+    fully processed
+    """
+    loaded_before = set(sys.modules)
+    worker_data = callFlowData()
+    db_conn = worker_data.getSqliteConnection()
+    error = None
+    with bulkWriter(db_conn) as writer:
+        fileID = addFileToDB(writer, file_row["file_full_path"], file_row["package_path"],
+                             file_row["file_mod_time"], file_row["file_size"])
+        local_row = dict(file_row, fileID=fileID)
+        try:
+            if static:
+                saveStaticFileEntities(writer, local_row)
+            else:
+                saveFileEntities(writer, local_row)
+        except KeyboardInterrupt:
+            raise
+        except BaseException as badnews:
+            # Includes SystemExit from module level code, which would otherwise take the pool down
+            error = str(badnews) or type(badnews).__name__
+    entry = entryFromDB(db_conn.cursor(), fileID)
+    # Nothing needs the live objects once their rows are out
+    worker_data.releaseDiscoveredObjects()
+    db_conn.close()
+    if release_modules and not static:
+        releaseAnalyzedModules(loaded_before, file_row["package_path"], worker_analyzed)
+    return entry, error
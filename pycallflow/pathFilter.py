@@ -0,0 +1,183 @@
+"""
+Which files under a target get analyzed, for --exclude, --include and --gitignore.
+
+Patterns work the way .gitignore patterns do.  One without a / (other than at the end) matches
+a file or directory name at any depth, one with a / matches the path from the directory being
+walked (or from the .gitignore file).  * and ? don't match /, ** matches any number of
+directories, a trailing / only matches directories, and a leading ! brings back what an
+earlier pattern excluded.
+
+Excluded directories are taken out of the walk before it goes into them, so nothing under them
+is ever listed, stat'ed or imported.
+"""
+import os
+import re
+
+# Never part of the target's code: version control, virtualenvs (.venv), .tox, and caches
+DEFAULT_EXCLUDES = [".*/", "__pycache__/"]
+
+
+class pathFilter:
+
+    def __init__(self, exclude=None, include=None, gitignore=False) -> None:
+        """
+        exclude - patterns of files and directories to skip [None]
+        include - only analyze files matching one of these patterns, or in a directory that
+                  does [every file]
+        gitignore - also skip what the .gitignore files of the target (and of the git work tree
+                    it is in) ignore [False]
+        """
+        self.exclude = [ignoreRule(pattern) for pattern in DEFAULT_EXCLUDES + list(exclude or [])]
+        self.include = [ignoreRule(pattern) for pattern in include or []]
+        self.gitignore = gitignore
+        # {directory: [(directory, rules), ...] of every .gitignore that applies in it, outermost first}
+        self.gitignore_rules = {}
+
+    def keepDirs(self, search_path, root, dirs):
+        """
+        Takes the excluded directories out of dirs, in place, so os.walk doesn't go into them
+        """
+        dirs[:] = [d for d in dirs if not self.excluded(search_path, os.path.join(root, d), True)]
+
+    def keepFile(self, search_path, file_path):
+        if self.excluded(search_path, file_path, False):
+            return False
+        if len(self.include) == 0:
+            return True
+        parts = relPath(search_path, file_path).split("/")
+        for n in range(1, len(parts) + 1):
+            if matchRules(self.include, "/".join(parts[:n]), n < len(parts)):
+                return True
+        return False
+
+    def excluded(self, search_path, path, is_dir):
+        ignored = matchRules(self.exclude, relPath(search_path, path), is_dir)
+        if self.gitignore:
+            for directory, rules in self.gitignoreRules(search_path, os.path.dirname(path)):
+                # A deeper .gitignore has the last word, but only on what it matches
+                ignored = matchRules(rules, relPath(directory, path), is_dir, ignored)
+        return ignored
+
+    def gitignoreRules(self, search_path, directory):
+        directory = os.path.normpath(directory)
+        if directory not in self.gitignore_rules:
+            if directory == os.path.normpath(search_path):
+                outer = outerGitignoreRules(directory)
+            else:
+                outer = self.gitignoreRules(search_path, os.path.dirname(directory))
+            self.gitignore_rules[directory] = outer + readGitignore(directory)
+        return self.gitignore_rules[directory]
+
+
+class ignoreRule:
+    """
+    One pattern, as a regex over /-separated relative paths
+    """
+
+    def __init__(self, pattern) -> None:
+        self.negated = pattern.startswith("!")
+        if self.negated:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if "/" in pattern:
+            # Anchored to the directory the path is relative to
+            self.regex = re.compile(globRegex(pattern.lstrip("/")))
+        else:
+            self.regex = re.compile("(.*/)?" + globRegex(pattern))
+
+    def matches(self, rel_path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        return self.regex.fullmatch(rel_path) is not None
+
+
+def matchRules(rules, rel_path, is_dir, matched=False):
+    """
+    True if the last rule to match rel_path isn't negated, matched if none does
+    """
+    for rule in rules:
+        if rule.matches(rel_path, is_dir):
+            matched = not rule.negated
+    return matched
+
+
+def globRegex(pattern):
+    regex = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            regex.append("(.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex.append("/.*")
+            i += 3
+            continue
+        if c == "*":
+            regex.append("[^/]*")
+        elif c == "?":
+            regex.append("[^/]")
+        elif c == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            chars = pattern[i + 1:end]
+            if chars.startswith("!"):
+                chars = "^" + chars[1:]
+            regex.append(f"[{chars}]")
+            i = end
+        elif c == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex.append(re.escape(pattern[i]))
+        else:
+            regex.append(re.escape(c))
+        i += 1
+    return "".join(regex)
+
+
+def relPath(base, path):
+    return os.path.relpath(path, base).replace(os.sep, "/")
+
+
+def readGitignore(directory):
+    """
+    [(directory, rules)] for the .gitignore in directory, or [] if it has none
+    """
+    try:
+        with open(os.path.join(directory, ".gitignore"), encoding="utf-8", errors="replace") as gitignore_f:
+            lines = gitignore_f.read().splitlines()
+    except OSError:
+        return []
+    rules = []
+    for line in lines:
+        if not line.endswith("\\ "):
+            line = line.rstrip()
+        if line == "" or line.startswith("#"):
+            continue
+        rules.append(ignoreRule(line))
+    if len(rules) == 0:
+        return []
+    return [(directory, rules)]
+
+
+def outerGitignoreRules(directory):
+    """
+    The .gitignore rules of the directories above directory, up to the top of its git work
+    tree.  None if it isn't in one.
+    """
+    directory = os.path.abspath(directory)
+    if os.path.exists(os.path.join(directory, ".git")):
+        return []
+    parents = []
+    parent = os.path.dirname(directory)
+    while True:
+        parents.append(parent)
+        if os.path.exists(os.path.join(parent, ".git")):
+            break
+        if os.path.dirname(parent) == parent:
+            return []
+        parent = os.path.dirname(parent)
+    rules = []
+    for parent in reversed(parents):
+        rules += readGitignore(parent)
+    return rules
@@ -0,0 +1,184 @@
+"""
+Per-phase timing, memory and counters for --profile.
+
+A runProfile is made active for the length of a run.  The phases of collectData and cli_run are
+timed with phase(), and the hot spots inside them (importing, disassembly, parsing, writing to
+sqlite) add to named timers and counters through profileTimer() and countEvent(), which do
+nothing when no profile is active.
+
+Work done in --jobs worker processes is not counted, only its wall time in the parent.
+
+Timers and counters can be added to from any thread (the background sqlite writer times
+sql_write while the main thread times import), and each timer is the wall time of its own with
+blocks, so timers running on different threads overlap.  Phases are only timed on the thread
+that made the profile active; other threads' work counts towards the phase that waits for them.
+"""
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+from .__about__ import __version__
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+
+class runProfile:
+    # The profile of the run in progress, if there is one
+    active = None
+
+    def __init__(self, report_file, cprofile_dir=None) -> None:
+        """
+        report_file - where the JSON report is written
+        cprofile_dir - directory to dump a cProfile .prof file for each phase into [None]
+        """
+        if cprofile_dir is not None and not os.path.isdir(cprofile_dir):
+            raise NotADirectoryError(cprofile_dir)
+        self.report_file = report_file
+        self.cprofile_dir = cprofile_dir
+        self.phases = []
+        self.timers = {}
+        self.counters = Counter()
+        self.settings = {}
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        # Guards timers and counters
+        self.lock = threading.Lock()
+        self.thread_id = None
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        runProfile.active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        runProfile.active = None
+        self.saveReport()
+
+    @contextmanager
+    def phase(self, name):
+        profiler = None
+        if self.cprofile_dir is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            this_phase = {
+                "name": name,
+                "wall_s": round(time.perf_counter() - wall_start, 4),
+                "cpu_s": round(time.process_time() - cpu_start, 4),
+                "peak_rss_mb": peakRSS(),
+            }
+            if profiler is not None:
+                profiler.disable()
+                this_phase["cprofile"] = os.path.join(self.cprofile_dir, f"{len(self.phases):02d}_{name}.prof")
+                profiler.dump_stats(this_phase["cprofile"])
+            self.phases.append(this_phase)
+
+    def countSQL(self, db_conn):
+        """
+        Counts every statement db_conn runs (each row of an executemany counts)
+        """
+        def traceStatement(statement):
+            # Called on whichever thread runs the statement
+            self.count("sql_statements")
+        db_conn.set_trace_callback(traceStatement)
+
+    def countResults(self, db_conn):
+        """
+        Adds the counters that come straight from the db
+        """
+        db_conn.set_trace_callback(None)
+        db_cursor = db_conn.cursor()
+        self.counters["files"] = db_cursor.execute("SELECT count(*) FROM Files;").fetchone()[0]
+        self.counters["entities"] = db_cursor.execute("SELECT count(*) FROM Entities;").fetchone()[0]
+        # Ambiguous calls are the ones that found more than one entity with the name
+        self.counters["ambiguous_edges"] = db_cursor.execute("""
+            SELECT count(*) FROM Calls WHERE collision_num IN (
+                SELECT collision_num FROM Calls GROUP BY collision_num HAVING count(*) > 1
+            );
+        """).fetchone()[0]
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def addTime(self, name, wall_s):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"wall_s": 0.0, "count": 0})
+            timer["wall_s"] += wall_s
+            timer["count"] += 1
+
+    def report(self):
+        return {
+            "pycallflow": __version__,
+            "python": sys.version.split()[0],
+            "settings": self.settings,
+            "total": {
+                "wall_s": round(time.perf_counter() - self.wall_start, 4),
+                "cpu_s": round(time.process_time() - self.cpu_start, 4),
+                "peak_rss_mb": peakRSS(),
+            },
+            "phases": self.phases,
+            "timers": {name: {"wall_s": round(t["wall_s"], 4), "count": t["count"]} for name, t in self.timers.items()},
+            "counters": dict(self.counters),
+        }
+
+    def saveReport(self):
+        try:
+            with open(self.report_file, "w") as report_f:
+                json.dump(self.report(), report_f, indent=2)
+        except OSError as badnews:
+            print(f"Unable to save profile to {self.report_file} because {badnews}", file=sys.stderr)
+
+
+def peakRSS():
+    if resource is None:
+        return None
+    # ru_maxrss is KB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+
+def countEvent(name, n=1):
+    profile = runProfile.active
+    if profile is not None:
+        profile.count(name, n)
+
+
+@contextmanager
+def accumulateTimer(profile, name):
+    wall_start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.addTime(name, time.perf_counter() - wall_start)
+
+
+def profileTimer(name):
+    """
+    Adds the time spent in the with block to the named timer of the active profile
+    """
+    if runProfile.active is None:
+        return nullcontext()
+    return accumulateTimer(runProfile.active, name)
+
+
+def profilePhase(name):
+    """
+    Times the with block as a phase of the active profile
+    """
+    if runProfile.active is None or threading.get_ident() != runProfile.active.thread_id:
+        return nullcontext()
+    return runProfile.active.phase(name)
@@ -0,0 +1,312 @@
+"""
+Query server for `pycallflow serve`.
+
+Loads the analysis saved in a --db_file once, keeps the results object and its callGraph in
+memory, and answers requests for it over HTTP on localhost or on a Unix socket:
+
+    GET /entities                   the entity list, as -o entity_list shows it (JSON)
+    GET /trace?select=5,11          the results object of the selected entities, or of every
+                                    entity without select (JSON).  max_depth_up, max_depth_down
+                                    and max_fan_out limit the trace.
+    GET /dot?select=5,11&clean=1    DOT text, the dot output options and granularity can be given
+                                    as parameters
+    GET /status                     what is loaded
+
+Every request checks on a pooled read only connection whether the db has changed since it was
+loaded (by a pycallflow --incremental run, say), and loads it again first if it has.
+"""
+from contextlib import contextmanager
+import argparse
+import http.server
+import json
+import os
+import pathlib
+import queue
+import signal
+import socketserver
+import sqlite3
+import stat
+import sys
+import threading
+import time
+import urllib.parse
+
+from .__about__ import __version__
+from .callFlowData import callFlowData
+from .finalResults import callGraph, generateEntityResults_object, getEntityList
+from .reachabilityIndex import tablesFingerprint
+from .rollupResults import generateRollupResults_object
+from .output import DOT_WRITERS, DOT_OPTIONS
+
+
+def serve_run(argv):
+    parser = argparse.ArgumentParser(
+        description="Serves the analysis saved in a --db_file to local clients, without importing or analyzing anything",
+        prog="pycallflow serve")
+    parser.add_argument("--db_file", type=str, required=True, help="Db file made by a pycallflow run with --db_file")
+    parser.add_argument("--port", type=int, default=8765, help="Port to serve HTTP on, on 127.0.0.1 only.  Use 0 to pick a free one.")
+    parser.add_argument("--socket", type=str, default=None, help="Serve HTTP on this Unix socket instead of a port")
+    parser.add_argument("--pool_size", type=int, default=4, help="Number of read only db connections shared by the requests")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db_file):
+        print(f"Unable to serve {args.db_file} because it does not exist, make it with pycallflow --db_file first")
+        return
+    try:
+        callflow = callflowServer(args.db_file, args.pool_size)
+    except Exception as badnews:
+        print(f"Unable to serve {args.db_file} because {badnews}")
+        return
+
+    try:
+        if args.socket is not None:
+            server = unixHTTPServer(args.socket, requestHandler)
+            address = f"unix socket {args.socket}"
+        else:
+            server = http.server.ThreadingHTTPServer(("127.0.0.1", args.port), requestHandler)
+            address = f"http://127.0.0.1:{server.server_address[1]}"
+    except OSError as badnews:
+        print(f"Unable to serve {args.db_file} because {badnews}")
+        callflow.close()
+        return
+    server.daemon_threads = True
+    server.callflow = callflow
+    server.verbose = args.verbose
+    print(f"[-] Serving {args.db_file} ({len(callflow.snapshot.entity_list)} entities) on {address}", file=sys.stderr)
+    # Shut down the same way on kill as on Ctrl-C
+    signal.signal(signal.SIGTERM, stopServing)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        callflow.close()
+
+
+def stopServing(signum, frame):
+    raise KeyboardInterrupt
+
+
+class connectionPool:
+    """
+    Read only connections to a db file, shared by the request threads.  At most size are open,
+    a request that finds them all in use waits for one.
+    """
+
+    def __init__(self, db_file, size=4) -> None:
+        self.uri = pathlib.Path(db_file).resolve().as_uri() + "?mode=ro"
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max(size, 1))
+
+    @contextmanager
+    def connection(self):
+        with self.slots:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+            try:
+                yield conn
+            finally:
+                # An idle connection left in a transaction would keep the db locked for writers
+                if conn.in_transaction:
+                    conn.rollback()
+                self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class analysisSnapshot:
+    """
+    Everything requests are answered from, read from the db in one transaction
+    """
+
+    def __init__(self, db_conn) -> None:
+        db_conn.execute("BEGIN;")
+        try:
+            db_cursor = db_conn.cursor()
+            self.fingerprint = tablesFingerprint(db_cursor)
+            self.run_settings = callFlowData().getRunSettings(db_conn)
+            self.entity_list = getEntityList(db_conn)
+            self.call_graph = callGraph(generateEntityResults_object(db_conn))
+        finally:
+            db_conn.rollback()
+        self.loaded_at = time.time()
+
+
+class callflowServer:
+    """
+    Answers the requests, keeping the snapshot in step with the db
+    """
+
+    def __init__(self, db_file, pool_size=4) -> None:
+        self.db_file = db_file
+        # Brings an older db up to the current schema, which the read only connections can't
+        callFlowData(db_file).getSqliteConnection().close()
+        self.pool = connectionPool(db_file, pool_size)
+        self.reload_lock = threading.Lock()
+        self.loads = 0
+        self.snapshot = None
+        self.currentSnapshot()
+
+    def currentSnapshot(self):
+        with self.pool.connection() as conn:
+            snapshot = self.snapshot
+            if snapshot is not None and snapshot.fingerprint == tablesFingerprint(conn.cursor()):
+                return snapshot
+            with self.reload_lock:
+                # Another request may have loaded it while this one waited
+                if self.snapshot is snapshot:
+                    self.snapshot = analysisSnapshot(conn)
+                    self.loads += 1
+                return self.snapshot
+
+    def entities(self, params):
+        return "application/json", json.dumps(self.currentSnapshot().entity_list)
+
+    def trace(self, params):
+        return "application/json", json.dumps(self.traceResults(self.currentSnapshot(), params))
+
+    def dot(self, params):
+        snapshot = self.currentSnapshot()
+        options = dict(DOT_OPTIONS)
+        for option, default in DOT_OPTIONS.items():
+            if option in params:
+                options[option] = flag(params[option]) if isinstance(default, bool) else params[option]
+        if flag(params.get("clean", "0")):
+            options.update({option: True for option, default in DOT_OPTIONS.items() if isinstance(default, bool)})
+        dot_writer = params.get("dot_writer", "stream")
+        if dot_writer not in DOT_WRITERS:
+            raise ValueError(f"dot_writer must be one of {', '.join(DOT_WRITERS)}")
+        results = self.traceResults(snapshot, params)
+        granularity = params.get("granularity", "entity")
+        if granularity != "entity":
+            entityIDs = None
+            select_entity_id_list = []
+            if "select" in params:
+                entityIDs = results.keys()
+                select_entity_id_list = [int(i) for i in params["select"].split(",")]
+            with self.pool.connection() as conn:
+                rollup = generateRollupResults_object(conn, granularity, entityIDs=entityIDs, select_entity_id_list=select_entity_id_list,
+                                                      suppress_class_references=options["suppress_class_references"])
+            return "text/vnd.graphviz", DOT_WRITERS[dot_writer]().rollup_output(rollup, output_to_stdout=False, **options)
+        dot_data = DOT_WRITERS[dot_writer]().output(results, output_to_stdout=False, select_entity_id=params.get("select"),
+                                                     **options)
+        return "text/vnd.graphviz", dot_data
+
+    def status(self, params):
+        snapshot = self.snapshot
+        return "application/json", json.dumps({
+            "pycallflow": __version__,
+            "db_file": self.db_file,
+            "entities": len(snapshot.entity_list),
+            "run_settings": snapshot.run_settings,
+            "loaded_at": snapshot.loaded_at,
+            "loads": self.loads,
+        })
+
+    def traceResults(self, snapshot, params):
+        """
+        Copies of the snapshot's results, which the dot writers add to, for this request only
+        """
+        call_graph = snapshot.call_graph
+        if "select" not in params:
+            return call_graph.allResults()
+        try:
+            select_entity_id_list = [int(i) for i in params["select"].split(",")]
+        except ValueError:
+            raise ValueError(f"Unable to parse select: {params['select']}")
+        missing = [str(i) for i in select_entity_id_list if i not in call_graph.results_object]
+        if len(missing) > 0:
+            raise ValueError(f"No entity with ID {','.join(missing)}")
+        limits = {}
+        for limit in ["max_depth_up", "max_depth_down", "max_fan_out"]:
+            if limit in params:
+                try:
+                    limits[limit] = int(params[limit])
+                except ValueError:
+                    raise ValueError(f"Unable to parse {limit}: {params[limit]}")
+        if len(limits) > 0:
+            return call_graph.boundedTrace(select_entity_id_list, **limits)
+        return call_graph.trace(select_entity_id_list)
+
+    def close(self):
+        self.pool.close()
+
+
+def flag(value):
+    return value.lower() in ["", "1", "true", "yes", "on"]
+
+
+ROUTES = {
+    "/entities": callflowServer.entities,
+    "/trace": callflowServer.trace,
+    "/dot": callflowServer.dot,
+    "/status": callflowServer.status,
+}
+
+
+class requestHandler(http.server.BaseHTTPRequestHandler):
+    server_version = f"pycallflow/{__version__}"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query, keep_blank_values=True).items()}
+        route = ROUTES.get(url.path)
+        if route is None:
+            self.reply(404, "application/json", json.dumps({"error": f"No such endpoint {url.path}, try one of {', '.join(ROUTES)}"}))
+            return
+        try:
+            content_type, body = route(self.server.callflow, params)
+        except ValueError as badnews:
+            self.reply(400, "application/json", json.dumps({"error": str(badnews)}))
+            return
+        except Exception as badnews:
+            self.reply(500, "application/json", json.dumps({"error": f"Unable to answer {self.path} because {badnews}"}))
+            return
+        self.reply(200, content_type, body)
+
+    def reply(self, status, content_type, body):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class unixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP on a Unix socket, which only the user running the server can connect to
+    """
+
+    def __init__(self, socket_path, handler) -> None:
+        if os.path.exists(socket_path) and stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            # Left behind by a server that didn't shut down cleanly
+            os.unlink(socket_path)
+        super().__init__(socket_path, handler)
+        os.chmod(socket_path, 0o600)
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
@@ -0,0 +1,125 @@
+"""
+Reachability index for --select_entity_id queries against a saved --db_file.
+
+The first select against an analysis condenses the call graph into its strongly connected
+components (EntityComponents) and saves the calls between components (ComponentCalls), which
+form a DAG no bigger than the Calls table.  A select then follows that DAG from the selected
+entities' components with a recursive query, and only loads the entities it keeps and their
+calls, instead of loading the whole db and walking the graph.  Saving the closure itself would
+take space quadratic in the number of entities on a long chain of calls.
+
+The index remembers what the Entities and Calls tables looked like when it was built, and is
+built again the next time it is needed after either has changed.
+"""
+import sys
+
+from .finalResults import callGraph, generateEntityResults_object, addClasses, selectEntities
+
+# RunSettings entry holding tablesFingerprint() as of the last index build
+REACH_INDEX_SETTING = "reach_index_fingerprint"
+
+
+def generateEntityResults_indexed(db_conn, select_entity_id):
+    """
+    Same results as generateEntityResults_selectID_object, answered from the reachability index
+    (which is built first if it is missing or out of date)
+    """
+    if select_entity_id is None:
+        return generateEntityResults_object(db_conn)
+    try:
+        select_entity_id_list = [int(i) for i in select_entity_id.split(",")]
+    except Exception as badnews:
+        print(
+            f"generateEntityResults_indexed: Unable to parse select_entity_id: {select_entity_id}", file=sys.stderr)
+        return generateEntityResults_object(db_conn)
+
+    if not reachabilityIndexIsCurrent(db_conn):
+        buildReachabilityIndex(db_conn)
+    return generateEntityResults_object(db_conn, entityIDs=tracedEntityIDs(db_conn, select_entity_id_list))
+
+
+def reachabilityIndexIsCurrent(db_conn):
+    stmt = "SELECT setting_value FROM RunSettings WHERE setting_name = ?;"
+    row = db_conn.cursor().execute(stmt, (REACH_INDEX_SETTING, )).fetchone()
+    return row is not None and row[0] == tablesFingerprint(db_conn.cursor())
+
+
+def tablesFingerprint(db_cursor):
+    """
+    Changes whenever rows are added to or removed from Entities or Calls.  AUTOINCREMENT never
+    hands out an ID twice, so deleting and adding the same number of rows still changes it.
+    """
+    fingerprint = []
+    for table in ["Entities", "Calls"]:
+        count = db_cursor.execute(f"SELECT count(*) FROM {table};").fetchone()[0]
+        row = db_cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?;", (table, )).fetchone()
+        fingerprint.append(f"{table}:{count}:{0 if row is None else row[0]}")
+    return ",".join(fingerprint)
+
+
+def buildReachabilityIndex(db_conn, call_graph=None):
+    """
+    (Re)builds EntityComponents and ComponentCalls
+    call_graph - callGraph of the whole db, if one has already been made [built from the db]
+    """
+    if call_graph is None:
+        call_graph = callGraph(generateEntityResults_object(db_conn))
+    db_cursor = db_conn.cursor()
+    db_cursor.execute("DELETE FROM EntityComponents;")
+    db_cursor.execute("DELETE FROM ComponentCalls;")
+    db_cursor.executemany("INSERT INTO EntityComponents (entityID, componentID) VALUES (?, ?);",
+                          sorted(call_graph.component_of.items()))
+    db_cursor.executemany("INSERT INTO ComponentCalls (componentID, called_componentID) VALUES (?, ?);", (
+        (component, next_component)
+        for component in range(len(call_graph.components))
+        for next_component in sorted(call_graph.nextComponents(component, call_graph.successors))
+    ))
+    db_cursor.execute("INSERT OR REPLACE INTO RunSettings (setting_name, setting_value) VALUES (?, ?);",
+                      (REACH_INDEX_SETTING, tablesFingerprint(db_cursor)))
+    db_conn.commit()
+
+
+def tracedEntityIDs(db_conn, select_entity_id_list):
+    """
+    The set of entities callGraph.trace would keep for these entities: everything that calls,
+    or is called from, them (directly or not), plus the classes of all of those
+    """
+    db_cursor = db_conn.cursor()
+    selectEntities(db_cursor, select_entity_id_list)
+    found = {row[0] for row in db_cursor.execute(
+        "SELECT entityID FROM Entities WHERE entityID IN (SELECT entityID FROM temp.SelectedEntities);")}
+    for entityID in select_entity_id_list:
+        if entityID not in found:
+            print(f"generateEntityResults_indexed: No entity with ID {entityID}", file=sys.stderr)
+    # UNION rather than UNION ALL, so a component reached along several paths is only followed once
+    stmt = """
+        WITH RECURSIVE
+            selected(componentID) AS (
+                SELECT componentID FROM EntityComponents
+                WHERE entityID IN (SELECT entityID FROM temp.SelectedEntities)
+            ),
+            downstream(componentID) AS (
+                SELECT componentID FROM selected
+                UNION
+                SELECT called_componentID FROM ComponentCalls
+                JOIN downstream ON ComponentCalls.componentID=downstream.componentID
+            ),
+            upstream(componentID) AS (
+                SELECT componentID FROM selected
+                UNION
+                SELECT ComponentCalls.componentID FROM ComponentCalls
+                JOIN upstream ON ComponentCalls.called_componentID=upstream.componentID
+            )
+        SELECT
+            entityID
+        FROM
+            EntityComponents
+        WHERE
+            componentID IN (SELECT componentID FROM downstream UNION SELECT componentID FROM upstream);
+    """
+    # Entities without a component can't call or be called by anything
+    keep = set(found)
+    keep.update(row[0] for row in db_cursor.execute(stmt))
+
+    # We need to add in the classes for these entities
+    return addClasses(db_cursor, keep)
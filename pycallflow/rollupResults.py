@@ -0,0 +1,210 @@
+"""
+Rolled up views of the call graph for --granularity, where each node is a whole file, package,
+or class instead of one entity.
+
+Every entity is put in its group in a temp table, and the calls between groups are then
+counted by SQLite in one GROUP BY over Calls, so the results object of every entity is never
+built.  The weight of an edge is the number of call sites in the caller group that call into
+the called group (an ambiguous call counts once).
+"""
+import sys
+from contextlib import contextmanager
+
+from .compactGraph import compactGraphFromDB
+from .finalResults import selectEntities, addClasses
+from .reachabilityIndex import reachabilityIndexIsCurrent, buildReachabilityIndex, tracedEntityIDs
+
+GRANULARITIES = ["entity", "file", "package", "class"]
+
+"""
+generateRollupResults_object returns
+{
+    groupID: {
+        "name": file or package import path, or class name,
+        "file_import_path": file the group is in, for class groups, otherwise None,
+        "entities": number of entities in the group,
+        "selected": True if the group holds a --select_entity_id entity,
+        "calls": {
+            called groupID: weight
+        }
+    }
+}
+"""
+
+
+def generateRollupResults_selectID_object(db_conn, granularity, select_entity_id, indexed=False,
+                                          max_depth_up=None, max_depth_down=None, max_fan_out=None, **kwargs):
+    """
+    Rollup of the entities that call, or are called from, the selected ones
+    indexed - trace with the saved reachability index (building it if needed), for a db_file
+    max_depth_up, max_depth_down, max_fan_out - limits for the trace, as for
+        generateEntityResults_selectID_object [no limit]
+    kwargs - passed on to generateRollupResults_object
+    """
+    if select_entity_id is None:
+        return generateRollupResults_object(db_conn, granularity, **kwargs)
+    try:
+        select_entity_id_list = [int(i) for i in select_entity_id.split(",")]
+    except Exception as badnews:
+        print(
+            f"generateRollupResults_selectID_object: Unable to parse select_entity_id: {select_entity_id}", file=sys.stderr)
+        return generateRollupResults_object(db_conn, granularity, **kwargs)
+
+    with tempTablesTransaction(db_conn):
+        if max_depth_up is not None or max_depth_down is not None or max_fan_out is not None:
+            graph = compactGraphFromDB(db_conn)
+            keep, _, _ = graph.boundedTraceIDs(select_entity_id_list, max_depth_up, max_depth_down, max_fan_out)
+            entityIDs = addClasses(db_conn.cursor(), keep)
+        elif indexed:
+            if not reachabilityIndexIsCurrent(db_conn):
+                buildReachabilityIndex(db_conn)
+            entityIDs = tracedEntityIDs(db_conn, select_entity_id_list)
+        else:
+            entityIDs = addClasses(db_conn.cursor(), compactGraphFromDB(db_conn).traceIDs(select_entity_id_list))
+        return generateRollupResults_object(db_conn, granularity, entityIDs=entityIDs,
+                                            select_entity_id_list=select_entity_id_list, **kwargs)
+
+
+def generateRollupResults_object(db_conn, granularity, entityIDs=None, select_entity_id_list=(),
+                                 suppress_class_references=False, **kwargs):
+    """
+    granularity - "file", "package", or "class"
+    entityIDs - only roll up these entities [all entities]
+    select_entity_id_list - entities whose groups are marked selected
+    suppress_class_references - leave out references to classes, as the entity view does
+    """
+    db_cursor = db_conn.cursor()
+    with tempTablesTransaction(db_conn):
+        names = groupEntities(db_cursor, granularity, entityIDs)
+
+        toreturn = {}
+        stmt = """
+            SELECT
+                groupID,
+                count(*) AS entities
+            FROM
+                temp.EntityGroups
+            GROUP BY
+                groupID;
+        """
+        for row in db_cursor.execute(stmt):
+            name, file_import_path = names[row["groupID"]]
+            toreturn[row["groupID"]] = {
+                "name": name,
+                "file_import_path": file_import_path,
+                "entities": row["entities"],
+                "selected": False,
+                "calls": {},
+            }
+
+        class_references = ""
+        if suppress_class_references:
+            class_references = """
+                JOIN
+                    Entities ON Calls.called_entity_ID=Entities.entityID
+                WHERE
+                    Entities.entity_type != 'class'
+            """
+        stmt = f"""
+            SELECT
+                caller.groupID AS from_group,
+                called.groupID AS to_group,
+                count(DISTINCT Calls.collision_num) AS weight
+            FROM
+                Calls
+            JOIN
+                temp.EntityGroups AS caller ON Calls.entityID=caller.entityID
+            JOIN
+                temp.EntityGroups AS called ON Calls.called_entity_ID=called.entityID
+            {class_references}
+            GROUP BY
+                caller.groupID, called.groupID
+            ORDER BY
+                caller.groupID, called.groupID;
+        """
+        for row in db_cursor.execute(stmt):
+            toreturn[row["from_group"]]["calls"][row["to_group"]] = row["weight"]
+
+        if len(select_entity_id_list) > 0:
+            selectEntities(db_cursor, select_entity_id_list)
+            stmt = "SELECT groupID FROM temp.EntityGroups WHERE entityID IN (SELECT entityID FROM temp.SelectedEntities);"
+            for row in db_cursor.execute(stmt):
+                toreturn[row["groupID"]]["selected"] = True
+        return toreturn
+
+
+@contextmanager
+def tempTablesTransaction(db_conn):
+    """
+    Filling the temp tables starts a transaction.  It is rolled back afterwards (unless one was
+    open already) so that a read only connection doesn't go on holding its lock on the db.
+    """
+    in_transaction = db_conn.in_transaction
+    try:
+        yield
+    finally:
+        if not in_transaction and db_conn.in_transaction:
+            db_conn.rollback()
+
+
+def groupEntities(db_cursor, granularity, entityIDs=None):
+    """
+    Fills temp.EntityGroups with the group of every entity (or of entityIDs)
+    returns {groupID: (name, file_import_path)}
+    """
+    db_cursor.execute("CREATE TEMP TABLE IF NOT EXISTS EntityGroups (entityID INTEGER PRIMARY KEY, groupID INTEGER);")
+    db_cursor.execute("DELETE FROM temp.EntityGroups;")
+    where = ""
+    if entityIDs is not None:
+        selectEntities(db_cursor, entityIDs)
+        where = "WHERE Entities.entityID IN (SELECT entityID FROM temp.SelectedEntities)"
+
+    if granularity == "file":
+        group = "Entities.fileID"
+        stmt = "SELECT fileID, package_path FROM Files;"
+        names = {row[0]: (row[1], None) for row in db_cursor.execute(stmt)}
+    elif granularity == "package":
+        # The package of a module is its import path less the last part, which for a package's
+        # own __init__ file is the package itself
+        packageIDs = {}
+        file_groups = []
+        for fileID, package_path in db_cursor.execute("SELECT fileID, package_path FROM Files;").fetchall():
+            package = package_path.rpartition(".")[0] or package_path
+            file_groups.append((fileID, packageIDs.setdefault(package, len(packageIDs))))
+        db_cursor.execute("CREATE TEMP TABLE IF NOT EXISTS FileGroups (fileID INTEGER PRIMARY KEY, groupID INTEGER);")
+        db_cursor.execute("DELETE FROM temp.FileGroups;")
+        db_cursor.executemany("INSERT INTO temp.FileGroups (fileID, groupID) VALUES (?, ?);", file_groups)
+        group = "(SELECT groupID FROM temp.FileGroups WHERE FileGroups.fileID=Entities.fileID)"
+        names = {groupID: (package, None) for package, groupID in packageIDs.items()}
+    elif granularity == "class":
+        # Methods go in their class, and everything else (classes, module level functions) is a
+        # group of its own
+        group = """
+            CASE
+                WHEN Entities.entity_type = 'class' OR Entities.member_of_class IS NULL THEN Entities.entityID
+                ELSE Entities.member_of_class
+            END
+        """
+        stmt = """
+            SELECT
+                entityID,
+                entity_name,
+                entity_type,
+                Files.package_path
+            FROM
+                Entities
+            JOIN
+                Files ON Entities.fileID=Files.fileID
+            WHERE
+                entity_type = 'class' OR member_of_class IS NULL;
+        """
+        names = {}
+        for entityID, name, entity_type, package_path in db_cursor.execute(stmt):
+            # Named the way the entity view names them
+            name += ":" if entity_type == "class" else "()"
+            names[entityID] = (name, package_path)
+    else:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES[1:])}")
+
+    db_cursor.execute(f"INSERT INTO temp.EntityGroups (entityID, groupID) SELECT Entities.entityID, {group} FROM Entities {where};")
+    return names
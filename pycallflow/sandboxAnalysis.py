@@ -0,0 +1,176 @@
+"""
+Imports each file in its own short lived child process.
+
+A module that blocks on import, leaks threads, or scribbles on global state only takes its own
+child down with it.  Each child imports one file into its own in-memory database and sends back
+the rows in the analysisCache entry format, the same as a parallelAnalysis worker.  A child that
+runs past the timeout is killed and its file skipped, and a memory limit can be put on each
+child's address space.  The parent never imports the target, so its memory stays flat, and it
+saves the entries in Files order so entity IDs come out exactly as they would from a serial run.
+"""
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import sys
+import time
+
+from .buildFileDB import getFileList, addTargetFiles
+from .analysisCache import saveEntryToDB
+from .callFlowData import bulkWriter
+from .parallelAnalysis import initWorker, analyzeFileWorker
+from .profiling import countEvent
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows
+    resource = None
+
+
+def findDeclaredEntities_sandboxed(db_conn, jobs=1, timeout=60, memory_limit=None, fileIDs=None, cache=None,
+                                   stdout_capture_file=os.devnull, target_files=None):
+    """
+    Sandboxed version of findDeclaredEntities_inlineSave
+    jobs - number of files imported at once, 0 for one per CPU [1]
+    timeout - seconds a file gets to import and be disassembled before it is skipped [60]
+    memory_limit - MB each child may allocate on top of what it starts with, None for no limit [None]
+    fileIDs - only process these files [all files]
+    cache - analysisCache to reuse results from [None]
+    stdout_capture_file - where the children send output from the analyzed code [os.devnull]
+    target_files - walkTargetFiles generator to add the files from first [None]
+    """
+    if target_files is not None:
+        addTargetFiles(db_conn, target_files)
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    if memory_limit is not None and resource is None:
+        print("Unable to limit the memory of sandboxed imports because this platform has no resource module", file=sys.stderr)
+        memory_limit = None
+    file_list = [f for f in getFileList(db_conn) if fileIDs is None or f["fileID"] in fileIDs]
+
+    cached_entries = {}
+    to_analyze = []
+    for f in file_list:
+        entry = None
+        if cache is not None:
+            entry = cache.loadEntry(f)
+        if entry is None:
+            to_analyze.append(f)
+        else:
+            cached_entries[f["fileID"]] = entry
+
+    entries = {}
+    # Timed out or died, so nothing from these files is in the db
+    timed_out = []
+    for f, entry, error in runSandboxes(to_analyze, jobs, timeout, memory_limit, stdout_capture_file):
+        entries[f["fileID"]] = (entry, error)
+        if entry is None:
+            timed_out.append(f)
+
+    to_cache = []
+    with bulkWriter(db_conn) as writer:
+        # Children finish in any order, save in Files order
+        for f in file_list:
+            if f["fileID"] in cached_entries:
+                saveEntryToDB(writer, f["fileID"], cached_entries[f["fileID"]])
+                continue
+            entry, error = entries[f["fileID"]]
+            if entry is not None:
+                saveEntryToDB(writer, f["fileID"], entry)
+            if error is not None:
+                print(f"Unable to process file {f['file_full_path']} because {error}", file=sys.stderr)
+            else:
+                to_cache.append(f)
+    if cache is not None:
+        cache.storeFiles(db_conn.cursor(), to_cache)
+    if len(timed_out) > 0:
+        countEvent("sandbox_skipped", len(timed_out))
+        print(f"Skipped {len(timed_out)} files that timed out or whose import process died:", file=sys.stderr)
+        for f in timed_out:
+            print(f"    {f['file_full_path']}", file=sys.stderr)
+    return
+
+
+def runSandboxes(file_list, jobs, timeout, memory_limit, stdout_capture_file, static=False):
+    """
+    Generates (file_row, entry, error) as the children finish.  entry is None if the child
+    timed out or died before sending anything back
+    timeout - seconds each child gets, None for no limit
+    static - Set True to have the children parse the files with ast instead of importing them [False]
+    """
+    context = sandboxContext()
+    to_start = list(file_list)
+    running = {}
+    try:
+        while to_start or running:
+            while to_start and len(running) < jobs:
+                f = to_start.pop(0)
+                parent_conn, child_conn = context.Pipe(duplex=False)
+                child = context.Process(target=sandboxWorker, args=(f, stdout_capture_file, memory_limit, child_conn, static),
+                                        daemon=True)
+                child.start()
+                # Only the child writes to it
+                child_conn.close()
+                running[parent_conn] = (child, f, None if timeout is None else time.monotonic() + timeout)
+
+            deadlines = [deadline for _, _, deadline in running.values() if deadline is not None]
+            wait_for = None
+            if len(deadlines) > 0:
+                wait_for = max(min(deadlines) - time.monotonic(), 0)
+            for parent_conn in wait(list(running), timeout=wait_for):
+                child, f, _ = running.pop(parent_conn)
+                try:
+                    entry, error = parent_conn.recv()
+                except EOFError:
+                    entry = None
+                parent_conn.close()
+                child.join()
+                if entry is None:
+                    # Died without sending anything back (killed, crashed, or hit the memory limit)
+                    error = f"its import process exited with code {child.exitcode}"
+                yield f, entry, error
+
+            now = time.monotonic()
+            for parent_conn in [c for c, (_, _, deadline) in running.items() if deadline is not None and deadline <= now]:
+                child, f, _ = running.pop(parent_conn)
+                child.kill()
+                child.join()
+                parent_conn.close()
+                yield f, None, f"importing it took longer than {timeout} seconds"
+    finally:
+        for child, _, _ in running.values():
+            child.kill()
+            child.join()
+
+
+def sandboxContext():
+    # fork skips re-importing pycallflow in every child, spawn is the fallback
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def sandboxWorker(file_row, stdout_capture_file, memory_limit, result_conn, static=False):
+    """
+    Runs in the child process
+    """
+    initWorker(stdout_capture_file)
+    if memory_limit is not None:
+        limit = addressSpaceUsed() + memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    result_conn.send(analyzeFileWorker(file_row, static))
+    result_conn.close()
+    sys.stdout.flush()
+    # Skips waiting on any threads the analyzed code left running
+    os._exit(0)
+
+
+def addressSpaceUsed():
+    """
+    Bytes of address space this process is using, 0 if it can't be found
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
@@ -0,0 +1,285 @@
+"""
+Static entity discovery using ast.  Nothing in the target is imported or executed, so this is
+safe to run on code you would rather not run and avoids paying for heavy module level imports.
+
+The rows produced mirror what the import based engine in buildDeclaredEntitiesDB produces.
+Entities are found from the source and each one carries the list of names it references, in the
+order the bytecode would load them, so buildCallflowDB does not need to disassemble anything.
+"""
+import ast
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import types
+
+from .buildFileDB import getFileList, streamFileRows
+from .buildDeclaredEntitiesDB import addEntityToDB
+from .callFlowData import callFlowData, bulkWriter, BACKGROUND_BATCH_SIZE
+from .analyzeCallFlow import saveCallNames
+from .profiling import profileTimer
+
+
+class staticEntity:
+    """
+    Stand-in for a live python object when the entity was found in the ast.
+    Classes get no call names, so like live classes they are skipped by saveCallNames.
+    """
+    def __init__(self, name, call_names=None) -> None:
+        self.__name__ = name
+        if call_names is not None:
+            self.callflow_call_names = call_names
+
+
+class callNameCollector(ast.NodeVisitor):
+    """
+    Collects the names an entity's code references, roughly in bytecode load order.
+    Like the bytecodeScanner, the bodies of nested functions, lambdas, and classes count as
+    the enclosing entity's, at the point the nested code would be loaded.
+    """
+    def __init__(self) -> None:
+        self.names = []
+
+    def visit_Name(self, node):
+        self.names.append(node.id)
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        self.names.append(node.attr)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, str):
+            self.names.append(node.value)
+
+    def visit_Tuple(self, node):
+        # Constant tuples are folded into a single (non string) constant by the compiler
+        if not isConstantCollection(node):
+            self.generic_visit(node)
+
+    def visit_List(self, node):
+        # So are constant lists and sets with more than a couple of items
+        if not (isConstantCollection(node) and len(node.elts) > 2):
+            self.generic_visit(node)
+
+    visit_Set = visit_List
+
+    def visit_Compare(self, node):
+        # ... and any constant list or set on the right of 'in'
+        self.visit(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)) and isConstantCollection(comparator):
+                continue
+            self.visit(comparator)
+
+    def visit_Expr(self, node):
+        # Bare string expressions (docstrings) never get loaded
+        if isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+            return
+        self.generic_visit(node)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.names.append(alias.name)
+            if alias.asname is not None:
+                # import a.b.c as d loads b and c from a
+                self.names.extend(alias.name.split(".")[1:])
+            self.names.append(alias.asname or alias.name.split(".")[0])
+
+    def visit_ImportFrom(self, node):
+        self.names.append(node.module or "")
+        for alias in node.names:
+            self.names.append(alias.name)
+            if alias.asname is not None:
+                self.names.append(alias.asname)
+
+    def visit_FunctionDef(self, node):
+        for expr in node.decorator_list + node.args.defaults + node.args.kw_defaults:
+            if expr is not None:
+                self.visit(expr)
+        for stmt in node.body:
+            self.visit(stmt)
+        self.names.append(node.name)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        for expr in node.args.defaults + node.args.kw_defaults:
+            if expr is not None:
+                self.visit(expr)
+        self.visit(node.body)
+
+    def visit_ClassDef(self, node):
+        for expr in node.decorator_list:
+            self.visit(expr)
+        for stmt in node.body:
+            self.visit(stmt)
+        for expr in node.bases + [kw.value for kw in node.keywords]:
+            self.visit(expr)
+        self.names.append(node.name)
+
+
+def isConstantCollection(node):
+    return isinstance(node, (ast.Tuple, ast.List, ast.Set)) and all(
+        isinstance(elt, ast.Constant) for elt in node.elts)
+
+
+def collectCallNames(def_node):
+    collector = callNameCollector()
+    for stmt in def_node.body:
+        collector.visit(stmt)
+    return collector.names
+
+
+def findStaticTarget(target):
+    """
+    Locates a package without importing it.  Returns an object with the __name__ and __path__
+    attributes buildFileDB needs.
+    find_spec() on a dotted name imports the packages it is in, running their __init__ code, so
+    it is only asked for the top level package and the rest are looked up in its directories.
+    """
+    top_level, _, rest = target.partition(".")
+    spec = importlib.util.find_spec(top_level)
+    search_paths = spec.submodule_search_locations if spec is not None else None
+    for name in rest.split(".") if rest else []:
+        if not search_paths:
+            break
+        search_paths = packageDirectories(search_paths, name)
+    if not search_paths:
+        raise ModuleNotFoundError(f"No package named {target!r}", name=target)
+    return types.SimpleNamespace(__name__=target, __path__=list(search_paths))
+
+
+def packageDirectories(search_paths, name):
+    """
+    The directories of the subpackage name, found in its parent's search_paths the way the import
+    system would.  The first regular package (or module) wins, otherwise every directory found
+    makes up a namespace package.  Returns [] when name is a module rather than a package.
+    """
+    portions = []
+    for search_path in search_paths:
+        directory = os.path.join(search_path, name)
+        if os.path.isdir(directory):
+            if any(os.path.isfile(os.path.join(directory, "__init__" + suffix)) for suffix in importlib.machinery.all_suffixes()):
+                return [directory]
+            portions.append(directory)
+        elif any(os.path.isfile(directory + suffix) for suffix in importlib.machinery.all_suffixes()):
+            return []
+    return portions
+
+
+def declaredNodes(body):
+    """
+    Returns {name: node} for the functions and classes bound in this block, the way they would
+    end up as attributes after it runs.  Walks into if/try/with blocks but not into defs.
+    """
+    toreturn = {}
+    for stmt in body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if isPropertyDef(stmt):
+                continue
+            toreturn[stmt.name] = stmt
+        else:
+            for block in ("body", "orelse", "finalbody"):
+                toreturn.update(declaredNodes(getattr(stmt, block, [])))
+            for handler in getattr(stmt, "handlers", []):
+                toreturn.update(declaredNodes(handler.body))
+    return toreturn
+
+
+def isPropertyDef(node):
+    # Properties are not functions once the class is built, so the import engine skips them too
+    for deco in getattr(node, "decorator_list", []):
+        if isinstance(deco, ast.Name) and deco.id == "property":
+            return True
+        if isinstance(deco, ast.Attribute) and deco.attr in ("setter", "getter", "deleter"):
+            return True
+    return False
+
+
+def classMembers(node, module_declared, seen=None):
+    """
+    Returns {name: node} for a class, including members inherited from base classes declared in
+    the same file.  inspect.getmembers() reports those too, so the import engine records them.
+    """
+    if seen is None:
+        seen = set()
+    seen.add(node.name)
+    toreturn = {}
+    for base in reversed(node.bases):
+        if isinstance(base, ast.Name) and base.id not in seen:
+            base_node = module_declared.get(base.id)
+            if isinstance(base_node, ast.ClassDef):
+                toreturn.update(classMembers(base_node, module_declared, seen))
+    toreturn.update(declaredNodes(node.body))
+    return toreturn
+
+
+def findDeclaredEntities_static(db_conn, fileIDs=None, cache=None, target_files=None):
+    """
+    Parses each file in the Files table and saves the entities inline, same as
+    findDeclaredEntities_inlineSave but without importing anything
+    fileIDs - only process these files [all files]
+    cache - analysisCache to reuse results from [None]
+    target_files - walkTargetFiles generator to add and parse the files from as they are found [None]
+    """
+    file_list = getFileList(db_conn)
+    to_cache = []
+    with bulkWriter(db_conn, BACKGROUND_BATCH_SIZE, background=True) as writer:
+        if target_files is not None:
+            file_list = streamFileRows(writer, target_files)
+        for f in file_list:
+            if fileIDs is not None and f["fileID"] not in fileIDs:
+                continue
+            if cache is not None and cache.restoreFile(writer, f):
+                continue
+            try:
+                saveStaticFileEntities(writer, f)
+                to_cache.append(f)
+            except Exception as badnews:
+                print(
+                    f"Unable to process file {f['file_full_path']} because {badnews}", file=sys.stderr)
+    if cache is not None:
+        cache.storeFiles(db_conn.cursor(), to_cache)
+    return
+
+
+def saveStaticFileEntities(db_cursor, file_row):
+    """
+    Parses the file in this Files row and saves its entities and their call names
+    """
+    with profileTimer("parse"):
+        with open(file_row["file_full_path"], "rb") as source:
+            tree = ast.parse(source.read(), filename=file_row["file_full_path"])
+    with profileTimer("static_scan"):
+        module_declared = declaredNodes(tree.body)
+        py_objs = {}
+        saveStaticEntities(db_cursor, file_row["fileID"], module_declared, file_row["package_path"],
+                           module_declared=module_declared, py_objs=py_objs)
+        saveCallNames(db_cursor, py_objs.values())
+    callFlowData().releaseDiscoveredObjects()
+
+
+def saveStaticEntities(db_cursor, fileID, declared, import_path, member_of_class=None, module_declared=None, py_objs=None):
+    """
+    Static counterpart to inspectAndSaveEntities.  Members are visited in name order, as
+    inspect.getmembers() would, so the entity IDs line up with the import engine.
+
+    py_objs maps each ast node to its one staticEntity.  An inherited member is the same object
+    in every class that has it, just like the live function would be.
+    """
+    for name in sorted(declared):
+        node = declared[name]
+        if node not in py_objs:
+            call_names = None if isinstance(node, ast.ClassDef) else collectCallNames(node)
+            py_objs[node] = staticEntity(node.name, call_names)
+        py_obj = py_objs[node]
+        callFlowData().addDiscoveredObject(py_obj)
+        if isinstance(node, ast.ClassDef):
+            class_entityID = addEntityToDB(db_cursor, fileID, node.name, entity_type="class",
+                                           import_path=f"{import_path}", py_obj=py_obj, member_of_class=member_of_class)
+            saveStaticEntities(db_cursor, fileID, classMembers(node, module_declared),
+                               f"{import_path}.{node.name}", class_entityID, module_declared, py_objs)
+        else:
+            addEntityToDB(db_cursor, fileID, node.name, entity_type="function",
+                          import_path=f"{import_path}", py_obj=py_obj, member_of_class=member_of_class)
+    return
@@ -0,0 +1,36 @@
+import itertools
+import sys
+import textwrap
+
+import pytest
+
+package_numbers = itertools.count()
+
+
+@pytest.fixture
+def make_package(tmp_path, monkeypatch):
+    """
+    Writes a throwaway package under tmp_path and puts it on sys.path.  Called as
+    make_package({"module.py": source, ...}), returns the package name.  Every package gets a
+    name of its own, and its modules are taken back out of sys.modules afterwards.
+    """
+    monkeypatch.syspath_prepend(str(tmp_path))
+    names = []
+
+    def make(files):
+        name = f"cftest_pkg{next(package_numbers)}"
+        names.append(name)
+        writeFiles(tmp_path / name, dict({"__init__.py": ""}, **files))
+        return name
+
+    yield make
+    for module_name in list(sys.modules):
+        if module_name.split(".")[0] in names:
+            del sys.modules[module_name]
+
+
+def writeFiles(directory, files):
+    for rel_path, source in files.items():
+        path = directory / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(textwrap.dedent(source))
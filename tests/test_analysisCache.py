@@ -0,0 +1,139 @@
+import json
+import re
+
+import pytest
+
+from pycallflow.analysisCache import analysisCache, entryFromDB, saveEntryToDB
+from pycallflow.callflow import collectData
+
+FILES = {
+    "shapes.py": """
+        class Shape:
+            def area(self):
+                return 0
+
+            def describe(self):
+                return self.area()
+
+        class Square(Shape):
+            def area(self):
+                return 4
+
+        def make():
+            return Square()
+    """,
+    "report.py": """
+        from .shapes import make
+
+        def report():
+            return make().describe()
+    """,
+}
+
+
+def cachedRun(package, cache_dir, capsys, **settings):
+    """
+    Returns (hits, misses, entities, calls) for a verbose run with the cache
+    """
+    conn = collectData(package, cache_dir=str(cache_dir), verbose=True, **settings).getSqliteConnection()
+    hits, misses = map(int, re.search(r"Analysis cache: (\d+) hits, (\d+) misses", capsys.readouterr().err).groups())
+    entities = sorted(tuple(row) for row in conn.execute("""
+        SELECT entity_name, entity_type, import_path, (SELECT entity_name FROM Entities AS cls WHERE cls.entityID = Entities.member_of_class)
+        FROM Entities;
+    """))
+    calls = sorted(tuple(row) for row in conn.execute("""
+        SELECT caller.import_path || '.' || caller.entity_name, called.import_path || '.' || called.entity_name
+        FROM Calls
+        JOIN Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """))
+    return hits, misses, entities, calls
+
+
+def entryFiles(cache_dir):
+    return sorted(str(path) for path in cache_dir.glob("*/*.json"))
+
+
+@pytest.mark.parametrize("static", [False, True])
+def test_miss_then_hit(make_package, tmp_path, capsys, static):
+    package = make_package(FILES)
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    hits, misses, entities, calls = cachedRun(package, cache_dir, capsys, static=static)
+    assert (hits, misses) == (0, 3)
+    assert len(entryFiles(cache_dir)) == 3
+    assert ("describe", "function", f"{package}.shapes.Square", "Square") in entities
+    assert (f"{package}.report.report", f"{package}.shapes.make") in calls
+
+    assert cachedRun(package, cache_dir, capsys, static=static) == (3, 0, entities, calls)
+    # The other engine has entries of its own
+    assert cachedRun(package, cache_dir, capsys, static=not static)[:2] == (0, 3)
+
+
+def test_key_changes(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    source = tmp_path / "mod.py"
+    source.write_text("def f():\n    pass\n")
+    cache = analysisCache(str(cache_dir))
+    key = cache.cacheKey(str(source), "pkg.mod")
+    assert cache.cacheKey(str(source), "pkg.mod") == key
+    # Only the content counts, not where the file is or when it was written
+    moved = tmp_path / "moved.py"
+    moved.write_text("def f():\n    pass\n")
+    assert cache.cacheKey(str(moved), "pkg.mod") == key
+
+    assert cache.cacheKey(str(source), "pkg.other") != key
+    assert analysisCache(str(cache_dir), static=True).cacheKey(str(source), "pkg.mod") != key
+    source.write_text("def f():\n    return 1\n")
+    assert cache.cacheKey(str(source), "pkg.mod") != key
+
+
+def test_entry_round_trip(make_package):
+    package = make_package(FILES)
+    conn = collectData(package).getSqliteConnection()
+    fileID = conn.execute("SELECT fileID FROM Files WHERE package_path = ?;", (f"{package}.shapes", )).fetchone()[0]
+    entry = entryFromDB(conn.cursor(), fileID)
+    by_path = {f"{e['import_path']}.{e['entity_name']}": e for e in entry["entities"]}
+    square = entry["entities"].index(by_path[f"{package}.shapes.Square"])
+    assert by_path[f"{package}.shapes.Square.describe"]["member_of_class"] == square
+    assert by_path[f"{package}.shapes.Square"]["call_names"] is None
+    assert by_path[f"{package}.shapes.make"]["call_names"] == ["Square"]
+
+    conn.execute("DELETE FROM EntityCallNames WHERE entityID IN (SELECT entityID FROM Entities WHERE fileID = ?);", (fileID, ))
+    conn.execute("DELETE FROM Entities WHERE fileID = ?;", (fileID, ))
+    saveEntryToDB(conn.cursor(), fileID, entry)
+    assert entryFromDB(conn.cursor(), fileID) == entry
+    members = {tuple(row) for row in conn.execute("""
+        SELECT member.entity_name, cls.entity_name
+        FROM Entities AS member JOIN Entities AS cls ON member.member_of_class=cls.entityID
+        WHERE member.fileID = ?;
+    """, (fileID, ))}
+    assert members == {("area", "Shape"), ("describe", "Shape"), ("area", "Square"), ("describe", "Square")}
+
+
+ENTITY = {"entity_name": "f", "entity_type": "function", "import_path": "pkg", "member_of_class": None, "call_names": []}
+
+
+@pytest.mark.parametrize("damage", [
+    lambda text: text[:len(text) // 2],
+    lambda text: "",
+    lambda text: "[]",
+    lambda text: json.dumps({"entities": [{"entity_name": "f"}]}),
+    lambda text: json.dumps({"entities": [dict(ENTITY, member_of_class=0)]}),
+    lambda text: json.dumps({"entities": [dict(ENTITY, call_names="f")]}),
+])
+def test_corrupt_entry_is_a_miss(make_package, tmp_path, capsys, damage):
+    package = make_package(FILES)
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    _, _, entities, calls = cachedRun(package, cache_dir, capsys, static=True)
+    for entry_file in entryFiles(cache_dir):
+        with open(entry_file) as entry_f:
+            text = entry_f.read()
+        with open(entry_file, "w") as entry_f:
+            entry_f.write(damage(text))
+    assert cachedRun(package, cache_dir, capsys, static=True) == (0, 3, entities, calls)
+    # The damaged entries were written again
+    assert cachedRun(package, cache_dir, capsys, static=True) == (3, 0, entities, calls)
+    assert not list(cache_dir.glob("*/*.tmp"))
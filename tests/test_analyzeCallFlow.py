@@ -0,0 +1,93 @@
+import pytest
+
+from pycallflow import analyzeCallFlow
+from pycallflow.analyzeCallFlow import buildCallflowDB, entityData, entityNameIndex, getEntityCallNames
+from pycallflow.callflow import collectData
+from pycallflow.callFlowData import CALLFLOW_INDEXES
+
+FILES = {
+    "a.py": """
+        from .b import run, Tool
+
+        def run():
+            return Tool().run()
+
+        def helper():
+            return run()
+    """,
+    "b.py": """
+        class Tool:
+            def __init__(self):
+                self.ready = True
+
+            def run(self):
+                return helper()
+
+        def run():
+            return Tool()
+
+        def helper():
+            return run()
+    """,
+    "c.py": """
+        def lonely():
+            return run() + helper()
+    """,
+}
+
+
+def sqlEntityIDsWithName(db_cursor, entity_name, fileID, match_to_file=False):
+    """
+    The SELECT per name the calls used to be resolved with
+    """
+    toreturn = []
+    possibles = []
+    for row in db_cursor.execute("SELECT entityID, fileID FROM Entities WHERE entity_name = ?;", (entity_name, )):
+        possibles.append(row["entityID"])
+        if match_to_file and (row["fileID"] == fileID):
+            toreturn.append(row["entityID"])
+    if len(toreturn) == 0:
+        toreturn = possibles
+    return toreturn
+
+
+def callPairs(conn):
+    return sorted(tuple(row) for row in conn.execute("SELECT entityID, called_entity_ID, collision_num FROM Calls;"))
+
+
+@pytest.mark.parametrize("match_to_file", [False, True])
+def test_index_resolves_like_the_select(make_package, match_to_file):
+    conn = collectData(make_package(FILES), match_to_file=match_to_file).getSqliteConnection()
+    resolver = entityNameIndex(entityData(conn.cursor()), match_to_file)
+    expected = []
+    for entityID, fileID, call_names in getEntityCallNames(conn.cursor(), None):
+        call_num = 0
+        for name in call_names:
+            called = sqlEntityIDsWithName(conn.cursor(), name, fileID, match_to_file)
+            # The SELECT didn't promise an order
+            assert sorted(resolver.findAllEntityIDWithName(name, fileID)) == sorted(called)
+            if called:
+                expected.extend((entityID, called_ID, f"{entityID}.{call_num}") for called_ID in called)
+                call_num += 1
+    assert callPairs(conn) == sorted(expected)
+
+    names = {row["entityID"]: (row["entity_name"], row["fileID"]) for row in entityData(conn.cursor())}
+    helpers = [entityID for entityID, (name, _) in names.items() if name == "helper"]
+    assert len(helpers) == 2
+    for helper in helpers:
+        called = {names[row[0]][1] for row in conn.execute("SELECT called_entity_ID FROM Calls WHERE entityID = ?;", (helper, ))}
+        # With match_to_file each helper only calls the run()s in its own file
+        assert (called == {names[helper][1]}) == match_to_file
+
+
+def test_indexes_come_back_after_a_failed_build(make_package, monkeypatch):
+    conn = collectData(make_package(FILES)).getSqliteConnection()
+
+    def failingCall(*args, **kwargs):
+        raise RuntimeError("no more calls")
+
+    monkeypatch.setattr(analyzeCallFlow, "addCallDBEntry", failingCall)
+    with pytest.raises(RuntimeError):
+        buildCallflowDB(conn, False, False)
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index';")}
+    assert set(CALLFLOW_INDEXES) <= indexes
@@ -0,0 +1,57 @@
+from pycallflow.callflow import collectData
+
+# Members are inspected in name order, so first() and second() are saved before zBroken's
+# classmethod, which can't take the entity ID attributes, stops the inspection of the file
+PARTLY_BROKEN = """
+    def first():
+        return second()
+
+    def second():
+        return 1
+
+    class zBroken:
+        @classmethod
+        def make(cls):
+            return first()
+"""
+
+
+def callPairs(conn):
+    stmt = """
+        SELECT
+            caller.entity_name,
+            called.entity_name
+        FROM
+            Calls
+        JOIN
+            Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN
+            Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """
+    return {tuple(row) for row in conn.execute(stmt)}
+
+
+def test_entities_saved_before_a_failure_keep_their_calls(make_package, capsys):
+    package = make_package({"broken.py": PARTLY_BROKEN})
+    conn = collectData(package).getSqliteConnection()
+    assert "Unable to process file" in capsys.readouterr().err
+    names = {row[0] for row in conn.execute("SELECT entity_name FROM Entities;")}
+    assert {"first", "second", "zBroken"} <= names
+    assert ("first", "second") in callPairs(conn)
+
+
+def test_calls_across_files(make_package):
+    package = make_package({
+        "a.py": """
+            from .b import helper
+
+            def caller():
+                return helper()
+        """,
+        "b.py": """
+            def helper():
+                return 1
+        """,
+    })
+    conn = collectData(package).getSqliteConnection()
+    assert ("caller", "helper") in callPairs(conn)
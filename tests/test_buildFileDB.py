@@ -0,0 +1,112 @@
+import importlib
+
+import pytest
+
+from pycallflow import buildDeclaredEntitiesDB, staticAnalysis
+from pycallflow.buildFileDB import walkTargetFiles
+from pycallflow.callflow import collectData
+
+FILES = {
+    "a.py": """
+        from .sub.c import helper
+
+        def caller():
+            return helper()
+    """,
+    "b.py": """
+        raise RuntimeError("b can't be imported")
+    """,
+    "sub/__init__.py": "",
+    "sub/c.py": """
+        def helper():
+            return other()
+
+        def other():
+            return 1
+    """,
+    "skipped/__init__.py": "",
+    "skipped/d.py": """
+        def other():
+            return 2
+    """,
+}
+
+
+def fileRows(conn):
+    return [tuple(row) for row in conn.execute("SELECT fileID, package_path FROM Files ORDER BY fileID;")]
+
+
+def walkOrder(package, **kwargs):
+    return [package_path for _, package_path, _, _ in walkTargetFiles(importlib.import_module(package), **kwargs)]
+
+
+def callNames(conn):
+    return {tuple(row) for row in conn.execute("""
+        SELECT caller.import_path || '.' || caller.entity_name, called.import_path || '.' || called.entity_name
+        FROM Calls
+        JOIN Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """)}
+
+
+@pytest.mark.parametrize("static, save_entities", [
+    (False, (buildDeclaredEntitiesDB, "saveFileEntities")),
+    (True, (staticAnalysis, "saveStaticFileEntities")),
+])
+def test_files_are_analyzed_as_the_walk_finds_them(make_package, monkeypatch, static, save_entities):
+    package = make_package(FILES)
+    events = []
+    module, name = save_entities
+    save = getattr(module, name)
+
+    def recordSave(db_cursor, file_row):
+        events.append(("analyze", file_row["package_path"]))
+        return save(db_cursor, file_row)
+
+    def recordWalk(*args, **kwargs):
+        for file_row in walkTargetFiles(*args, **kwargs):
+            events.append(("walk", file_row[1]))
+            yield file_row
+
+    monkeypatch.setattr(module, name, recordSave)
+    monkeypatch.setattr("pycallflow.callflow.walkTargetFiles", recordWalk)
+    collectData(package, static=static)
+    order = walkOrder(package)
+    assert events == [(event, package_path) for package_path in order for event in ["walk", "analyze"]]
+
+
+@pytest.mark.parametrize("settings", [{}, {"static": True}, {"jobs": 2}, {"sandbox": True}])
+def test_file_ids_follow_the_walk(make_package, settings):
+    package = make_package(FILES)
+    conn = collectData(package, **settings).getSqliteConnection()
+    assert fileRows(conn) == list(enumerate(walkOrder(package), start=1))
+    # The file that failed to import doesn't stop the ones after it
+    assert (f"{package}.a.caller", f"{package}.sub.c.helper") in callNames(conn)
+    assert (f"{package}.sub.c.helper", f"{package}.sub.c.other") in callNames(conn)
+
+
+@pytest.mark.parametrize("static", [False, True])
+def test_exclude_applies_to_the_streamed_walk(make_package, static):
+    package = make_package(FILES)
+    conn = collectData(package, static=static, exclude=["skipped/", "b.py"]).getSqliteConnection()
+    assert fileRows(conn) == list(enumerate([
+        package_path for package_path in walkOrder(package)
+        if ".skipped." not in package_path and package_path != f"{package}.b"
+    ], start=1))
+    assert callNames(conn) == {
+        (f"{package}.a.caller", f"{package}.sub.c.helper"),
+        (f"{package}.sub.c.helper", f"{package}.sub.c.other"),
+    }
+
+
+@pytest.mark.parametrize("static", [False, True])
+def test_small_background_batches(make_package, monkeypatch, static):
+    # Batches written while later files are still being found and analyzed give the same db
+    package = make_package(FILES)
+    expected = collectData(package, static=static).getSqliteConnection()
+    monkeypatch.setattr(buildDeclaredEntitiesDB, "BACKGROUND_BATCH_SIZE", 1)
+    monkeypatch.setattr(staticAnalysis, "BACKGROUND_BATCH_SIZE", 1)
+    conn = collectData(package, static=static).getSqliteConnection()
+    for table in ["Files", "Entities", "Calls", "EntityCallNames"]:
+        stmt = f"SELECT * FROM {table} ORDER BY 1, 2;"
+        assert [tuple(row) for row in conn.execute(stmt)] == [tuple(row) for row in expected.execute(stmt)]
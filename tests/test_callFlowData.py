@@ -0,0 +1,165 @@
+import sqlite3
+import types
+
+import pytest
+
+from pycallflow.buildDeclaredEntitiesDB import addEntityToDB
+from pycallflow.buildFileDB import addFileToDB
+from pycallflow.callFlowData import callFlowData, bulkWriter, CALLFLOW_SCHEMA_VERSION, CALLFLOW_INDEXES
+from pycallflow.finalResults import getCallsByEntity
+
+# The tables as the first releases made them, before EntityCallNames and Files.file_size
+V0_TABLES = [
+    """
+    CREATE TABLE Files (
+        fileID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        file_full_path TEXT,
+        package_path TEXT,
+        file_mod_time INTEGER
+    )
+    """,
+    """
+    CREATE TABLE Entities (
+        entityID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        fileID INTEGER,
+        entity_name TEXT,
+        entity_type TEXT,
+        import_path TEXT,
+        member_of_class INTEGER
+    )
+    """,
+    """
+    CREATE TABLE Calls (
+        callID INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+        entityID INTEGER,
+        called_entity_ID INTEGER,
+        collision_num TEXT
+    )
+    """,
+]
+
+
+def oldDB(db_file, user_version=0):
+    """
+    A db as an older version left it: file 2 repeats file 1's package path, and entity 3 (in
+    file 2) repeats entity 1, with calls to and from it
+    """
+    conn = sqlite3.connect(db_file)
+    for stmt in V0_TABLES:
+        conn.execute(stmt)
+    conn.executemany("INSERT INTO Files (fileID, file_full_path, package_path, file_mod_time) VALUES (?, ?, ?, ?);", [
+        (1, "/src/pkg/mod.py", "pkg.mod", 100),
+        (2, "/src/pkg/mod.py", "pkg.mod", 100),
+        (3, "/src/pkg/other.py", "pkg.other", 100),
+    ])
+    conn.executemany("INSERT INTO Entities (entityID, fileID, entity_name, entity_type, import_path) VALUES (?, ?, ?, ?, ?);", [
+        (1, 1, "run", "function", "pkg.mod"),
+        (2, 1, "helper", "function", "pkg.mod"),
+        (3, 2, "run", "function", "pkg.mod"),
+        (4, 3, "other", "function", "pkg.other"),
+    ])
+    conn.executemany("INSERT INTO Calls (entityID, called_entity_ID, collision_num) VALUES (?, ?, ?);", [
+        (1, 2, "1.0"),
+        (3, 2, "3.0"),
+        (4, 3, "4.0"),
+        (4, 1, "4.0"),
+    ])
+    conn.execute(f"PRAGMA user_version = {user_version};")
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize("user_version", [0, 2])
+def test_migrate_old_db(tmp_path, user_version):
+    db_file = str(tmp_path / "old.db")
+    oldDB(db_file, user_version)
+    if user_version == 2:
+        conn = sqlite3.connect(db_file)
+        conn.execute("ALTER TABLE Files ADD COLUMN file_size INTEGER;")
+        conn.execute("CREATE TABLE EntityCallNames (entityID INTEGER PRIMARY KEY NOT NULL, call_names TEXT);")
+        conn.execute("INSERT INTO EntityCallNames (entityID, call_names) VALUES (3, '[]');")
+        conn.commit()
+        conn.close()
+
+    conn = callFlowData(db_file).getSqliteConnection()
+    assert conn.execute("PRAGMA user_version;").fetchone()[0] == CALLFLOW_SCHEMA_VERSION
+    assert "file_size" in [row[1] for row in conn.execute("PRAGMA table_info(Files);")]
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index';")}
+    assert set(CALLFLOW_INDEXES) <= indexes
+
+    assert [row[0] for row in conn.execute("SELECT fileID FROM Files ORDER BY fileID;")] == [1, 3]
+    assert [row[0] for row in conn.execute("SELECT entityID FROM Entities ORDER BY entityID;")] == [1, 2, 4]
+    # Nothing left pointing at entity 3
+    calls = {tuple(row) for row in conn.execute("SELECT entityID, called_entity_ID FROM Calls;")}
+    assert calls == {(1, 2), (4, 1)}
+    assert conn.execute("SELECT count(*) FROM EntityCallNames;").fetchone()[0] == 0
+    assert set(getCallsByEntity(conn.cursor())) == {1, 4}
+
+
+def test_newer_schema_refused(tmp_path):
+    db_file = str(tmp_path / "newer.db")
+    conn = sqlite3.connect(db_file)
+    conn.execute(f"PRAGMA user_version = {CALLFLOW_SCHEMA_VERSION + 1};")
+    conn.close()
+    with pytest.raises(Exception, match="schema version"):
+        callFlowData(db_file).getSqliteConnection()
+
+
+def addRows(db_cursor, first, count):
+    """
+    count files with two entities each, returns the IDs handed out
+    """
+    ids = []
+    for n in range(first, first + count):
+        fileID = addFileToDB(db_cursor, f"/src/m{n}.py", f"pkg.m{n}", 100, 10)
+        ids.append(fileID)
+        for name in ["a", "b"]:
+            ids.append(addEntityToDB(db_cursor, fileID, name, "function", f"pkg.m{n}", types.SimpleNamespace()))
+    # Already there, so skipped
+    ids.append(addFileToDB(db_cursor, "/src/m0.py", "pkg.m0", 100, 10))
+    return ids
+
+
+def startedDB(db_file):
+    """
+    Some rows put in by AUTOINCREMENT, and the last ones deleted so the next IDs aren't max + 1
+    """
+    conn = callFlowData(db_file).getSqliteConnection()
+    addRows(conn.cursor(), 0, 4)
+    conn.execute("DELETE FROM Entities WHERE entityID > 5;")
+    conn.execute("DELETE FROM Files WHERE fileID > 2;")
+    conn.commit()
+    return conn
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_bulk_writer_ids_match_autoincrement(tmp_path, background):
+    expected_conn = startedDB(str(tmp_path / "expected.db"))
+    expected = addRows(expected_conn.cursor(), 10, 5)
+    expected_conn.commit()
+
+    conn = startedDB(str(tmp_path / "bulk.db"))
+    # Small batches, so several are written on the way
+    with bulkWriter(conn, batch_size=3, background=background) as writer:
+        assert addRows(writer, 10, 5) == expected
+    for table in ["Files", "Entities"]:
+        stmt = f"SELECT * FROM {table} ORDER BY 1;"
+        assert [tuple(row) for row in conn.execute(stmt)] == [tuple(row) for row in expected_conn.execute(stmt)]
+    # And AUTOINCREMENT carries on after them
+    assert addRows(conn.cursor(), 20, 1) == addRows(expected_conn.cursor(), 20, 1)
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_bulk_writer_failure_restores_connection(tmp_path, background):
+    conn = callFlowData(str(tmp_path / "fail.db")).getSqliteConnection()
+    addRows(conn.cursor(), 0, 1)
+    conn.commit()
+    pragmas = [conn.execute(f"PRAGMA {pragma};").fetchone()[0] for pragma in ["synchronous", "journal_mode"]]
+    with pytest.raises(sqlite3.IntegrityError):
+        with bulkWriter(conn, batch_size=2, background=background) as writer:
+            # Hands out an ID that is already taken
+            writer.next_fileID = 1
+            addRows(writer, 10, 3)
+    assert [conn.execute(f"PRAGMA {pragma};").fetchone()[0] for pragma in ["synchronous", "journal_mode"]] == pragmas
+    assert not conn.in_transaction
+    assert conn.execute("SELECT count(*) FROM Files WHERE fileID = 1;").fetchone()[0] == 1
@@ -0,0 +1,77 @@
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from pycallflow import CallFlowSession
+
+FILES = {
+    "a.py": """
+        from .b import helper
+
+        def caller():
+            return helper()
+    """,
+    "b.py": """
+        def helper():
+            return 1
+    """,
+}
+
+
+def entityNames(session):
+    return {row["name"] for row in session.entity_list()}
+
+
+def test_import_is_light():
+    # The session (and with it the CLI and the query server) is only imported when asked for
+    code = "import sys, pycallflow; print(sorted(m for m in ['http.server', 'pycallflow.callflow', 'pycallflow.callFlowSession'] if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_refresh_after_edit(make_package, tmp_path):
+    package = make_package(FILES)
+    with CallFlowSession() as session:
+        assert session.add_target(package) == 3
+        assert entityNames(session) == {"caller", "helper"}
+        assert session.refresh() == 0
+
+        (tmp_path / package / "b.py").write_text("def helper():\n    return other()\n\ndef other():\n    return 2\n")
+        assert session.refresh() == 1
+        assert entityNames(session) == {"caller", "helper", "other"}
+        ids = {row["name"]: row["entityID"] for row in session.entity_list()}
+        traced = {v["name"] for v in session.entity_results([ids["other"]]).values()}
+        assert traced == {"caller()", "helper()", "other()"}
+
+
+def test_results_are_copies(make_package):
+    with CallFlowSession() as session:
+        session.add_target(make_package(FILES))
+        for results in [session.entity_results(), session.entity_results("1")]:
+            for v in results.values():
+                v["node"] = object()
+        assert all("node" not in v for v in session.entity_results().values())
+        assert session.dot(dot_writer="pydot") == session.dot(dot_writer="stream")
+
+
+@pytest.mark.parametrize("select_entity_id", [None, "1"])
+def test_rollup_leaves_the_db_writable(make_package, tmp_path, select_entity_id):
+    db_file = str(tmp_path / "session.db")
+    with CallFlowSession(db_file=db_file) as session:
+        session.add_target(make_package(FILES))
+        assert "penwidth" in session.dot(select_entity_id, granularity="package")
+        writer = sqlite3.connect(db_file, timeout=0)
+        writer.execute("CREATE TABLE Scratch (x INTEGER);")
+        writer.execute("INSERT INTO Scratch (x) VALUES (1);")
+        writer.commit()
+        writer.close()
+
+
+def test_sessions_keep_apart(make_package):
+    with CallFlowSession() as first, CallFlowSession() as second:
+        first.add_target(make_package(FILES))
+        second.add_target(make_package({"c.py": "def lonely():\n    pass\n"}))
+        assert entityNames(first) == {"caller", "helper"}
+        assert entityNames(second) == {"lonely"}
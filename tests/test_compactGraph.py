@@ -0,0 +1,159 @@
+import random
+import sys
+
+import pytest
+
+from pycallflow.callflow import cli_run
+from pycallflow.compactGraph import compactGraph, stronglyConnectedComponents
+from pycallflow.finalResults import callGraph
+from pycallflow.output import moreNodes
+
+# 20 and 30 call each other, as do 40 and 50.  30 and 70 call themselves, 10 calls 20 twice and
+# 20 calls an entity that isn't there.  70 is otherwise on its own.
+CALLED = {
+    10: [20, 20],
+    20: [30, 999],
+    30: [20, 30, 40],
+    40: [50],
+    50: [40],
+    60: [10],
+    70: [70],
+}
+ENTITY_IDS = [10, 20, 30, 40, 50, 60, 70]
+
+
+@pytest.fixture
+def graph():
+    return compactGraph(ENTITY_IDS, CALLED)
+
+
+def ids(graph, nodes):
+    return {graph.entityIDs[n] for n in nodes}
+
+
+def reached(graph, entityIDs, adjacency, **limits):
+    marks = graph.reach([graph.index_of[id] for id in entityIDs], adjacency, **limits)
+    return {id for id, mark in zip(graph.entityIDs, marks) if mark}
+
+
+def test_adjacency(graph):
+    # Self calls, repeats and unknown entities are dropped
+    assert {id: ids(graph, graph.forward.neighbors(n)) for n, id in enumerate(ENTITY_IDS)} == {
+        10: {20}, 20: {30}, 30: {20, 40}, 40: {50}, 50: {40}, 60: {10}, 70: set(),
+    }
+    assert {id: ids(graph, graph.reverse.neighbors(n)) for n, id in enumerate(ENTITY_IDS)} == {
+        10: {60}, 20: {10, 30}, 30: {20}, 40: {30, 50}, 50: {40}, 60: set(), 70: set(),
+    }
+    assert list(graph.forward.offsets) == [0, 1, 2, 4, 5, 6, 7, 7]
+    # Neighbours come out sorted, in both directions
+    for adjacency in [graph.forward, graph.reverse]:
+        for n in range(graph.num_nodes):
+            assert list(adjacency.neighbors(n)) == sorted(adjacency.neighbors(n))
+
+
+def test_strongly_connected_components(graph):
+    components, component_of = stronglyConnectedComponents(graph)
+    assert sorted(sorted(ids(graph, component)) for component in components) == [[10], [20, 30], [40, 50], [60], [70]]
+    for n, component in enumerate(component_of):
+        assert n in components[component]
+    # Reverse topological order, what a component calls comes before it
+    for n in range(graph.num_nodes):
+        for to_n in graph.forward.neighbors(n):
+            assert component_of[to_n] <= component_of[n]
+
+
+def test_reach(graph):
+    assert reached(graph, [10], graph.forward) == {10, 20, 30, 40, 50}
+    assert reached(graph, [40], graph.reverse) == {10, 20, 30, 40, 50, 60}
+    assert reached(graph, [50, 60], graph.forward) == {10, 20, 30, 40, 50, 60}
+    assert reached(graph, [70], graph.forward) == {70}
+    assert reached(graph, [], graph.forward) == set()
+
+
+@pytest.mark.parametrize("select, expected", [
+    ([30], {10, 20, 30, 40, 50, 60}),
+    ([50], {10, 20, 30, 40, 50, 60}),
+    ([60], {10, 20, 30, 40, 50, 60}),
+    ([70], {70}),
+    ([70, 10], {10, 20, 30, 40, 50, 60, 70}),
+    ([999], set()),
+])
+def test_trace(graph, select, expected):
+    assert graph.traceIDs(select) == expected
+    results = {id: {"calls": [[to_id] for to_id in CALLED.get(id, [])], "member_of_class": None} for id in ENTITY_IDS}
+    assert set(callGraph(results).trace(select)) == expected
+
+
+@pytest.mark.parametrize("limits, keep, hidden_calls, hidden_callers", [
+    ({}, {10, 20, 30, 40, 50, 60}, {}, {}),
+    ({"max_depth_down": 1}, {10, 20, 30, 40, 60}, {40: 1}, {}),
+    ({"max_depth_up": 1, "max_depth_down": 0}, {20, 30}, {30: 1}, {20: 1}),
+    ({"max_depth_up": 0, "max_depth_down": 0}, {30}, {30: 2}, {30: 1}),
+    # Neighbours are followed in entity order, so 30 only follows its call to 20
+    ({"max_fan_out": 1}, {10, 20, 30, 60}, {30: 1}, {}),
+    ({"max_fan_out": 0}, {30}, {30: 2}, {30: 1}),
+    ({"max_depth_up": 2, "max_fan_out": 1}, {10, 20, 30}, {30: 1}, {10: 1}),
+])
+def test_bounded_trace(graph, limits, keep, hidden_calls, hidden_callers):
+    assert graph.boundedTraceIDs([30], **limits) == (keep, hidden_calls, hidden_callers)
+    results = {id: {"calls": [[to_id] for to_id in CALLED.get(id, [])], "member_of_class": None} for id in ENTITY_IDS}
+    traced = callGraph(results).boundedTrace([30], **limits)
+    assert set(traced) == keep
+    assert {id: v["hidden_calls"] for id, v in traced.items() if "hidden_calls" in v} == hidden_calls
+    assert {id: v["hidden_callers"] for id, v in traced.items() if "hidden_callers" in v} == hidden_callers
+    # The shared results aren't marked
+    assert not any("hidden_calls" in v or "hidden_callers" in v for v in results.values())
+
+
+def test_more_nodes():
+    assert moreNodes(30, {"hidden_calls": 2, "hidden_callers": 1}) == [
+        ("30_more_calls", "+2 more", "30", "30_more_calls"),
+        ("30_more_callers", "+1 more", "30_more_callers", "30"),
+    ]
+    assert moreNodes(30, {}) == []
+
+
+@pytest.mark.parametrize("limit", ["max_depth_up", "max_depth_down", "max_fan_out"])
+def test_negative_limits(graph, limit):
+    with pytest.raises(ValueError):
+        graph.boundedTraceIDs([30], **{limit: -1})
+
+
+@pytest.mark.parametrize("argument", ["--max_depth_up=-1", "--max_depth_down=-2", "--max_fan_out=-1"])
+def test_cli_rejects_negative_limits(monkeypatch, capsys, argument):
+    monkeypatch.setattr(sys, "argv", ["pycallflow", "json", "--select_entity_id=1", argument])
+    with pytest.raises(SystemExit) as exit_info:
+        cli_run()
+    assert exit_info.value.code == 2
+    assert "must be 0 or more" in capsys.readouterr().err
+
+
+def randomGraph(seed, num_nodes=60, num_edges=120):
+    rng = random.Random(seed)
+    called = {}
+    for _ in range(num_edges):
+        called.setdefault(rng.randrange(num_nodes), []).append(rng.randrange(num_nodes))
+    return called, compactGraph(range(num_nodes), called)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_networkx(seed):
+    nx = pytest.importorskip("networkx")
+    called, graph = randomGraph(seed)
+    nx_graph = nx.DiGraph()
+    nx_graph.add_nodes_from(range(graph.num_nodes))
+    nx_graph.add_edges_from((n, to_n) for n, to_ns in called.items() for to_n in to_ns)
+    components, _ = stronglyConnectedComponents(graph)
+    assert sorted(map(sorted, components)) == sorted(map(sorted, nx.strongly_connected_components(nx_graph)))
+    for n in range(graph.num_nodes):
+        assert reached(graph, [n], graph.forward) == nx.descendants(nx_graph, n) | {n}
+        assert reached(graph, [n], graph.reverse) == nx.ancestors(nx_graph, n) | {n}
+
+
+def test_long_cycle():
+    # Deeper than the recursion limit, Tarjan's has to stay iterative
+    num_nodes = 20000
+    graph = compactGraph(range(num_nodes), {n: [(n + 1) % num_nodes] for n in range(num_nodes)})
+    components, _ = stronglyConnectedComponents(graph)
+    assert len(components) == 1
+    assert graph.traceIDs([0]) == set(range(num_nodes))
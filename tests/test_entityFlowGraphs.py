@@ -0,0 +1,172 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from pycallflow import output
+from pycallflow.callflow import cli_run
+from pycallflow.output import MANIFEST_NAME
+
+SOURCE = """
+    def caller():
+        return helper() + helper()
+
+    def helper():
+        return 1
+
+    def other():
+        return helper()
+"""
+
+
+class fakeDot:
+    """
+    Stands in for subprocess.run in output, so the tests don't need Graphviz.  Writes the dot
+    text as the image and records which images it was asked for.
+    """
+    def __init__(self) -> None:
+        self.rendered = []
+        self.hang = set()
+        self.fail = set()
+
+    def __call__(self, args, input=None, timeout=None, **kwargs):
+        if args == ["dot", "--version"]:
+            return subprocess.CompletedProcess(args, 0)
+        filename = args[2][len("-o"):]
+        name = os.path.basename(filename)
+        self.rendered.append(name)
+        if name in self.hang:
+            raise subprocess.TimeoutExpired(args, timeout)
+        if name in self.fail:
+            return subprocess.CompletedProcess(args, 1, "", "syntax error in line 1\n")
+        with open(filename, "w") as image_f:
+            image_f.write(input)
+        return subprocess.CompletedProcess(args, 0, "", "")
+
+
+@pytest.fixture
+def flows(make_package, tmp_path, monkeypatch, capsys):
+    """
+    Returns flows(*arguments), which runs -o entity_flow_graphs on a small package and returns
+    (names of the images dot was asked for, stdout).  flows.image(name) is the image's path.
+    """
+    package = make_package({"a.py": SOURCE})
+    images = tmp_path / "images"
+    images.mkdir()
+    dot = fakeDot()
+    monkeypatch.setattr(output.subprocess, "run", dot)
+
+    def run(*arguments):
+        dot.rendered.clear()
+        monkeypatch.setattr(sys, "argv", ["pycallflow", package, "--static", "-o", "entity_flow_graphs",
+                                          f"--save_images_to={images}", *arguments])
+        cli_run()
+        return set(dot.rendered), capsys.readouterr().out
+
+    run.dot = dot
+    run.images = images
+    run.source = images.parent / package / "a.py"
+    run.image = lambda name: images / f"{package}_a_{name}.png"
+    run.manifest = lambda: json.loads((images / MANIFEST_NAME).read_text())
+    return run
+
+
+def names(flows, *entity_names):
+    return {flows.image(name).name for name in entity_names}
+
+
+def test_unchanged_images_are_skipped(flows):
+    rendered, _ = flows()
+    assert rendered == names(flows, "caller", "helper", "other")
+    assert set(flows.manifest()) == rendered
+    assert flows() == (set(), "")
+    # An image that went missing is made again, even though its dot text is the same
+    flows.image("helper").unlink()
+    assert flows()[0] == names(flows, "helper")
+
+
+def test_stale_images_are_removed(flows):
+    flows()
+    keep = flows.images / "mine.png"
+    keep.write_text("not made by pycallflow")
+    flows.source.write_text(flows.source.read_text().replace("def other():\n    return helper()\n", ""))
+    flows()
+    assert not flows.image("other").exists()
+    assert flows.image("caller").exists()
+    assert set(flows.manifest()) == names(flows, "caller", "helper")
+    assert keep.exists()
+
+
+def test_clean_renders_again(flows):
+    flows()
+    # --clean combines caller's two calls to helper, which changes the graphs they are both in
+    assert flows("--clean")[0] == names(flows, "caller", "helper")
+    assert flows("--clean")[0] == set()
+    assert flows()[0] == names(flows, "caller", "helper")
+
+
+def test_render_timeout(flows):
+    flows.dot.hang = names(flows, "helper")
+    rendered, out = flows("--render_timeout=0.5")
+    assert rendered == names(flows, "caller", "helper", "other")
+    assert "1 of 3 flow graphs failed" in out
+    assert "Unable to make flow graph for helper because dot took longer than 0.5 seconds" in out
+    assert set(flows.manifest()) == names(flows, "caller", "other")
+    flows.dot.hang = set()
+    assert flows()[0] == names(flows, "helper")
+
+
+def test_failed_render(flows):
+    flows.dot.fail = names(flows, "caller", "other")
+    rendered, out = flows()
+    assert "2 of 3 flow graphs failed" in out
+    assert "Unable to make flow graph for caller because dot failed: syntax error in line 1" in out
+    assert set(flows.manifest()) == names(flows, "helper")
+    flows.dot.fail = set()
+    assert flows()[0] == names(flows, "caller", "other")
+
+
+def test_manifest_cannot_remove_other_files(flows, tmp_path):
+    victim = tmp_path / "victim.png"
+    victim.write_text("keep me")
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    (elsewhere / "victim.png").write_text("keep me too")
+    flows()
+    manifest = flows.manifest()
+    manifest.update({
+        "../victim.png": "0",
+        str(victim): "0",
+        "..": "0",
+        "nested/../../victim.png": "0",
+        os.path.join("..", "elsewhere", "victim.png"): "0",
+    })
+    (flows.images / MANIFEST_NAME).write_text(json.dumps(manifest))
+    rendered, out = flows()
+    assert rendered == set()
+    assert victim.read_text() == "keep me"
+    assert (elsewhere / "victim.png").read_text() == "keep me too"
+    assert f"Unable to remove '../victim.png' because it is not an image in {flows.images}" in out
+    assert set(flows.manifest()) == names(flows, "caller", "helper", "other")
+
+
+def test_manifest_through_a_symlink(flows, tmp_path):
+    victim = tmp_path / "victim.png"
+    victim.write_text("keep me")
+    flows()
+    link = flows.images / "outside"
+    link.symlink_to(tmp_path, target_is_directory=True)
+    manifest = dict(flows.manifest(), **{os.path.join("outside", "victim.png"): "0"})
+    (flows.images / MANIFEST_NAME).write_text(json.dumps(manifest))
+    flows()
+    assert victim.read_text() == "keep me"
+
+
+@pytest.mark.parametrize("manifest", ["[]", "not json", '"text"'])
+def test_unreadable_manifest_renders_everything(flows, manifest):
+    flows()
+    (flows.images / MANIFEST_NAME).write_text(manifest)
+    assert flows()[0] == names(flows, "caller", "helper", "other")
+    assert set(flows.manifest()) == names(flows, "caller", "helper", "other")
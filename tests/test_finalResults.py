@@ -0,0 +1,77 @@
+import pytest
+
+from pycallflow.callflow import collectData
+from pycallflow.finalResults import (generateEntityResults_object, generateEntityResults_selectID_object, getCallEntries,
+                                     getCallEntryForEntityID, getCallForEntity, getCallsByEntity, getCallsBySelectedEntity)
+
+# Two run()s and two helper()s, so some calls are ambiguous
+FILES = {
+    "a.py": """
+        from .b import Tool
+
+        def run():
+            return Tool().run()
+
+        def helper():
+            return run() + run()
+    """,
+    "b.py": """
+        class Tool:
+            def __init__(self):
+                self.ready = True
+
+            def run(self):
+                return helper()
+
+        def helper():
+            return Tool()
+
+        def lonely():
+            pass
+    """,
+}
+
+
+@pytest.fixture
+def conn(make_package):
+    return collectData(make_package(FILES)).getSqliteConnection()
+
+
+def allEntityIDs(conn):
+    return [row[0] for row in conn.execute("SELECT entityID FROM Entities ORDER BY entityID;")]
+
+
+def perEntityCalls(conn, entityID):
+    """
+    What an entity's calls were read as before getCallsByEntity, one query per entity
+    """
+    return [[int(called_id) for called_id in row["found_calls"].split(",")] for row in getCallForEntity(conn.cursor(), entityID)]
+
+
+def test_calls_match_the_per_entity_query(conn):
+    entityIDs = allEntityIDs(conn)
+    calls_by_entity = getCallsByEntity(conn.cursor())
+    expected = {id: perEntityCalls(conn, id) for id in entityIDs}
+    assert {id: calls_by_entity.get(id, []) for id in entityIDs} == expected
+    # Entities that call nothing are left out rather than given empty lists
+    assert all(calls_by_entity[id] for id in calls_by_entity)
+    assert any(len(called) > 1 for calls in expected.values() for called in calls)
+
+    for selected in [entityIDs, entityIDs[::2], entityIDs[1::3], entityIDs[-1:], []]:
+        selected_calls = getCallsBySelectedEntity(conn.cursor(), selected)
+        assert {id: selected_calls.get(id, []) for id in selected} == {id: expected[id] for id in selected}
+        assert set(selected_calls) <= set(selected)
+        assert getCallsByEntity(conn.cursor(), selected) == selected_calls
+
+
+def test_call_entries_match_the_per_entity_query(conn):
+    call_entries = getCallEntries(conn.cursor())
+    assert call_entries == {id: getCallEntryForEntityID(conn.cursor(), id) for id in allEntityIDs(conn)}
+    assert {entry["entity_name"] for entry in call_entries.values()} >= {"Tool:", "run()", "helper()"}
+
+
+def test_unparsable_select(conn, capsys):
+    assert generateEntityResults_selectID_object(conn, "1,two") == generateEntityResults_object(conn)
+    captured = capsys.readouterr()
+    assert "Unable to parse select_entity_id: 1,two" in captured.err
+    assert captured.out == ""
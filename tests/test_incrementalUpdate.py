@@ -0,0 +1,110 @@
+import importlib
+import os
+import sys
+
+from pycallflow.callflow import collectData
+from pycallflow.buildFileDB import walkTargetFiles
+from pycallflow.incrementalUpdate import refreshFiles, findAffectedEntities
+
+FILES = {
+    "a.py": """
+        from .b import helper
+
+        def caller():
+            return helper()
+    """,
+    "b.py": """
+        def helper():
+            return 1
+    """,
+    "c.py": """
+        def unrelated():
+            return 3
+    """,
+}
+
+
+def fileIDOf(conn, package, module):
+    return conn.execute("SELECT fileID FROM Files WHERE package_path = ?;", (f"{package}.{module}", )).fetchone()[0]
+
+
+def names(conn):
+    return {row[0] for row in conn.execute("SELECT entity_name FROM Entities;")}
+
+
+def callNames(conn):
+    return {tuple(row) for row in conn.execute("""
+        SELECT caller.entity_name, called.entity_name
+        FROM Calls
+        JOIN Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """)}
+
+
+def forgetPackage(package):
+    # As if each run were a new process, the way the CLI runs them
+    for module_name in [name for name in sys.modules if name.split(".")[0] == package]:
+        del sys.modules[module_name]
+
+
+def touch(path, source):
+    """
+    Rewrites the file with a modification time that is sure to differ from the saved one
+    """
+    mtime = os.stat(path).st_mtime
+    path.write_text(source)
+    os.utime(path, (mtime + 10, mtime + 10))
+
+
+def test_refresh_after_edit(make_package, tmp_path):
+    package = make_package(FILES)
+    conn = collectData(package).getSqliteConnection()
+    b = fileIDOf(conn, package, "b")
+    assert refreshFiles(conn, walkTargetFiles(importlib.import_module(package))) == (set(), set())
+
+    touch(tmp_path / package / "b.py", "def helper2():\n    return 1\n")
+    fileIDs, removed_names = refreshFiles(conn, walkTargetFiles(importlib.import_module(package)))
+    assert fileIDs == {b}
+    assert removed_names == {"helper"}
+    # The file keeps its ID, its entities and the calls to them are gone
+    assert fileIDOf(conn, package, "b") == b
+    assert names(conn) == {"caller", "unrelated"}
+    assert callNames(conn) == set()
+    caller = conn.execute("SELECT entityID FROM Entities WHERE entity_name = 'caller';").fetchone()[0]
+    assert findAffectedEntities(conn, fileIDs, removed_names) == {caller}
+
+
+def test_refresh_after_delete_and_add(make_package, tmp_path):
+    package = make_package(FILES)
+    conn = collectData(package).getSqliteConnection()
+    c = fileIDOf(conn, package, "c")
+    last_fileID = conn.execute("SELECT max(fileID) FROM Files;").fetchone()[0]
+
+    os.remove(tmp_path / package / "c.py")
+    (tmp_path / package / "d.py").write_text("def added():\n    pass\n")
+    fileIDs, removed_names = refreshFiles(conn, walkTargetFiles(importlib.import_module(package)))
+    assert removed_names == {"unrelated"}
+    assert conn.execute("SELECT count(*) FROM Files WHERE fileID = ?;", (c, )).fetchone()[0] == 0
+    d = fileIDOf(conn, package, "d")
+    assert fileIDs == {d}
+    assert d > last_fileID
+    assert names(conn) == {"caller", "helper"}
+    assert ("caller", "helper") in callNames(conn)
+
+
+def test_incremental_matches_full(make_package, tmp_path):
+    package = make_package(FILES)
+    db_file = str(tmp_path / "inc.db")
+    collectData(package, db_file=db_file)
+    touch(tmp_path / package / "b.py", "def helper():\n    return unrelated()\n")
+    os.remove(tmp_path / package / "c.py")
+    (tmp_path / package / "d.py").write_text("def unrelated():\n    return 4\n")
+
+    forgetPackage(package)
+    incremental = collectData(package, db_file=db_file, incremental=True)
+    assert incremental.reused_analysis
+    forgetPackage(package)
+    full = collectData(package)
+    for conn in [incremental.getSqliteConnection(), full.getSqliteConnection()]:
+        assert names(conn) == {"caller", "helper", "unrelated"}
+        assert callNames(conn) == {("caller", "helper"), ("helper", "unrelated")}
@@ -0,0 +1,116 @@
+import itertools
+
+import pytest
+
+from pycallflow.callflow import collectData
+from pycallflow.finalResults import generateEntityResults_selectID_object
+from pycallflow.output import pydot_output, stream_dot_output
+from pycallflow.rollupResults import generateRollupResults_selectID_object
+
+FILES = {
+    "shapes.py": """
+        class Shape:
+            def __init__(self, name):
+                self.name = name
+
+            def area(self):
+                return 0
+
+            def describe(self):
+                return f"{self.name} {self.area()}"
+
+
+        class Square(Shape):
+            def __init__(self, side):
+                super().__init__("square")
+                self.side = side
+
+            def area(self):
+                return self.side * self.side
+    """,
+    "sub/__init__.py": "",
+    "sub/report.py": """
+        from ..shapes import Square, Shape
+
+        def countdown(n):
+            return n if n <= 0 else countdown(n - 1)
+
+        def report(sides):
+            squares = [Square(side) for side in sides]
+            countdown(len(squares))
+            print("a \\"quoted\\" name")
+            return [square.describe() for square in squares] + [Shape("x").area()]
+
+        def fan_out():
+            report([1])
+            report([2])
+            countdown(3)
+            print(len("x"))
+    """,
+}
+
+OPTIONS = ["suppress_recursive_calls", "combine_calls", "suppress_class_references", "suppress_calls_to_init"]
+
+
+@pytest.fixture
+def conn(make_package):
+    return collectData(make_package(FILES)).getSqliteConnection()
+
+
+def entityID(conn, name):
+    return conn.execute("SELECT entityID FROM Entities WHERE entity_name = ?;", (name, )).fetchone()[0]
+
+
+def bothWriters(make_results, output, **settings):
+    # pydot_output adds its nodes to the results, so each writer gets its own
+    pydot_text = getattr(pydot_output(), output)(make_results(), output_to_stdout=False, **settings)
+    stream_text = getattr(stream_dot_output(), output)(make_results(), output_to_stdout=False, **settings)
+    return pydot_text, stream_text
+
+
+@pytest.mark.parametrize("flags", list(itertools.product([False, True], repeat=len(OPTIONS))))
+@pytest.mark.parametrize("edge_color", ["rotate", "black"])
+def test_entity_dot_matches_pydot(conn, flags, edge_color):
+    settings = dict(zip(OPTIONS, flags), rankdir="LR", edge_color=edge_color)
+    pydot_text, stream_text = bothWriters(lambda: generateEntityResults_selectID_object(conn, None), "output", **settings)
+    assert "report" in stream_text
+    assert stream_text == pydot_text
+
+
+@pytest.mark.parametrize("names, limits", [
+    (["report", "countdown"], {}),
+    (["fan_out"], {"max_depth_down": 1}),
+    (["describe"], {"max_depth_up": 1}),
+    (["report", "countdown"], {"max_fan_out": 1}),
+])
+def test_selected_dot_matches_pydot(conn, names, limits):
+    select = ",".join(str(entityID(conn, name)) for name in names)
+    settings = {option: False for option in OPTIONS}
+    make_results = lambda: generateEntityResults_selectID_object(conn, select, **limits)
+    pydot_text, stream_text = bothWriters(make_results, "output", rankdir="TB", edge_color="rotate",
+                                          select_entity_id=select, graph_name="a \"traced\" graph", **settings)
+    assert "doubleoctagon" in stream_text
+    if limits:
+        assert " more\"" in stream_text
+    assert stream_text == pydot_text
+
+
+@pytest.mark.parametrize("granularity", ["file", "package", "class"])
+@pytest.mark.parametrize("select", [False, True])
+def test_rollup_dot_matches_pydot(conn, granularity, select):
+    select_entity_id = str(entityID(conn, "fan_out")) if select else None
+    make_results = lambda: generateRollupResults_selectID_object(conn, granularity, select_entity_id)
+    for suppress_recursive_calls in [False, True]:
+        pydot_text, stream_text = bothWriters(make_results, "rollup_output", rankdir="LR", edge_color="rotate",
+                                              suppress_recursive_calls=suppress_recursive_calls)
+        assert "penwidth" in stream_text
+        assert stream_text == pydot_text
+
+
+def test_stream_writes_to_out(conn, capsys, tmp_path):
+    settings = dict({option: False for option in OPTIONS}, rankdir="LR", edge_color="black")
+    pydot_output().output(generateEntityResults_selectID_object(conn, None), **settings)
+    printed = capsys.readouterr().out
+    with open(tmp_path / "out.dot", "w") as out:
+        stream_dot_output().output(generateEntityResults_selectID_object(conn, None), out=out, **settings)
+    assert (tmp_path / "out.dot").read_text() == printed
@@ -0,0 +1,66 @@
+import pytest
+
+from pycallflow.callflow import collectData
+
+FILES = {
+    "a.py": """
+        from .b import helper
+
+        def caller():
+            return helper()
+    """,
+    "b.py": """
+        def helper():
+            return 1
+    """,
+    "c.py": """
+        class Thing:
+            def use(self):
+                return helper()
+
+        def helper():
+            return 2
+    """,
+}
+
+
+def dbRows(conn):
+    return [
+        [tuple(row) for row in conn.execute(stmt)]
+        for stmt in [
+            "SELECT fileID, package_path FROM Files ORDER BY fileID;",
+            "SELECT entityID, fileID, entity_name, entity_type, import_path, member_of_class FROM Entities ORDER BY entityID;",
+            "SELECT entityID, called_entity_ID, collision_num FROM Calls ORDER BY entityID, called_entity_ID, collision_num;",
+        ]
+    ]
+
+
+@pytest.mark.parametrize("static", [False, True])
+def test_jobs_match_a_serial_run(make_package, static):
+    package = make_package(FILES)
+    serial = dbRows(collectData(package, static=static).getSqliteConnection())
+    assert dbRows(collectData(package, static=static, jobs=2).getSqliteConnection()) == serial
+
+
+def test_worker_that_dies_only_loses_its_file(make_package, capsys):
+    package = make_package(dict(FILES, **{
+        "b_dies.py": """
+            import os
+
+            def never_saved():
+                pass
+
+            os._exit(3)
+        """,
+    }))
+    conn = collectData(package, jobs=2).getSqliteConnection()
+    assert "b_dies.py because its import process exited with code 3" in capsys.readouterr().err
+    names = {row[0] for row in conn.execute("SELECT entity_name FROM Entities;")}
+    assert names == {"caller", "helper", "Thing", "use"}
+    calls = {tuple(row) for row in conn.execute("""
+        SELECT caller.import_path || '.' || caller.entity_name, called.import_path
+        FROM Calls
+        JOIN Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """)}
+    assert (f"{package}.a.caller", f"{package}.b") in calls
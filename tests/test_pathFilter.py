@@ -0,0 +1,122 @@
+import os
+
+import pytest
+
+from pycallflow.buildFileDB import walkTargetFiles
+from pycallflow.pathFilter import pathFilter, ignoreRule, matchRules
+
+from .conftest import writeFiles
+
+
+@pytest.mark.parametrize("pattern, path, is_dir, expected", [
+    # No / matches a name at any depth
+    ("tests", "tests", True, True),
+    ("tests", "pkg/tests", True, True),
+    ("tests", "pkg/tests.py", False, False),
+    ("*.py", "pkg/deep/mod.py", False, True),
+    # A / anchors it to the walk's root
+    ("pkg/tests", "pkg/tests", True, True),
+    ("pkg/tests", "other/pkg/tests", True, False),
+    ("/build", "build", True, True),
+    ("/build", "src/build", True, False),
+    # A trailing / only matches directories
+    ("build/", "build", True, True),
+    ("build/", "build", False, False),
+    ("build/", "src/build", True, True),
+    # * and ? stop at /, ** doesn't
+    ("src/*.py", "src/a.py", False, True),
+    ("src/*.py", "src/sub/a.py", False, False),
+    ("src/?.py", "src/a.py", False, True),
+    ("src/?.py", "src/ab.py", False, False),
+    ("src/**/*.py", "src/a.py", False, True),
+    ("src/**/*.py", "src/x/y/a.py", False, True),
+    ("**/gen", "a/b/gen", True, True),
+    ("vendor/**", "vendor/x/y.py", False, True),
+    ("vendor/**", "vendor", True, False),
+    ("[ab].py", "b.py", False, True),
+    ("[!ab].py", "b.py", False, False),
+    # Dots are literal
+    ("a.py", "axpy", False, False),
+])
+def test_rule_matching(pattern, path, is_dir, expected):
+    assert ignoreRule(pattern).matches(path, is_dir) == expected
+
+
+def test_negation_last_rule_wins():
+    rules = [ignoreRule(p) for p in ["*.py", "!keep.py"]]
+    assert matchRules(rules, "drop.py", False)
+    assert not matchRules(rules, "sub/keep.py", False)
+    rules.append(ignoreRule("sub/keep.py"))
+    assert matchRules(rules, "sub/keep.py", False)
+    assert not matchRules(rules, "keep.py", False)
+
+
+def walked(root, path_filter):
+    return sorted(os.path.relpath(row[0], root).replace(os.sep, "/") for row in walkTargetFiles(str(root), True, path_filter))
+
+
+TREE = {
+    "main.py": "",
+    "setup.py": "",
+    "pkg/__init__.py": "",
+    "pkg/core.py": "",
+    "pkg/tests/test_core.py": "",
+    "pkg/gen/out.py": "",
+    "pkg/gen/keep.py": "",
+    "build/lib.py": "",
+    ".venv/site.py": "",
+    "__pycache__/cached.py": "",
+}
+
+
+def test_default_excludes(tmp_path):
+    writeFiles(tmp_path, TREE)
+    assert walked(tmp_path, pathFilter()) == [
+        "build/lib.py", "main.py", "pkg/__init__.py", "pkg/core.py", "pkg/gen/keep.py", "pkg/gen/out.py",
+        "pkg/tests/test_core.py",
+    ]
+
+
+def test_exclude_and_include(tmp_path):
+    writeFiles(tmp_path, TREE)
+    assert walked(tmp_path, pathFilter(exclude=["tests", "/build", "pkg/gen/*.py", "!keep.py"])) == [
+        "main.py", "pkg/__init__.py", "pkg/core.py", "pkg/gen/keep.py",
+    ]
+    # Everything in a directory that matches, or files that do
+    assert walked(tmp_path, pathFilter(include=["pkg/gen", "main.py"])) == [
+        "main.py", "pkg/gen/keep.py", "pkg/gen/out.py",
+    ]
+    # Excluded wins over included
+    assert walked(tmp_path, pathFilter(include=["pkg"], exclude=["tests/"])) == [
+        "pkg/__init__.py", "pkg/core.py", "pkg/gen/keep.py", "pkg/gen/out.py",
+    ]
+
+
+def test_excluded_directories_are_not_walked(tmp_path, monkeypatch):
+    writeFiles(tmp_path, TREE)
+    path_filter = pathFilter(exclude=["pkg/"])
+    asked = []
+    excluded = path_filter.excluded
+
+    def spy(search_path, path, is_dir):
+        asked.append(os.path.relpath(path, search_path).replace(os.sep, "/"))
+        return excluded(search_path, path, is_dir)
+
+    monkeypatch.setattr(path_filter, "excluded", spy)
+    walked(tmp_path, path_filter)
+    assert "pkg" in asked
+    assert not any(path.startswith("pkg/") for path in asked)
+
+
+def test_gitignore(tmp_path):
+    (tmp_path / ".git").mkdir()
+    writeFiles(tmp_path, dict(TREE, **{
+        ".gitignore": "# generated\nbuild/\npkg/gen/*\n!pkg/gen/keep.py\n",
+        "pkg/.gitignore": "core.py\n",
+        "pkg/tests/.gitignore": "!*.py\n",
+    }))
+    expected = ["main.py", "pkg/__init__.py", "pkg/gen/keep.py", "pkg/tests/test_core.py"]
+    assert walked(tmp_path, pathFilter(gitignore=True)) == expected
+    # Walking a subdirectory still picks up the .gitignore files above it, up to the work tree
+    assert walked(tmp_path / "pkg", pathFilter(gitignore=True)) == ["__init__.py", "gen/keep.py", "tests/test_core.py"]
+    assert "pkg/core.py" in walked(tmp_path, pathFilter())
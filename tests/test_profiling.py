@@ -0,0 +1,50 @@
+import json
+import threading
+
+from pycallflow.callflow import collectData
+from pycallflow.profiling import runProfile, countEvent, profileTimer, profilePhase
+
+
+def test_profile_of_a_run(make_package, tmp_path):
+    package = make_package({
+        "a.py": """
+            def one():
+                return two()
+
+            def two():
+                return 2
+        """,
+    })
+    report_file = tmp_path / "profile.json"
+    with runProfile(str(report_file)):
+        collectData(package)
+    report = json.loads(report_file.read_text())
+    assert [phase["name"] for phase in report["phases"]] == ["import_target", "clear_tables", "find_entities", "build_calls"]
+    # Written by the background writer thread while the main thread imports
+    assert {"import", "disassembly", "sql_write"} <= report["timers"].keys()
+    assert report["counters"]["files"] == 2
+    assert report["counters"]["entities"] == 2
+    assert report["counters"]["sql_statements"] > 0
+
+
+def test_counts_from_threads_add_up(tmp_path):
+    profile = runProfile(str(tmp_path / "profile.json"))
+
+    def work():
+        for _ in range(10000):
+            countEvent("events")
+            with profileTimer("work"):
+                pass
+        # Only the thread running the profile times phases
+        with profilePhase("not_from_here"):
+            pass
+
+    with profile:
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert profile.counters["events"] == 40000
+    assert profile.timers["work"]["count"] == 40000
+    assert profile.phases == []
@@ -0,0 +1,140 @@
+import http.server
+import json
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pycallflow.callflow import collectData
+from pycallflow.queryServer import callflowServer, requestHandler
+
+SOURCE = """
+    def top():
+        return middle()
+
+    def middle():
+        return bottom()
+
+    def bottom():
+        return 1
+
+    class Widget:
+        def run(self):
+            return top()
+"""
+
+
+@pytest.fixture
+def server(make_package, tmp_path):
+    """
+    Serves a freshly analyzed package, returns a get(path) that returns (status, body)
+    """
+    db_file = str(tmp_path / "served.db")
+    collectData(make_package({"flow.py": SOURCE}), db_file=db_file)
+    callflow = callflowServer(db_file)
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), requestHandler)
+    httpd.daemon_threads = True
+    httpd.callflow = callflow
+    httpd.verbose = False
+    thread = threading.Thread(target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+
+    def get(path):
+        url = f"http://127.0.0.1:{httpd.server_address[1]}{path}"
+        try:
+            with urllib.request.urlopen(url) as response:
+                return response.status, response.read().decode("utf-8")
+        except urllib.error.HTTPError as error:
+            return error.code, error.read().decode("utf-8")
+
+    get.db_file = db_file
+    yield get
+    httpd.shutdown()
+    httpd.server_close()
+    callflow.close()
+
+
+def entityIDs(get):
+    status, body = get("/entities")
+    assert status == 200
+    return {row["name"]: row["entityID"] for row in json.loads(body)}
+
+
+def test_entities_and_status(server):
+    ids = entityIDs(server)
+    assert {"top", "middle", "bottom", "Widget", "run"} <= ids.keys()
+    status, body = server("/status")
+    assert status == 200
+    assert json.loads(body)["entities"] == len(ids)
+
+
+def test_trace_select(server):
+    ids = entityIDs(server)
+    status, body = server(f"/trace?select={ids['middle']}")
+    assert status == 200
+    traced = {v["name"] for v in json.loads(body).values()}
+    # run() is in Widget, so the class comes along
+    assert traced == {"top()", "middle()", "bottom()", "run()", "Widget:"}
+
+
+def test_trace_limits(server):
+    ids = entityIDs(server)
+    status, body = server(f"/trace?select={ids['middle']}&max_depth_up=0&max_depth_down=1")
+    assert status == 200
+    traced = {v["name"] for v in json.loads(body).values()}
+    assert traced == {"middle()", "bottom()"}
+
+
+def test_trace_after_pydot_render(server):
+    # The pydot writer adds its nodes to the results it is given, which must not be the
+    # snapshot's own
+    for writer in ["pydot", "stream"]:
+        status, body = server(f"/dot?dot_writer={writer}")
+        assert status == 200
+        assert body.startswith("digraph")
+    status, body = server("/trace")
+    assert status == 200
+    assert len(json.loads(body)) == len(entityIDs(server))
+
+
+def test_dot_writers_agree(server):
+    ids = entityIDs(server)
+    for query in [f"select={ids['top']}", "clean=1", "granularity=file"]:
+        _, pydot_body = server(f"/dot?dot_writer=pydot&{query}")
+        _, stream_body = server(f"/dot?dot_writer=stream&{query}")
+        assert pydot_body == stream_body
+
+
+@pytest.mark.parametrize("query", ["granularity=package", "granularity=class&select=1", "select=1", ""])
+def test_requests_leave_the_db_writable(server, query):
+    status, _ = server(f"/dot?{query}")
+    assert status == 200
+    # The pooled connection mustn't still hold a lock once the request is answered
+    writer = sqlite3.connect(server.db_file, timeout=0)
+    writer.execute("CREATE TABLE Scratch (x INTEGER);")
+    writer.execute("INSERT INTO Scratch (x) VALUES (1);")
+    writer.commit()
+    writer.close()
+
+
+@pytest.mark.parametrize("path", [
+    "/trace?select=abc",
+    "/trace?select=999999",
+    "/trace?select=1&max_depth_up=many",
+    "/trace?select=1&max_fan_out=-1",
+    "/dot?select=1&max_depth_down=-1&granularity=file",
+    "/dot?dot_writer=svg",
+    "/dot?granularity=module",
+])
+def test_bad_requests(server, path):
+    status, body = server(path)
+    assert status == 400
+    assert "error" in json.loads(body)
+
+
+def test_unknown_endpoint(server):
+    status, body = server("/nothing")
+    assert status == 404
+    assert "/entities" in json.loads(body)["error"]
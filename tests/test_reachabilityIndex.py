@@ -0,0 +1,101 @@
+import sqlite3
+
+from pycallflow.callflow import collectData
+from pycallflow.callFlowData import callFlowData
+from pycallflow.finalResults import generateEntityResults_selectID_object
+from pycallflow.reachabilityIndex import REACH_INDEX_SETTING, generateEntityResults_indexed, reachabilityIndexIsCurrent
+
+# A cycle (ping/pong), a class whose methods call out, and entities nothing calls
+SOURCE = """
+    def ping(n):
+        return pong(n - 1)
+
+    def pong(n):
+        return ping(n) if n else leaf()
+
+    def leaf():
+        return 1
+
+    def loner():
+        return 2
+
+    class Runner:
+        def start(self):
+            return ping(3)
+
+        def stop(self):
+            return self.start()
+
+    def uses_runner():
+        return Runner().stop()
+"""
+
+
+def test_indexed_select_matches_cold_select(make_package, tmp_path):
+    cf_data = collectData(make_package({"graph.py": SOURCE}), db_file=str(tmp_path / "index.db"))
+    conn = cf_data.getSqliteConnection()
+    entityIDs = [row[0] for row in conn.execute("SELECT entityID FROM Entities;")]
+    selects = [str(id) for id in entityIDs] + [",".join(str(id) for id in entityIDs[:3])]
+    for select in selects:
+        cold = generateEntityResults_selectID_object(conn, select_entity_id=select)
+        assert generateEntityResults_indexed(conn, select) == cold
+    assert reachabilityIndexIsCurrent(conn)
+
+
+def test_index_rebuilt_after_change(make_package, tmp_path):
+    package = make_package({"graph.py": SOURCE})
+    db_file = str(tmp_path / "index.db")
+    conn = collectData(package, db_file=db_file).getSqliteConnection()
+    leaf = conn.execute("SELECT entityID FROM Entities WHERE entity_name = 'leaf';").fetchone()[0]
+    generateEntityResults_indexed(conn, str(leaf))
+    conn.execute("DELETE FROM Calls WHERE called_entity_ID = ?;", (leaf, ))
+    conn.commit()
+    assert not reachabilityIndexIsCurrent(conn)
+    assert generateEntityResults_indexed(conn, str(leaf)) == generateEntityResults_selectID_object(conn, select_entity_id=str(leaf))
+
+
+def test_only_reused_analysis_counts_as_reused(make_package, tmp_path):
+    package = make_package({"graph.py": SOURCE})
+    db_file = str(tmp_path / "index.db")
+    assert not collectData(package, db_file=db_file).reused_analysis
+    assert collectData(package, db_file=db_file, incremental=True).reused_analysis
+    assert not collectData(package, db_file=db_file).reused_analysis
+
+
+def test_long_chain_index(make_package, tmp_path):
+    # Each step reaches every one after it, the index only keeps the calls between them
+    chain_length = 300
+    source = "".join(f"def step{n}():\n    return step{n + 1}()\n\n" for n in range(chain_length))
+    source += f"def step{chain_length}():\n    pass\n"
+    conn = collectData(make_package({"chain.py": source}), db_file=str(tmp_path / "index.db")).getSqliteConnection()
+    entityIDs = {row[0]: row[1] for row in conn.execute("SELECT entity_name, entityID FROM Entities;")}
+    for n in [0, 150, chain_length]:
+        select = str(entityIDs[f"step{n}"])
+        assert generateEntityResults_indexed(conn, select) == generateEntityResults_selectID_object(conn, select_entity_id=select)
+    assert conn.execute("SELECT count(*) FROM ComponentCalls;").fetchone()[0] == chain_length
+    assert generateEntityResults_indexed(conn, f"{entityIDs['step0']},999999") == generateEntityResults_indexed(conn, str(entityIDs["step0"]))
+
+
+def test_index_from_schema_3_is_rebuilt(make_package, tmp_path):
+    db_file = str(tmp_path / "index.db")
+    conn = collectData(make_package({"graph.py": SOURCE}), db_file=db_file).getSqliteConnection()
+    leaf = conn.execute("SELECT entityID FROM Entities WHERE entity_name = 'leaf';").fetchone()[0]
+    expected = generateEntityResults_selectID_object(conn, select_entity_id=str(leaf))
+    generateEntityResults_indexed(conn, str(leaf))
+    conn.close()
+
+    # What version 3 left behind: the closures in ComponentReach, and no ComponentCalls
+    old = sqlite3.connect(db_file)
+    old.execute("DROP TABLE ComponentCalls;")
+    old.execute("CREATE TABLE ComponentReach (componentID INTEGER PRIMARY KEY NOT NULL, reaches TEXT, reached_by TEXT);")
+    old.execute("INSERT INTO ComponentReach VALUES (0, '[]', '[]');")
+    old.execute("PRAGMA user_version = 3;")
+    old.commit()
+    old.close()
+
+    conn = callFlowData(db_file).getSqliteConnection()
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+    assert "ComponentReach" not in tables and "ComponentCalls" in tables
+    assert conn.execute("SELECT count(*) FROM RunSettings WHERE setting_name = ?;", (REACH_INDEX_SETTING, )).fetchone()[0] == 0
+    assert not reachabilityIndexIsCurrent(conn)
+    assert generateEntityResults_indexed(conn, str(leaf)) == expected
@@ -0,0 +1,108 @@
+import pytest
+
+from pycallflow.callflow import collectData
+from pycallflow.rollupResults import generateRollupResults_object, generateRollupResults_selectID_object
+
+FILES = {
+    "shapes.py": """
+        class Shape:
+            def area(self):
+                return 0
+
+            def describe(self):
+                return self.area()
+
+        def make():
+            return Shape()
+    """,
+    "sub/__init__.py": "",
+    "sub/report.py": """
+        from ..shapes import make
+
+        def report():
+            shape = make()
+            return shape.describe() + shape.describe()
+
+        def area():
+            return 1
+    """,
+}
+
+
+@pytest.fixture
+def rollup(make_package):
+    """
+    Returns rollup(granularity, **kwargs), the results with the groups keyed by name
+    """
+    package = make_package(FILES)
+    conn = collectData(package).getSqliteConnection()
+
+    def run(granularity, select=None, **kwargs):
+        if select is not None:
+            select = ",".join(str(conn.execute("SELECT entityID FROM Entities WHERE entity_name = ?;", (name, )).fetchone()[0])
+                              for name in select)
+        results = generateRollupResults_selectID_object(conn, granularity, select, **kwargs)
+        assert not conn.in_transaction
+        named = {}
+        for v in results.values():
+            name = v["name"].replace(package, "pkg")
+            named[name] = dict(v, calls={results[to_id]["name"].replace(package, "pkg"): weight
+                                         for to_id, weight in v["calls"].items()})
+            if named[name]["file_import_path"] is not None:
+                named[name]["file_import_path"] = v["file_import_path"].replace(package, "pkg")
+        return named
+
+    run.conn = conn
+    return run
+
+
+def summary(named):
+    return {name: (v["entities"], v["selected"], v["calls"]) for name, v in named.items()}
+
+
+def test_file_groups(rollup):
+    # describe's self.area() is one call site, even though it could be either area()
+    assert summary(rollup("file")) == {
+        "pkg.shapes": (4, False, {"pkg.shapes": 2, "pkg.sub.report": 1}),
+        "pkg.sub.report": (2, False, {"pkg.shapes": 3}),
+    }
+    assert all(v["file_import_path"] is None for v in rollup("file").values())
+
+
+def test_package_groups(rollup):
+    assert summary(rollup("package")) == {
+        "pkg": (4, False, {"pkg": 2, "pkg.sub": 1}),
+        "pkg.sub": (2, False, {"pkg": 3}),
+    }
+
+
+def test_class_groups(rollup):
+    named = rollup("class")
+    assert summary(named) == {
+        "Shape:": (3, False, {"Shape:": 1, "area()": 1}),
+        "make()": (1, False, {"Shape:": 1}),
+        "report()": (1, False, {"make()": 1, "Shape:": 2}),
+        "area()": (1, False, {}),
+    }
+    assert named["Shape:"]["file_import_path"] == "pkg.shapes"
+    assert named["area()"]["file_import_path"] == "pkg.sub.report"
+    # make()'s reference to the class goes, the method calls into it stay
+    assert summary(rollup("class", suppress_class_references=True))["make()"] == (1, False, {})
+    assert summary(rollup("class", suppress_class_references=True))["report()"] == (1, False, {"make()": 1, "Shape:": 2})
+
+
+def test_selected_groups(rollup):
+    assert summary(rollup("class", select=["make"])) == {
+        "Shape:": (1, False, {}),
+        "make()": (1, True, {"Shape:": 1}),
+        "report()": (1, False, {"make()": 1}),
+    }
+    assert summary(rollup("file", select=["make"], max_depth_up=0)) == {
+        "pkg.shapes": (2, True, {"pkg.shapes": 1}),
+    }
+
+
+def test_unknown_granularity(rollup):
+    with pytest.raises(ValueError):
+        generateRollupResults_object(rollup.conn, "module")
+    assert not rollup.conn.in_transaction
@@ -0,0 +1,97 @@
+import os
+import time
+
+import pytest
+
+from pycallflow import sandboxAnalysis
+from pycallflow.callflow import collectData
+
+GOOD_FILES = {
+    "a_good.py": """
+        from .z_good import helper
+
+        def caller():
+            return helper()
+    """,
+    "z_good.py": """
+        def helper():
+            return 1
+    """,
+}
+
+
+def sandboxed(make_package, capsys, bad_file, **settings):
+    """
+    Analyzes the good files and bad_file in the sandbox, returns (entity names, calls, stderr)
+    """
+    package = make_package(dict(GOOD_FILES, **{"bad.py": bad_file}))
+    conn = collectData(package, sandbox=True, **settings).getSqliteConnection()
+    names = {row[0] for row in conn.execute("SELECT entity_name FROM Entities;")}
+    calls = {tuple(row) for row in conn.execute("""
+        SELECT caller.entity_name, called.entity_name
+        FROM Calls
+        JOIN Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """)}
+    return names, calls, capsys.readouterr().err
+
+
+def test_import_that_hangs_times_out(make_package, capsys):
+    started = time.monotonic()
+    names, calls, err = sandboxed(make_package, capsys, """
+        import time
+
+        def never_saved():
+            pass
+
+        time.sleep(60)
+    """, jobs=2, import_timeout=1)
+    assert time.monotonic() - started < 30
+    assert "bad.py because importing it took longer than 1 seconds" in err
+    assert "Skipped 1 files that timed out" in err
+    assert names == {"caller", "helper"}
+    assert calls == {("caller", "helper")}
+
+
+@pytest.mark.skipif(sandboxAnalysis.resource is None or not os.path.exists("/proc/self/statm"),
+                    reason="needs RLIMIT_AS and /proc to limit the children's memory")
+def test_import_over_the_memory_limit(make_package, capsys):
+    names, calls, err = sandboxed(make_package, capsys, """
+        def never_saved():
+            pass
+
+        hog = bytearray(2 * 1024 ** 3)
+    """, import_memory_limit=100)
+    assert "bad.py because MemoryError" in err
+    assert names == {"caller", "helper"}
+    assert calls == {("caller", "helper")}
+
+
+def test_import_process_that_dies(make_package, capsys):
+    names, calls, err = sandboxed(make_package, capsys, """
+        import os
+
+        def gone():
+            pass
+
+        os._exit(3)
+    """, jobs=2)
+    assert "bad.py because its import process exited with code 3" in err
+    assert "Skipped 1 files that timed out or whose import process died" in err
+    assert names == {"caller", "helper"}
+    assert calls == {("caller", "helper")}
+
+
+def test_children_leave_the_parent_alone(make_package, capsys):
+    # What the analyzed code does at import time stays in its own process
+    names, _, err = sandboxed(make_package, capsys, """
+        import os
+
+        os.environ["CFTEST_SANDBOX_LEAK"] = "1"
+
+        def kept():
+            pass
+    """)
+    assert err == ""
+    assert names == {"caller", "helper", "kept"}
+    assert "CFTEST_SANDBOX_LEAK" not in os.environ
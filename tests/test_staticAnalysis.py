@@ -0,0 +1,163 @@
+import ast
+import json
+import sys
+
+import pytest
+
+from pycallflow.bytecodeScanner import bytecodeScanner
+from pycallflow.callflow import collectData
+from pycallflow.staticAnalysis import collectCallNames, findStaticTarget
+
+FILES = {
+    "shapes.py": """
+        import math
+        import sys
+        from collections import OrderedDict as OD
+
+        UNITS = ("cm", "m")
+
+
+        class Shape:
+            \"\"\"Not loaded\"\"\"
+            def __init__(self, name):
+                self.name = name
+
+            def area(self):
+                return 0
+
+            @property
+            def label(self):
+                return self.name.title()
+
+            def describe(self, units="cm"):
+                if units in ("mm", "cm"):
+                    return f"{self.name} {self.area()} {units}"
+                return OD(name=self.name, area=math.floor(self.area()))
+
+
+        class Square(Shape):
+            def __init__(self, side):
+                super().__init__("square")
+                self.side = side
+
+            def area(self):
+                return self.side ** 2
+
+
+        if sys.version_info < (3, ):
+            def dumps(obj):
+                return str(obj)
+    """,
+    "report.py": """
+        from .shapes import Square, Shape
+
+        def report(sides, key=lambda square: square.area()):
+            def line(square):
+                return square.describe()
+            squares = sorted((Square(side) for side in sides), key=key)
+            return [line(square) for square in squares] + [Shape("x").area()]
+
+        class Printer:
+            class Inner:
+                def show(self):
+                    print(report([1, 2, 3]))
+    """,
+}
+
+
+def dbRows(conn):
+    return [
+        [tuple(row) for row in conn.execute(stmt)]
+        for stmt in [
+            "SELECT fileID, package_path FROM Files ORDER BY fileID;",
+            "SELECT entityID, fileID, entity_name, entity_type, import_path, member_of_class FROM Entities ORDER BY entityID;",
+            "SELECT entityID, called_entity_ID, collision_num FROM Calls ORDER BY entityID, called_entity_ID, collision_num;",
+        ]
+    ]
+
+
+def callNames(conn):
+    # Only the names, the ast is walked in roughly (not exactly) the order the bytecode loads them
+    return {entityID: set(json.loads(call_names)) - {".0"} for entityID, call_names in
+            conn.execute("SELECT entityID, call_names FROM EntityCallNames;")}
+
+
+def test_static_matches_import(make_package):
+    package = make_package(FILES)
+    static_conn = collectData(package, static=True).getSqliteConnection()
+    import_conn = collectData(package).getSqliteConnection()
+    static_rows, import_rows = dbRows(static_conn), dbRows(import_conn)
+    assert static_rows[0] == import_rows[0]
+    assert static_rows[2] == import_rows[2]
+    # Unlike an import, the static engine can't tell which branch of an if runs
+    dumps = [row[0] for row in static_rows[1] if row[2] == "dumps"]
+    assert [row for row in static_rows[1] if row[0] not in dumps] == import_rows[1]
+    static_names = callNames(static_conn)
+    assert [static_names.pop(entityID) for entityID in dumps] == [{"str", "obj"}]
+    assert static_names == callNames(import_conn)
+    names = {row[2] for row in static_rows[1]}
+    assert {"Shape", "Square", "describe", "report", "Printer", "Inner", "show"} <= names
+    assert "label" not in names
+
+
+def test_nothing_is_imported(make_package, tmp_path):
+    marker = tmp_path / "imported"
+    package = make_package({
+        "side_effect.py": f"""
+            open({str(marker)!r}, "w").close()
+            raise SystemExit("imported")
+
+            def quiet():
+                return loud()
+
+            def loud():
+                pass
+        """,
+    })
+    conn = collectData(package, static=True).getSqliteConnection()
+    assert not marker.exists()
+    assert not any(name.split(".")[0] == package for name in sys.modules)
+    calls = {tuple(row) for row in conn.execute("""
+        SELECT caller.entity_name, called.entity_name
+        FROM Calls
+        JOIN Entities AS caller ON Calls.entityID=caller.entityID
+        JOIN Entities AS called ON Calls.called_entity_ID=called.entityID;
+    """)}
+    assert calls == {("quiet", "loud")}
+
+
+def test_subpackage_target(make_package, tmp_path):
+    marker = tmp_path / "imported"
+    package = make_package({
+        "__init__.py": f"open({str(marker)!r}, 'w').close()\n",
+        "inner/__init__.py": f"open({str(marker)!r}, 'w').close()\n",
+        "inner/mod.py": "def found():\n    pass\n",
+        "inner/space/mod.py": "def spaced():\n    pass\n",
+        "inner/single.py": "",
+    })
+    target = findStaticTarget(f"{package}.inner")
+    assert target.__path__ == [str(tmp_path / package / "inner")]
+    # A directory without an __init__.py is a namespace package
+    assert findStaticTarget(f"{package}.inner.space").__path__ == [str(tmp_path / package / "inner" / "space")]
+    for not_a_package in [f"{package}.inner.single", f"{package}.inner.missing", f"{package}.missing.mod", "cftest_no_such_pkg.inner"]:
+        with pytest.raises(ModuleNotFoundError):
+            findStaticTarget(not_a_package)
+    conn = collectData(f"{package}.inner", static=True).getSqliteConnection()
+    assert {row[0] for row in conn.execute("SELECT entity_name FROM Entities;")} == {"found", "spaced"}
+    assert not marker.exists()
+    assert not any(name.split(".")[0] == package for name in sys.modules)
+
+
+@pytest.mark.parametrize("source", [
+    "def f(a):\n    return [x.y for x in a if x not in ['p', 'q', 'r']]\n",
+    "def f(a, b=max, *, c=min):\n    import os.path as osp\n    return osp.join(a, {'k': b(c)})\n",
+    "def f(a):\n    import xml.etree.ElementTree as ET\n    return ET.parse(a, parser=lambda: ET.XMLParser())\n",
+    "def f():\n    def g(x=len):\n        return x('abc')\n    return g() + sum(i for i in range(3))\n",
+    "def f(n):\n    while n:\n        n -= 1\n    else:\n        raise ValueError('done')\n",
+])
+def test_call_names_match_bytecode(source):
+    namespace = {}
+    exec(compile(source, "<test>", "exec"), namespace)
+    static_names = {name for name in collectCallNames(ast.parse(source).body[0]) if isinstance(name, str)}
+    bytecode_names = {name for name in bytecodeScanner().callNames(namespace["f"]) if isinstance(name, str)}
+    assert static_names == bytecode_names - {".0"}